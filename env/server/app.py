@@ -1,10 +1,15 @@
 import os, sys
-import pickle, queue, atexit, json, logging, copy, datetime
-from threading import Lock, Event
-from env.server.utils import ThreadSafeSet, ThreadSafeDict
+import pickle, atexit, json, logging, copy
+from time import perf_counter
+from threading import Lock
+from env.server.utils import ThreadSafeDict
 from flask import Flask, render_template, jsonify, request, send_file, send_from_directory
 from flask_socketio import SocketIO, join_room, leave_room, emit, rooms
-from env.server.game import OvercookedGame, Game
+from env.server.game import Game
+from env.server.game_server import GameServer, get_room, get_agent_names
+from env.server.log_writer import get_log_writer, close_log_writers
+from env.server.scheduler import TickScheduler
+from env.server.npc_executor import make_npc_executor
 import env.server.game
 import os
 import ast
@@ -13,12 +18,6 @@ import ast
 # Globals #
 ###########
 
-thread_event = Event()
-
-smm = None
-paused = False
-pause_time = 0
-
 # Read in global config
 CONF_PATH = './env/server/config.json'
 with open(CONF_PATH, 'r') as f:
@@ -31,31 +30,24 @@ MAX_GAME_LENGTH = CONFIG['MAX_GAME_LENGTH']  # Maximum allowable game length (in
 AGENT_DIR = CONFIG['AGENT_DIR']  # Path to where pre-trained agents will be stored on server
 MAX_GAMES = CONFIG['MAX_GAMES']  # Maximum number of games that can run concurrently. Contrained by available memory and CPU
 MAX_FPS = CONFIG['MAX_FPS']  # Frames per second cap for serving to client
-FREE_IDS = queue.Queue(maxsize=MAX_GAMES)  # Global queue of available IDs. This is how we sync game creation and keep track of how many games are in memory
-FREE_MAP = ThreadSafeDict()  # Bitmap that indicates whether ID is currently in use. Game with ID=i is "freed" by setting FREE_MAP[i] = True
-
-USER_ID = "user"
-
-# Initialize our ID tracking data
-for i in range(MAX_GAMES):
-    FREE_IDS.put(i)
-    FREE_MAP[i] = True
-
-GAMES = ThreadSafeDict()  # Mapping of game-id to game objects
-ACTIVE_GAMES = ThreadSafeSet()  # Set of games IDs that are currently being played
-WAITING_GAMES = queue.Queue()  # Queue of games IDs that are waiting for additional players to join. Note that some of these IDs might be stale (i.e. if FREE_MAP[id] = True)
+MAX_TICK_WORKERS = CONFIG.get('MAX_TICK_WORKERS', 4)  # Number of threads that run the tick loops of all games. Constrained by available CPU
+BINARY_TRANSPORT = CONFIG.get('binary_transport', True)  # Whether clients may negotiate binary state_pong payloads, see binary_codec.py
+NPC_EXECUTOR_STRATEGY = CONFIG.get('npc_executor', 'threads')  # How the NPC policies run: "inline" in the tick, on a shared pool of "threads", or on worker "processes"
+NPC_WORKERS = CONFIG.get('npc_workers', 4)  # Number of threads or processes that run the NPC policies of all games
+
+# The games, players and sessions of the server, see GameServer
+SERVER = GameServer(
+    MAX_GAMES,
+    keyframe_interval=CONFIG.get('keyframe_interval', 50),  # Number of ticks between full states in the delta-encoded state_pong, see StateDeltaEncoder
+    log_writer=CONFIG.get('log_writer', {}),  # Parameters of the session log writers, see LogWriter
+    metrics_path=CONFIG.get('metrics_path', None),  # Folder the tick loop metrics of each game are written to at the end of the game, None to not write them
+    live_smm=CONFIG.get('live_smm', False),  # Whether to run the SMMs live during games and send their belief states to the client
+)
 USERS = ThreadSafeDict()  # Mapping of users to locks associated with the ID. Enforces user-level serialization
-USER_ROOMS = ThreadSafeDict()  # Mapping of user id's to the current game (room) they are in
-
-GAME_TIME = 0  # stores the current game time
-LAYOUT = ""  # stores the current game layout
+TICK_SCHEDULER = TickScheduler(MAX_TICK_WORKERS)  # Runs the tick loops of all games on a shared pool of workers
+NPC_EXECUTOR = make_npc_executor(NPC_EXECUTOR_STRATEGY, NPC_WORKERS, fps=MAX_FPS)  # Runs the NPC policies of all games
 
-# Mapping of string game names to corresponding classes
-GAME_NAME_TO_CLS = {
-    "overcooked" : OvercookedGame,
-}
-
-env.server.game._configure(MAX_GAME_LENGTH, AGENT_DIR, CONFIG["visibility"], CONFIG["visibility_range"])
+env.server.game._configure(MAX_GAME_LENGTH, AGENT_DIR, CONFIG["visibility"], CONFIG["visibility_range"], npc_executor=NPC_EXECUTOR)
 
 #######################
 # Flask Configuration #
@@ -75,94 +67,18 @@ app.logger.addHandler(handler)
 # Global Coordination Functions #
 #################################
 
-def timestamp():
-    return int(datetime.datetime.timestamp(datetime.datetime.now()))
-
-def try_create_game(game_name ,**kwargs):
+def start_game_loop(game, session=None, smm=None):
     """
-    Tries to create a brand new Game object based on parameters in `kwargs`
-
-    Returns (Game, Error) that represent a pointer to a game object, and error that occured
-    during creation, if any. In case of error, `Game` returned in None. In case of sucess,
-    `Error` returned is None
-
-    Possible Errors:
-        - Runtime error if server is at max game capacity
-        - Propogate any error that occured in game __init__ function
+    Starts the tick loop of an activated game on the tick scheduler
     """
-
-    # remove all previous games
-    thread_event.clear()
-    ids = [x for x in GAMES.keys()]
-    for game_id in ids:
-        GAMES[game_id].status = Game.Status.DONE
-        print("REMOVED GAME")
-
-    # create the game
-    try:
-        curr_id = FREE_IDS.get(block=False)
-        assert FREE_MAP[curr_id], "Current id is already in use"
-        game_cls = GAME_NAME_TO_CLS.get(game_name, OvercookedGame)
-        game = game_cls(id=curr_id, **kwargs)
-
-    except queue.Empty:
-        err = RuntimeError("Server at max capacity")
-        return None, err
-    except Exception as e:
-        return None, e
-    else:
-        GAMES[game.id] = game
-        FREE_MAP[game.id] = False
-        return game, None
+    SERVER.start_game(game, MAX_FPS)
+    TICK_SCHEDULER.start(play_game(game, session=session, smm=smm, fps=MAX_FPS))
 
 def cleanup_game(game):
-    if FREE_MAP[game.id]:
-        raise ValueError("Double free on a game")
-
-    # User tracking
-    for user_id in game.players:
-        leave_curr_room(user_id)
+    SERVER.cleanup_game(game)
 
     # Socketio tracking
-    socketio.close_room(game.id)
-
-    # Game tracking
-    FREE_MAP[game.id] = True
-    FREE_IDS.put(game.id)
-    del GAMES[game.id]
-    if game.id in ACTIVE_GAMES:
-        ACTIVE_GAMES.remove(game.id)
-
-def get_game(game_id):
-    return GAMES.get(game_id, None)
-
-def get_curr_game(user_id):
-    return get_game(get_curr_room(user_id))
-
-def get_curr_room(user_id):
-    return USER_ROOMS.get(user_id, None)
-
-def set_curr_room(user_id, room_id):
-    USER_ROOMS[user_id] = room_id
-
-def leave_curr_room(user_id):
-    del USER_ROOMS[user_id]
-
-def get_waiting_game():
-    """
-    Return a pointer to a waiting game, if one exists
-
-    Note: The use of a queue ensures that no two threads will ever receive the same pointer, unless
-    the waiting game's ID is re-added to the WAITING_GAMES queue
-    """
-    try:
-        waiting_id = WAITING_GAMES.get(block=False)
-        while FREE_MAP[waiting_id]:
-            waiting_id = WAITING_GAMES.get(block=False)
-    except queue.Empty:
-        return None
-    else:
-        return get_game(waiting_id)
+    socketio.close_room(get_room(game.id))
 
 
 ##########################
@@ -180,7 +96,7 @@ def  _leave_game(user_id):
     game after `user_id` is removed
     """
     # Get pointer to current game if it exists
-    game = get_curr_game(user_id)
+    game = SERVER.get_curr_game(user_id)
 
     if not game:
         # Cannot leave a game if not currently in one
@@ -189,80 +105,36 @@ def  _leave_game(user_id):
     # Acquire this game's lock to ensure all global state updates are atomic
     with game.lock:
         # Update socket state maintained by socketio
-        leave_room(game.id)
+        leave_room(get_room(game.id))
 
-        # Update user data maintained by this app
-        leave_curr_room(user_id)
-
-        # Update game state maintained by game object
-        if user_id in game.players:
-            game.remove_player(user_id)
-        else:
-            game.remove_spectator(user_id)
-
-        # Whether the game was active before the user left
-        was_active = game.id in ACTIVE_GAMES
+        was_active = SERVER.leave_game(game, user_id)
 
         # Rebroadcast data and handle cleanup based on the transition caused by leaving
-        if was_active and game.is_empty():
-            # Active -> Empty
-            game.deactivate()
-        elif game.is_empty():
+        if not was_active and game.is_empty():
             # Waiting -> Empty
             cleanup_game(game)
         elif not was_active:
             # Waiting -> Waiting
-            emit('waiting', { "in_game" : True }, room="jack")
-        elif was_active and game.is_ready():
-            # Active -> Active
-            pass
-        elif was_active and not game.is_empty():
-            # Active -> Waiting
-            game.deactivate()
+            emit('waiting', { "in_game" : True }, room=get_room(game.id))
 
     return was_active
 
-def _create_game(user_id, game_name, params={}, smm=None):
-    global game_thread
+def _create_game(user_id, game_name, params={}, smm=None, session=None):
     print("Socket Create Game")
     print("_create_game params", params)
-    game, err = try_create_game(game_name, **params)
+    game, err = SERVER.try_create_game(game_name, session=session, **params)
     if not game:
-        socketio.emit("creation_failed", { "error" : err.__repr__() })
+        socketio.emit("creation_failed", { "error" : err.__repr__() }, room=user_id)
         return
-    spectating = True
     with game.lock:
-        if not game.is_full():
-            spectating = False
-            game.add_player(user_id)
-            print("Added human player", user_id, game.human_players)
-        else:
-            spectating = True
-            game.add_spectator(user_id)
-            print("Added spectator", user_id)
-        join_room(game.id)
-        set_curr_room(user_id, game.id)
-        print("Game is ready?", game.is_ready(), game.is_full())
-        if game.is_ready():
-            folder = os.path.join(os.getcwd(), "env/server/layouts")
-            curr_layout = game.layouts.pop()
-            # load the layout and use it to initialize the SMM
-            with open(folder + "/" + curr_layout + ".layout", "r") as f:
-                lines = f.read()
-            print("Activating!", game.human_players, game.npc_players, game.players)
-            game.activate(curr_layout=curr_layout, folder=folder)
-            ACTIVE_GAMES.add(game.id)
-            socketio.emit('start_game', { "spectating" : spectating, "start_info" : game.to_json()}, room="jack")
+        spectating = SERVER.add_user(game, user_id)
+        join_room(get_room(game.id))
+        activated, smm = SERVER.activate_created_game(game, smm=smm)
+        if activated:
+            socketio.emit('start_game', { "spectating" : spectating, "start_info" : game.to_json()}, room=get_room(game.id))
+            start_game_loop(game, session=session, smm=smm)
         else:
-            WAITING_GAMES.put(game.id)
-            socketio.emit('waiting', { "in_game" : True }, room="jack")
-
-    thread_event.set()
-    game_thread = socketio.start_background_task(play_game, game, smm=smm, fps=MAX_FPS)
-
-# utility function for getting agent names
-def get_agent_names():
-    return [d for d in os.listdir(AGENT_DIR) if os.path.isdir(os.path.join(AGENT_DIR, d))]
+            socketio.emit('waiting', { "in_game" : True }, room=get_room(game.id))
 
 ######################
 # Application routes #
@@ -273,35 +145,15 @@ def get_agent_names():
 
 @app.route('/')
 def index():
-    # reset all global variables
-    global paused, pause_time, GAMES, ACTIVE_GAMES, WAITING_GAMES, USERS, USER_ROOMS, GAME_TIME, LAYOUT, thread_event, FREE_IDS, FREE_MAP, USER_ID
-    USER_ID = request.args.get("user_id")
+    user_id = request.args.get("user_id")
 
-    if USER_ID is None:
+    if user_id is None:
         return "Missing user ID, please reload this page with the user_id parameter"
 
-    paused = False
-    pause_time = 0
-    thread_event = Event()
-    GAMES = ThreadSafeDict()
-    ACTIVE_GAMES = ThreadSafeSet()
-    WAITING_GAMES = queue.Queue()
-    USERS = ThreadSafeDict()
-    USER_ROOMS = ThreadSafeDict()
-    GAME_TIME = 0
-    LAYOUT = "RSMM1"
-    FREE_IDS = queue.Queue(maxsize=MAX_GAMES)  # Global queue of available IDs. This is how we sync game creation and keep track of how many games are in memory
-    FREE_MAP = ThreadSafeDict()  # Bitmap that indicates whether ID is currently in use. Game with ID=i is "freed" by setting FREE_MAP[i] = True
-
-    # Initialize our ID tracking data
-    for i in range(MAX_GAMES):
-        FREE_IDS.put(i)
-        FREE_MAP[i] = True
-
-    env.server.game._configure(MAX_GAME_LENGTH, AGENT_DIR, CONFIG["visibility"], CONFIG["visibility_range"])
-
-    socketio.emit('end_game', { "status" : Game.Status.DONE }, room="jack")
-    agent_names = get_agent_names()
+    # start the participant's session over, ending the game of their previous page. Other sessions are not affected
+    SERVER.restart_session(user_id)
+
+    agent_names = get_agent_names(AGENT_DIR)
     return render_template('index.html', agent_names=agent_names, layouts=LAYOUTS)
 
 @app.route('/consent-form')
@@ -311,39 +163,30 @@ def download_consent_form():
 
 @app.route('/log', methods=["POST"])
 def log():
-    with open(f"env/server/logs/{USER_ID}.txt", "a") as f:
-        f.write(str(request.get_json()) + "\n")
+    data = request.get_json()
+    if data.get("user", None) is None:
+        return "Missing user", 400
+    get_log_writer(str(data["user"]), **SERVER.log_writer).write(data)
     return ""
 
 @app.route("/level", methods=["POST"])
 def set_level():
-    global LAYOUT, GAME_TIME
     level = request.get_json()
+    if level.get("user_id", None) is None:
+        return "Missing user ID", 400
+    session = SERVER.get_session(str(level["user_id"]))
     if "level" in level:
         level = level["level"]
 
-    if level == "intro":
-        LAYOUT = "RSMM1"
-        GAME_TIME = 60
-    elif level == "practice":
-        LAYOUT = "RSMM2"
-        GAME_TIME = 93
-    elif level == "round1":
-        LAYOUT = "RSMM3"
-        GAME_TIME = 93
-    elif level == "round2":
-        LAYOUT = "RSMM4"
-        GAME_TIME = 93
-    elif level == "round3":
-        LAYOUT = "RSMM5"
-        GAME_TIME = 93
-    elif level == "round4":
-        LAYOUT = "RSMM6"
-        GAME_TIME = 93
-
-    print("Setting level to", level, LAYOUT)
-
-    return jsonify({"layout": LAYOUT})
+    layout = session.set_stage(level)
+    print("Setting level of", session.user_id, "to", level, layout)
+
+    return jsonify({"layout": layout})
+
+@app.route('/metrics')
+def metrics():
+    # rolling per-phase timings of the tick loop of each running game, in milliseconds
+    return jsonify({ "scheduler" : TICK_SCHEDULER.get_stats(), "npc" : NPC_EXECUTOR.get_stats(), "games" : SERVER.get_game_metrics() })
 
 @app.route('/favicon.ico')
 def favicon():
@@ -358,24 +201,21 @@ def favicon():
 def on_create(data):
     print("Creating Game!")
     user_id = request.sid
+    if data.get("user_id", None) is None:
+        socketio.emit("creation_failed", { "error" : "Missing user ID" }, room=user_id)
+        return
+    session = SERVER.get_session(str(data["user_id"]))
+    SERVER.identify_socket(user_id, session)
     with USERS[user_id]:
         # Retrieve current game if one exists
-        curr_game = get_curr_game(user_id)
+        curr_game = SERVER.get_curr_game(user_id)
         if curr_game:
             # Cannot create if currently in a game
             return
-        params = data.get('params', {})
-        #hardcoded since there is no input for toggling this flag
-        #defnitely want to change this in the future
-        params["num_players"] = 2  # change this to set the number of players in the game
-        params["mdp_params"] = {"old_dynamics":True}
-        params["layout"] = LAYOUT + ".layout"
-        params["layouts"] = [LAYOUT]
-        print("    game layout to " + LAYOUT + ".layout")
-        params["gameTime"] = str(GAME_TIME)
+        params = SERVER.get_create_params(session, data.get('params', {}))
         print("Params", params)
         game_name = data.get('game_name', 'overcooked')
-        _create_game(user_id, game_name, params, smm=smm)
+        _create_game(user_id, game_name, params, session=session)
 
 @socketio.on('join')
 def on_join(data):
@@ -383,39 +223,33 @@ def on_join(data):
     with USERS[user_id]:
         create_if_not_found = data.get("create_if_not_found", True)
         # Retrieve current game if one exists
-        curr_game = get_curr_game(user_id)
+        curr_game = SERVER.get_curr_game(user_id)
         if curr_game:
             # Cannot join if currently in a game
             return
         # Retrieve a currently open game if one exists
-        game = get_waiting_game()
+        game = SERVER.get_waiting_game()
         if not game and create_if_not_found:
             # No available game was found so create a game
             params = data.get('params', {})
             game_name = data.get('game_name', 'overcooked')
-            _create_game(user_id, game_name, params)
+            _create_game(user_id, game_name, params, session=SERVER.get_socket_session(user_id))
             return
         elif not game:
             # No available game was found so start waiting to join one
-            socketio.emit('waiting', { "in_game" : False })
+            socketio.emit('waiting', { "in_game" : False }, room=user_id)
         else:
             # Game was found so join it
             with game.lock:
-                join_room(game.id)
-                set_curr_room(user_id, game.id)
-                game.add_player(user_id)
-                if game.is_ready():
+                join_room(get_room(game.id))
+                activated, session = SERVER.join_game(game, user_id)
+                if activated:
                     # Game is ready to begin play
-                    game.activate()
-                    ACTIVE_GAMES.add(game.id)
-                    socketio.emit('start_game', { "spectating" : False, "start_info" : game.to_json()}, room="jack")
-                    thread_event.set()
-                    global game_thread
-                    game_thread = socketio.start_background_task(play_game, game)
+                    socketio.emit('start_game', { "spectating" : False, "start_info" : game.to_json()}, room=get_room(game.id))
+                    start_game_loop(game, session=session)
                 else:
                     # Still need to keep waiting for players
-                    WAITING_GAMES.put(game.id)
-                    socketio.emit('waiting', { "in_game" : True }, room="jack")
+                    socketio.emit('waiting', { "in_game" : True }, room=get_room(game.id))
 
 @socketio.on('leave')
 def on_leave(data):
@@ -423,24 +257,26 @@ def on_leave(data):
     with USERS[user_id]:
         was_active = _leave_game(user_id)
         if was_active:
-            socketio.emit('end_game', { "status" : Game.Status.DONE, "data" : {}})
+            socketio.emit('end_game', { "status" : Game.Status.DONE, "data" : {}}, room=user_id)
         else:
-            socketio.emit('end_lobby')
+            socketio.emit('end_lobby', room=user_id)
 
 @socketio.on('pause')
 def on_pause(data):
-    global paused
-    paused = bool(data)
-    return
+    SERVER.pause_session(request.sid, data)
+
+@socketio.on('transport')
+def on_transport(data):
+    return SERVER.negotiate_transport(request.sid, data, binary_transport=BINARY_TRANSPORT)
+
+@socketio.on('keyframe_request')
+def on_keyframe_request(data):
+    # the client missed a state_pong and can not apply the following deltas
+    SERVER.request_keyframe(request.sid)
 
 @socketio.on('action')
 def on_action(data):
-    user_id = request.sid
-    action = data['action']
-    game = get_curr_game(user_id)
-    if not game:
-        return
-    game.enqueue_action(user_id, action)
+    SERVER.enqueue_action(request.sid, data['action'])
 
 @socketio.on('connect')
 def on_connect():
@@ -448,7 +284,6 @@ def on_connect():
     if user_id in USERS:
         return
     USERS[user_id] = Lock()
-    join_room("jack")
 
 @socketio.on('disconnect')
 def on_disconnect():
@@ -459,80 +294,75 @@ def on_disconnect():
     with USERS[user_id]:
         _leave_game(user_id)
     del USERS[user_id]
+    SERVER.remove_socket(user_id)
 
 # Exit handler for server
 def on_exit():
     # Force-terminate all games on server termination
-    for game_id in GAMES:
-        socketio.emit('end_game', { "status" : Game.Status.INACTIVE, "data" : get_game(game_id).get_data() }, room="jack")
+    for game_id, game in list(SERVER.games.items()):
+        socketio.emit('end_game', { "status" : Game.Status.INACTIVE, "data" : game.get_data() }, room=get_room(game_id))
+    # Write the remaining log records
+    close_log_writers()
+    # Stop the NPC workers
+    NPC_EXECUTOR.shutdown()
 
 
 #############
 # Game Loop #
 #############
 
-def play_game(game, smm=None, fps=10):
+def emit_state_pong(game, message):
+    """
+    Sends a state_pong message to the clients of a game, encoded once per transport: binary payloads to the clients
+    that negotiated the binary transport, JSON to the rest of the game's room
     """
-    Asynchronously apply real-time game updates and broadcast state to all clients currently active
-    in the game. Note that this loop must be initiated by a parallel thread for each active game
+    binary_users, payload, send_json = SERVER.encode_state_pong(game, message)
+    for user_id in binary_users:
+        socketio.emit('state_pong', payload, room=user_id)
+    if send_json:
+        socketio.emit('state_pong', message, room=get_room(game.id), skip_sid=binary_users)
 
-    game (Game object):     Stores relevant game state. Note that the game id is the same as to socketio
-                            room id for all clients connected to this game
-    fps (int):              Number of game ticks that should happen every second
+def play_game(game, session=None, smm=None, fps=10):
+    """
+    Apply real-time game updates and broadcast state to all clients currently active in the game. This is a task
+    of `TICK_SCHEDULER`: each step runs one tick and yields the number of seconds until the next tick, so the ticks
+    of all games share the scheduler's workers. The loop runs until the game ends or `GameServer.stop_game` is called
+
+    game (Game object):         Stores relevant game state. Note that the game's socketio room (`get_room`) is
+                                derived from the game id for all clients connected to this game
+    session (Session object):   Study session of the game's participant, used for pausing and logging. Games
+                                without a session are not logged and cannot be paused
+    smm (LiveSMM object):       Optional SMMs updated with every tick, their latest belief states are sent with
+                                the state. The models run on their own thread and never slow down the game loop
+    fps (int):                  Number of game ticks that should happen every second
     """
-    global pause_time
+    running = SERVER.game_events[game.id]
+    metrics = game.metrics
     status = Game.Status.ACTIVE
-    old_state = {}
     count = 0
-    while status != Game.Status.DONE and status != Game.Status.INACTIVE and thread_event.is_set():
+    while status != Game.Status.DONE and status != Game.Status.INACTIVE and running.is_set():
         # hold if paused
-        if paused:
-            # if just paused, record the pause time
-            if pause_time == 0:
-                pause_time = timestamp()
-            socketio.sleep(1/fps)
+        if SERVER.hold_paused(game, session):
+            yield 1/fps
             continue
-        # if just unpaused, add to time remaining
-        if pause_time != 0:
-            game.start_time += timestamp() - pause_time
-            pause_time = 0
         # cycle a tick
         count += 1
-        with game.lock:
-            status = game.tick()
+        frame_start = perf_counter()
+        status = SERVER.tick_game(game)
         if status == Game.Status.RESET:
             print("play game but game is in RESET state")
-            with game.lock:
-                data = game.get_data()
-            socketio.emit('reset_game', { "state" : game.to_json(), "timeout" : game.reset_timeout, "data" : data}, room="jack")
-            socketio.sleep(game.reset_timeout/1000)
+            socketio.emit('reset_game', SERVER.get_reset_message(game), room=get_room(game.id))
+            yield game.reset_timeout/1000
         else:
-            state = game.get_state()
-            # log the state
-            with open(f"env/server/logs/{USER_ID}.txt", "a") as f:
-                f.write(str(state) + "\n")
-
-            # convert position tuples to strings for nicer formatting, check 3 layers deep
-            belief_state = {}
-            for item in belief_state:
-                if isinstance(belief_state[item], tuple):
-                    belief_state[item] = str(belief_state[item])
-                if isinstance(belief_state[item], dict):
-                    for prop in belief_state[item]:
-                        if isinstance(belief_state[item][prop], tuple):
-                            belief_state[item][prop] = str(belief_state[item][prop])
-                        if isinstance(belief_state[item][prop], dict):
-                            for subprop in belief_state[item][prop]:
-                                if isinstance(belief_state[item][prop][subprop], tuple):
-                                    belief_state[item][prop][subprop] = str(belief_state[item][prop][subprop])
-            socketio.emit('state_pong', { "state" : state, "smm" : belief_state }, room="jack")
-        socketio.sleep(1/fps)
-
-    print("End game")
-    thread_event.clear()
+            message = SERVER.step_game(game, session=session, smm=smm, tick=count)
+            with metrics.time("emit"):
+                emit_state_pong(game, message)
+            metrics.record("frame", perf_counter() - frame_start)
+        yield 1/fps
+
+    data = SERVER.end_game(game, session=session, smm=smm, ticks=count)
     with game.lock:
-        data = game.get_data()
-        socketio.emit('end_game', { "status" : status, "data" : data }, room="jack")
+        socketio.emit('end_game', { "status" : status, "data" : data }, room=get_room(game.id))
 
         if status != Game.Status.INACTIVE:
             game.deactivate()
@@ -0,0 +1,417 @@
+import os, sys
+import json, logging, mimetypes, asyncio
+from time import perf_counter
+from urllib.parse import parse_qs
+import jinja2
+import socketio
+from env.server.game import Game
+from env.server.game_server import GameServer, get_room, get_agent_names
+from env.server.log_writer import get_log_writer, close_log_writers
+from env.server.scheduler import AsyncTickScheduler
+from env.server.npc_executor import make_npc_executor
+import env.server.game
+
+# The asyncio server: the same study server as app.py, on a single asyncio event loop instead of threads.
+#   Socket.IO runs on python-socketio's ASGI server, and the tick loops of all games run on one fixed-rate clock
+#   (AsyncTickScheduler) that awaits every emit, so one process serves hundreds of sessions without a thread per
+#   game or per user. The routes and socket events are the same as app.py's, so the static client works unchanged.
+#   The games, players and sessions, and the steps of the tick loop, are app.py's GameServer, which is only touched
+#   from the event loop. Only the emits and the sleeps between ticks are awaited here, and the events of each socket
+#   are serialized with an asyncio lock. Run it with `python main.py --async`
+
+###########
+# Globals #
+###########
+
+# Read in global config
+CONF_PATH = './env/server/config.json'
+with open(CONF_PATH, 'r') as f:
+    CONFIG = json.load(f)
+
+LOGFILE = CONFIG['logfile']  # Where errors will be logged
+LAYOUTS = CONFIG['layouts']  # Available layout names
+MAX_GAME_LENGTH = CONFIG['MAX_GAME_LENGTH']  # Maximum allowable game length (in seconds)
+AGENT_DIR = CONFIG['AGENT_DIR']  # Path to where pre-trained agents will be stored on server
+MAX_GAMES = CONFIG['MAX_GAMES']  # Maximum number of games that can run concurrently. Contrained by available memory and CPU
+MAX_FPS = CONFIG['MAX_FPS']  # Frames per second of the shared clock that ticks every game
+BINARY_TRANSPORT = CONFIG.get('binary_transport', True)  # Whether clients may negotiate binary state_pong payloads, see binary_codec.py
+NPC_EXECUTOR_STRATEGY = CONFIG.get('async_npc_executor', 'asyncio')  # How the NPC policies run: awaited on a shared pool of threads ("asyncio"), "inline" in the tick, or on worker "processes"
+NPC_WORKERS = CONFIG.get('npc_workers', 4)  # Number of threads or processes that run the NPC policies of all games
+SERVER_ROOT = os.path.dirname(os.path.abspath(__file__))  # Folder of the server's templates and static files
+STATIC_DIR = os.path.join(SERVER_ROOT, 'static')
+
+# The games, players and sessions of the server, see GameServer
+SERVER = GameServer(
+    MAX_GAMES,
+    keyframe_interval=CONFIG.get('keyframe_interval', 50),  # Number of ticks between full states in the delta-encoded state_pong, see StateDeltaEncoder
+    log_writer=CONFIG.get('log_writer', {}),  # Parameters of the session log writers, see LogWriter
+    metrics_path=CONFIG.get('metrics_path', None),  # Folder the tick loop metrics of each game are written to at the end of the game, None to not write them
+    live_smm=CONFIG.get('live_smm', False),  # Whether to run the SMMs live during games and send their belief states to the client
+)
+USERS = {}  # Mapping of users to locks associated with the ID. Enforces user-level serialization
+TICK_SCHEDULER = AsyncTickScheduler(MAX_FPS)  # Ticks every game on one fixed-rate clock
+NPC_EXECUTOR = make_npc_executor(NPC_EXECUTOR_STRATEGY, NPC_WORKERS, fps=MAX_FPS)  # Runs the NPC policies of all games
+
+env.server.game._configure(MAX_GAME_LENGTH, AGENT_DIR, CONFIG["visibility"], CONFIG["visibility_range"], npc_executor=NPC_EXECUTOR)
+
+######################
+# ASGI Configuration #
+######################
+
+DEBUG = os.getenv('FLASK_ENV', 'production') == 'development'
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*", logger=DEBUG)
+TEMPLATES = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.join(STATIC_DIR, 'templates')), autoescape=True)
+
+# Attach handler for logging errors to file
+logger = logging.getLogger(__name__)
+handler = logging.FileHandler(LOGFILE)
+handler.setLevel(logging.ERROR)
+logger.addHandler(handler)
+
+#################################
+# Global Coordination Functions #
+#################################
+
+def start_game_loop(game, session=None, smm=None):
+    """
+    Starts the tick loop of an activated game on the shared clock
+    """
+    SERVER.start_game(game, MAX_FPS)
+    TICK_SCHEDULER.start(play_game(game, session=session, smm=smm, fps=MAX_FPS))
+
+async def cleanup_game(game):
+    SERVER.cleanup_game(game)
+
+    # Socketio tracking
+    await sio.close_room(get_room(game.id))
+
+
+##########################
+# Socket Handler Helpers #
+##########################
+
+async def _leave_game(user_id):
+    """
+    Removes `user_id` from it's current game, if it exists, see app.py. Returns whether the game was active
+    """
+    # Get pointer to current game if it exists
+    game = SERVER.get_curr_game(user_id)
+
+    if not game:
+        # Cannot leave a game if not currently in one
+        return False
+
+    # Update socket state maintained by socketio
+    await sio.leave_room(user_id, get_room(game.id))
+
+    with game.lock:
+        was_active = SERVER.leave_game(game, user_id)
+
+    # Rebroadcast data and handle cleanup based on the transition caused by leaving
+    if not was_active and game.is_empty():
+        # Waiting -> Empty
+        await cleanup_game(game)
+    elif not was_active:
+        # Waiting -> Waiting
+        await sio.emit('waiting', { "in_game" : True }, room=get_room(game.id))
+
+    return was_active
+
+async def _create_game(user_id, game_name, params={}, smm=None, session=None):
+    print("Socket Create Game")
+    print("_create_game params", params)
+    game, err = SERVER.try_create_game(game_name, session=session, **params)
+    if not game:
+        await sio.emit("creation_failed", { "error" : err.__repr__() }, room=user_id)
+        return
+    with game.lock:
+        spectating = SERVER.add_user(game, user_id)
+    await sio.enter_room(user_id, get_room(game.id))
+    activated, smm = SERVER.activate_created_game(game, smm=smm)
+    if activated:
+        await sio.emit('start_game', { "spectating" : spectating, "start_info" : game.to_json()}, room=get_room(game.id))
+        start_game_loop(game, session=session, smm=smm)
+    else:
+        await sio.emit('waiting', { "in_game" : True }, room=get_room(game.id))
+
+######################
+# Application routes #
+######################
+
+# Plain HTTP requests that are not Socket.IO traffic, routed by `http_app`. Each route takes the query parameters
+# and the request body, and returns (status, content type, body)
+
+async def index(args, body):
+    user_id = args.get("user_id")
+
+    if user_id is None:
+        return 200, "text/html", "Missing user ID, please reload this page with the user_id parameter"
+
+    # start the participant's session over, ending the game of their previous page. Other sessions are not affected
+    SERVER.restart_session(user_id)
+
+    agent_names = get_agent_names(AGENT_DIR)
+    return 200, "text/html", TEMPLATES.get_template('index.html').render(agent_names=agent_names, layouts=LAYOUTS)
+
+async def download_consent_form(args, body):
+    print("Downloading consent form")
+    with open(os.path.join(STATIC_DIR, "pdf", "Consent Form.pdf"), "rb") as f:
+        return 200, "application/pdf", f.read()
+
+async def log(args, body):
+    data = json.loads(body)
+    if data.get("user", None) is None:
+        return 400, "text/html", "Missing user"
+    get_log_writer(str(data["user"]), **SERVER.log_writer).write(data)
+    return 200, "text/html", ""
+
+async def set_level(args, body):
+    level = json.loads(body)
+    if level.get("user_id", None) is None:
+        return 400, "text/html", "Missing user ID"
+    session = SERVER.get_session(str(level["user_id"]))
+    if "level" in level:
+        level = level["level"]
+
+    layout = session.set_stage(level)
+    print("Setting level of", session.user_id, "to", level, layout)
+
+    return 200, "application/json", json.dumps({"layout": layout})
+
+async def metrics(args, body):
+    # rolling per-phase timings of the tick loop of each running game, in milliseconds
+    return 200, "application/json", json.dumps({ "scheduler" : TICK_SCHEDULER.get_stats(), "npc" : NPC_EXECUTOR.get_stats(), "games" : SERVER.get_game_metrics() })
+
+async def favicon(args, body):
+    with open(os.path.join(STATIC_DIR, "favicon.ico"), "rb") as f:
+        return 200, "image/vnd.microsoft.icon", f.read()
+
+async def static(path):
+    # files under the static folder, like flask's static route
+    filename = os.path.realpath(os.path.join(STATIC_DIR, path))
+    if not filename.startswith(STATIC_DIR + os.sep) or not os.path.isfile(filename):
+        return 404, "text/html", "Not Found"
+    with open(filename, "rb") as f:
+        return 200, mimetypes.guess_type(filename)[0] or "application/octet-stream", f.read()
+
+# Mapping of (method, path) to the route that handles it
+ROUTES = {
+    ("GET", "/") : index,
+    ("GET", "/consent-form") : download_consent_form,
+    ("POST", "/log") : log,
+    ("POST", "/level") : set_level,
+    ("GET", "/metrics") : metrics,
+    ("GET", "/favicon.ico") : favicon,
+}
+
+async def http_app(scope, receive, send):
+    """
+    ASGI app of the HTTP routes, Socket.IO requests are handled by `sio` before they reach it
+    """
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    path = scope["path"]
+    route = ROUTES.get((scope["method"], path), None)
+    try:
+        if route is not None:
+            args = {key : values[-1] for key, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+            status, content_type, content = await route(args, body)
+        elif scope["method"] == "GET" and path.startswith("/static/"):
+            status, content_type, content = await static(path[len("/static/"):])
+        else:
+            status, content_type, content = 404, "text/html", "Not Found"
+    except Exception:
+        logger.exception("Failed to handle %s %s", scope["method"], path)
+        status, content_type, content = 500, "text/html", "Internal Server Error"
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+        content_type += "; charset=utf-8"
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(content)).encode("latin-1"))]})
+    await send({"type": "http.response.body", "body": content})
+
+
+#########################
+# Socket Event Handlers #
+#########################
+
+@sio.on('create')
+async def on_create(user_id, data):
+    print("Creating Game!")
+    if data.get("user_id", None) is None:
+        await sio.emit("creation_failed", { "error" : "Missing user ID" }, room=user_id)
+        return
+    session = SERVER.get_session(str(data["user_id"]))
+    SERVER.identify_socket(user_id, session)
+    async with USERS[user_id]:
+        # Retrieve current game if one exists
+        curr_game = SERVER.get_curr_game(user_id)
+        if curr_game:
+            # Cannot create if currently in a game
+            return
+        params = SERVER.get_create_params(session, data.get('params', {}))
+        print("Params", params)
+        game_name = data.get('game_name', 'overcooked')
+        await _create_game(user_id, game_name, params, session=session)
+
+@sio.on('join')
+async def on_join(user_id, data):
+    async with USERS[user_id]:
+        create_if_not_found = data.get("create_if_not_found", True)
+        # Retrieve current game if one exists
+        curr_game = SERVER.get_curr_game(user_id)
+        if curr_game:
+            # Cannot join if currently in a game
+            return
+        # Retrieve a currently open game if one exists
+        game = SERVER.get_waiting_game()
+        if not game and create_if_not_found:
+            # No available game was found so create a game
+            params = data.get('params', {})
+            game_name = data.get('game_name', 'overcooked')
+            await _create_game(user_id, game_name, params, session=SERVER.get_socket_session(user_id))
+            return
+        elif not game:
+            # No available game was found so start waiting to join one
+            await sio.emit('waiting', { "in_game" : False }, room=user_id)
+        else:
+            # Game was found so join it
+            await sio.enter_room(user_id, get_room(game.id))
+            with game.lock:
+                activated, session = SERVER.join_game(game, user_id)
+            if activated:
+                # Game is ready to begin play
+                await sio.emit('start_game', { "spectating" : False, "start_info" : game.to_json()}, room=get_room(game.id))
+                start_game_loop(game, session=session)
+            else:
+                # Still need to keep waiting for players
+                await sio.emit('waiting', { "in_game" : True }, room=get_room(game.id))
+
+@sio.on('leave')
+async def on_leave(user_id, data):
+    async with USERS[user_id]:
+        was_active = await _leave_game(user_id)
+        if was_active:
+            await sio.emit('end_game', { "status" : Game.Status.DONE, "data" : {}}, room=user_id)
+        else:
+            await sio.emit('end_lobby', room=user_id)
+
+@sio.on('pause')
+async def on_pause(user_id, data):
+    SERVER.pause_session(user_id, data)
+
+@sio.on('transport')
+async def on_transport(user_id, data):
+    return SERVER.negotiate_transport(user_id, data, binary_transport=BINARY_TRANSPORT)
+
+@sio.on('keyframe_request')
+async def on_keyframe_request(user_id, data):
+    # the client missed a state_pong and can not apply the following deltas
+    SERVER.request_keyframe(user_id)
+
+@sio.on('action')
+async def on_action(user_id, data):
+    SERVER.enqueue_action(user_id, data['action'])
+
+@sio.on('connect')
+async def on_connect(user_id, environ):
+    if user_id in USERS:
+        return
+    USERS[user_id] = asyncio.Lock()
+
+@sio.on('disconnect')
+async def on_disconnect(user_id, *args):
+    # Ensure game data is properly cleaned-up in case of unexpected disconnect
+    if user_id not in USERS:
+        return
+    async with USERS[user_id]:
+        await _leave_game(user_id)
+    del USERS[user_id]
+    SERVER.remove_socket(user_id)
+
+# Exit handler for server
+async def on_exit():
+    # Force-terminate all games on server termination
+    for game_id, game in list(SERVER.games.items()):
+        await sio.emit('end_game', { "status" : Game.Status.INACTIVE, "data" : game.get_data() }, room=get_room(game_id))
+    TICK_SCHEDULER.stop()
+    # Write the remaining log records
+    close_log_writers()
+    # Stop the NPC workers
+    NPC_EXECUTOR.shutdown()
+
+# The ASGI app of the server, e.g. for `uvicorn env.server.async_app:app`
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_shutdown=on_exit)
+
+
+#############
+# Game Loop #
+#############
+
+async def emit_state_pong(game, message):
+    """
+    Sends a state_pong message to the clients of a game, encoded once per transport, see app.py
+    """
+    binary_users, payload, send_json = SERVER.encode_state_pong(game, message)
+    for user_id in binary_users:
+        await sio.emit('state_pong', payload, room=user_id)
+    if send_json:
+        await sio.emit('state_pong', message, room=get_room(game.id), skip_sid=binary_users)
+
+async def play_game(game, session=None, smm=None, fps=10):
+    """
+    Apply real-time game updates and broadcast state to all clients currently active in the game. This is a task
+    of `TICK_SCHEDULER`: each step runs one tick, awaits the emit of the game's state, and yields the number of
+    seconds until the next tick. The loop runs until the game ends or `GameServer.stop_game` is called, see app.py's
+    `play_game` for the parameters
+    """
+    running = SERVER.game_events[game.id]
+    metrics = game.metrics
+    status = Game.Status.ACTIVE
+    count = 0
+    while status != Game.Status.DONE and status != Game.Status.INACTIVE and running.is_set():
+        # hold if paused
+        if SERVER.hold_paused(game, session):
+            yield 1/fps
+            continue
+        # cycle a tick
+        count += 1
+        frame_start = perf_counter()
+        status = SERVER.tick_game(game)
+        if status == Game.Status.RESET:
+            print("play game but game is in RESET state")
+            await sio.emit('reset_game', SERVER.get_reset_message(game), room=get_room(game.id))
+            yield game.reset_timeout/1000
+        else:
+            message = SERVER.step_game(game, session=session, smm=smm, tick=count)
+            with metrics.time("emit"):
+                await emit_state_pong(game, message)
+            metrics.record("frame", perf_counter() - frame_start)
+        yield 1/fps
+
+    data = SERVER.end_game(game, session=session, smm=smm, ticks=count)
+    await sio.emit('end_game', { "status" : status, "data" : data }, room=get_room(game.id))
+    if status != Game.Status.INACTIVE:
+        game.deactivate()
+    await cleanup_game(game)
+
+def run():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 8080  # default port to 8080 unless specified
+
+    # Dynamically parse host and port from environment variables (set by docker build)
+    host = os.getenv('HOST', '0.0.0.0')
+    port = int(os.getenv('PORT', port))
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("The asyncio server runs on an ASGI server, install one with `pip install uvicorn`")
+        sys.exit(1)
+
+    print("Ready to Play!")
+    uvicorn.run(app, host=host, port=port, log_level="info" if DEBUG else "warning")
@@ -0,0 +1,186 @@
+import re, struct
+import numpy as np
+
+# Version of the binary format, sent to clients with the schema so a client can refuse a format it does not know
+BINARY_VERSION = 1
+
+# Value tags, a value is encoded as its uint8 tag followed by its payload. Multi-byte numbers are little endian
+NONE, FALSE, TRUE, INT8, INT32, FLOAT64, STRING, ENUM, OBJECT_ID, POSITION, ORIENTATION, TUPLE, LIST, DICT, BOOL_GRID, INT64 = range(16)
+
+# Strings encoded as a uint8 index (ENUM): the dict keys of game states, state_pong messages and belief states, and
+# the common values (object names, agent ids, goals). Only append to this list, clients decode with the copy sent
+# by `get_schema`
+STRINGS = [
+    # state_pong and game state keys
+    "seq", "keyframe", "state", "delta", "smm", "smm_info", "potential", "score", "time_left", "layout",
+    "players", "objects", "bonus_orders", "all_orders", "timestep", "visibility", "set", "removed",
+    "tick", "latency", "age", "dropped",
+    # player and object keys
+    "position", "orientation", "held_object", "name", "_ingredients", "cooking_tick", "is_cooking", "is_ready",
+    "is_idle", "cook_time", "_cooking_tick", "ingredients",
+    # object names
+    "onion", "tomato", "dish", "soup", "pot", "station", "counter", "serving",
+    # belief state keys and values
+    "true", "agent", "estimated human", "agents", "facing", "holding", "capableOf", "perceivable", "goal",
+    "contains", "canUseWith", "visible", "propertyOf", "id", "holder", "cookTime", "isCooking", "isReady",
+    "isIdle", "title", "A0", "A1", "null",
+    "activate pot", "pick up ingredient", "picking up dish", "place ingredient into pot", "place soup on counter",
+    "place soup on dish", "wait for cooking",
+]
+STRING_INDEX = {x : i for i, x in enumerate(STRINGS)}
+
+# Orientations encoded as a uint8 index (ORIENTATION), in the order of overcooked's Direction.ALL_DIRECTIONS
+ORIENTATIONS = [(0, -1), (0, 1), (1, 0), (-1, 0)]
+ORIENTATION_INDEX = {x : i for i, x in enumerate(ORIENTATIONS)}
+
+# Object ids of the SMM belief states (e.g. "O41"), encoded as a uint16 (OBJECT_ID)
+OBJECT_ID_PATTERN = re.compile(r"O([1-9][0-9]{0,4}|0)$")
+
+def get_schema():
+    """
+    Returns the tables a client needs to decode binary payloads, sent to clients that negotiate the binary transport
+    """
+    return {
+        "version": BINARY_VERSION,
+        "strings": STRINGS,
+        "orientations": ORIENTATIONS,
+    }
+
+def encode(value):
+    """
+    Encodes a value made of None, bools, ints, floats, strings, tuples, lists and dicts into bytes. Tuples stay
+    tuples when decoded. A list of lists of lists of bools of the same lengths (a visibility grid) is bit-packed
+    """
+    parts = []
+    _encode(value, parts)
+    return b"".join(parts)
+
+def _encode(value, parts):
+    t = type(value)
+    if value is None:
+        parts.append(b"\x00")
+    elif t is bool:
+        parts.append(b"\x02" if value else b"\x01")
+    elif t is int:
+        if -128 <= value <= 127:
+            parts.append(struct.pack("<Bb", INT8, value))
+        elif -2**31 <= value < 2**31:
+            parts.append(struct.pack("<Bi", INT32, value))
+        else:
+            parts.append(struct.pack("<Bq", INT64, value))
+    elif t is float:
+        parts.append(struct.pack("<Bd", FLOAT64, value))
+    elif t is str:
+        index = STRING_INDEX.get(value, None)
+        if index is not None:
+            parts.append(struct.pack("<BB", ENUM, index))
+            return
+        match = OBJECT_ID_PATTERN.match(value)
+        if match and int(match.group(1)) < 2**16:
+            parts.append(struct.pack("<BH", OBJECT_ID, int(match.group(1))))
+            return
+        data = value.encode("utf-8")
+        parts.append(struct.pack("<BH", STRING, len(data)))
+        parts.append(data)
+    elif t is tuple:
+        index = ORIENTATION_INDEX.get(value, None) if len(value) == 2 else None
+        if index is not None:
+            parts.append(struct.pack("<BB", ORIENTATION, index))
+        elif len(value) == 2 and type(value[0]) is int and type(value[1]) is int and 0 <= value[0] < 256 and 0 <= value[1] < 256:
+            parts.append(struct.pack("<BBB", POSITION, value[0], value[1]))
+        else:
+            parts.append(struct.pack("<BH", TUPLE, len(value)))
+            for x in value:
+                _encode(x, parts)
+    elif t is list:
+        if _is_bool_grid(value):
+            height, width, depth = len(value), len(value[0]), len(value[0][0])
+            parts.append(struct.pack("<BBBB", BOOL_GRID, height, width, depth))
+            parts.append(np.packbits(np.array(value, dtype=bool), axis=None).tobytes())
+            return
+        parts.append(struct.pack("<BH", LIST, len(value)))
+        for x in value:
+            _encode(x, parts)
+    elif t is dict:
+        parts.append(struct.pack("<BH", DICT, len(value)))
+        for k in value:
+            _encode(k, parts)
+            _encode(value[k], parts)
+    else:
+        raise TypeError("Cannot binary encode a value of type " + t.__name__)
+
+def _is_bool_grid(value):
+    if len(value) == 0 or len(value) > 255 or type(value[0]) is not list or len(value[0]) == 0 or len(value[0]) > 255:
+        return False
+    if type(value[0][0]) is not list or len(value[0][0]) == 0 or len(value[0][0]) > 255:
+        return False
+    width, depth = len(value[0]), len(value[0][0])
+    for row in value:
+        if type(row) is not list or len(row) != width:
+            return False
+        for cell in row:
+            if type(cell) is not list or len(cell) != depth:
+                return False
+            for x in cell:
+                if type(x) is not bool:
+                    return False
+    return True
+
+def decode(data):
+    """
+    Decodes the bytes of `encode`, the reference decoder of static/js/binary_codec.js
+    """
+    value, offset = _decode(memoryview(data), 0)
+    if offset != len(data):
+        raise ValueError("Trailing bytes after the binary value")
+    return value
+
+def _decode(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == NONE:
+        return None, offset
+    if tag == FALSE or tag == TRUE:
+        return tag == TRUE, offset
+    if tag == INT8:
+        return struct.unpack_from("<b", data, offset)[0], offset + 1
+    if tag == INT32:
+        return struct.unpack_from("<i", data, offset)[0], offset + 4
+    if tag == INT64:
+        return struct.unpack_from("<q", data, offset)[0], offset + 8
+    if tag == FLOAT64:
+        return struct.unpack_from("<d", data, offset)[0], offset + 8
+    if tag == STRING:
+        length = struct.unpack_from("<H", data, offset)[0]
+        return bytes(data[offset + 2:offset + 2 + length]).decode("utf-8"), offset + 2 + length
+    if tag == ENUM:
+        return STRINGS[data[offset]], offset + 1
+    if tag == OBJECT_ID:
+        return "O" + str(struct.unpack_from("<H", data, offset)[0]), offset + 2
+    if tag == POSITION:
+        return (data[offset], data[offset + 1]), offset + 2
+    if tag == ORIENTATION:
+        return ORIENTATIONS[data[offset]], offset + 1
+    if tag == TUPLE or tag == LIST:
+        length = struct.unpack_from("<H", data, offset)[0]
+        offset += 2
+        items = []
+        for _ in range(length):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return (tuple(items) if tag == TUPLE else items), offset
+    if tag == DICT:
+        length = struct.unpack_from("<H", data, offset)[0]
+        offset += 2
+        value = {}
+        for _ in range(length):
+            k, offset = _decode(data, offset)
+            value[k], offset = _decode(data, offset)
+        return value, offset
+    if tag == BOOL_GRID:
+        height, width, depth = data[offset], data[offset + 1], data[offset + 2]
+        offset += 3
+        num_bytes = (height * width * depth + 7) // 8
+        bits = np.unpackbits(np.frombuffer(data[offset:offset + num_bytes], dtype=np.uint8), count=height * width * depth)
+        return bits.astype(bool).reshape((height, width, depth)).tolist(), offset + num_bytes
+    raise ValueError("Unknown binary tag " + str(tag))
@@ -1,12 +1,16 @@
 from abc import ABC, abstractmethod
-from threading import Lock, Thread
-from queue import Queue, LifoQueue, Empty, Full, PriorityQueue
-from time import time
+from threading import Lock
+from queue import Queue, Empty, Full
+from time import time, perf_counter
 from overcooked_ai.src.overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
 from overcooked_ai.src.overcooked_ai_py.mdp.actions import Action, Direction
 from overcooked_ai.src.overcooked_ai_py.planning.planners import MotionPlanner, NO_COUNTERS_PARAMS
+from env.server.visibility import MASKS
+from env.server.navigation import NAVIGATION
+from env.server.npc_executor import InlineNPCExecutor
 # from overcooked_ai_py.rllib import load_agent
 import random, os, pickle, json
+import numpy as np
 
 # Relative path to where all static pre-trained agents are stored on server
 AGENT_DIR = None
@@ -18,12 +22,16 @@ MAX_GAME_TIME = None
 VISIBILITY = "D"
 VISIBILITY_RANGE = 4
 
-def _configure(max_game_time, agent_dir, visibility, visibility_range):
-    global AGENT_DIR, MAX_GAME_TIME, VISIBILITY, VISIBILITY_RANGE
+# Runs the NPC policies of games that are not given an executor, see npc_executor.py
+NPC_EXECUTOR = None
+
+def _configure(max_game_time, agent_dir, visibility, visibility_range, npc_executor=None):
+    global AGENT_DIR, MAX_GAME_TIME, VISIBILITY, VISIBILITY_RANGE, NPC_EXECUTOR
     MAX_GAME_TIME = max_game_time
     AGENT_DIR = agent_dir
     VISIBILITY = visibility
     VISIBILITY_RANGE = visibility_range
+    NPC_EXECUTOR = npc_executor
 
 class Game(ABC):
     """
@@ -60,6 +68,7 @@ class Game(ABC):
         pending_actions List[(Queue)]: Buffer of (player_id, action) pairs have submitted that haven't been commited yet
         lock (Lock):    Used to serialize updates to the game state
         is_active(bool): Whether the game is currently being played or not
+        metrics (TickMetrics): Optional per-phase timers of the tick loop, set by the server
         """
         self.players = []
         self.spectators = set()
@@ -67,6 +76,7 @@ class Game(ABC):
         self.id = kwargs.get('id', id(self))
         self.lock = Lock()
         self._is_active = False
+        self.metrics = None
 
     @abstractmethod
     def is_full(self):
@@ -301,7 +311,6 @@ class OvercookedGame(Game):
         - score (int): Current reward acheived by all players
         - max_time (int): Number of seconds the game should last
         - npc_policies (dict): Maps user_id to policy (Agent) for each AI player
-        - npc_state_queues (dict): Mapping of NPC user_ids to LIFO queues for the policy to process
         - curr_tick (int): How many times the game server has called this instance's `tick` method
         - ticker_per_ai_action (int): How many frames should pass in between NPC policy forward passes.
             Note that this is a lower bound; if the policy is computationally expensive the actual frames
@@ -311,26 +320,32 @@ class OvercookedGame(Game):
         - human_players (set(str)): Collection of all player IDs that correspond to humans
         - npc_players (set(str)): Collection of all player IDs that correspond to AI
         - randomized (boolean): Whether the order of the layouts should be randomized
+        - clock (function): Returns the current time in seconds, the game timer runs on it. Defaults to the wall clock,
+            a simulator can pass a simulated clock to run games faster than real time
+        - npc_executor (NPCExecutor): Runs the NPC policy forward passes: inline in `apply_actions`, on a thread pool
+            shared by the games, or on worker processes. Defaults to the executor configured by the server, or to
+            running them inline, which makes the game deterministic for a given random seed
 
     Methods:
-        - npc_policy_consumer: Background process that asynchronously computes NPC policy forward passes. One thread
-            spawned for each NPC
+        - enqueue_npc_action: Called by the NPC executor with the action of an NPC policy forward pass
         - _curr_game_over: Determines whether the game on the current mdp has ended
     """
 
-    def __init__(self, layouts=["cramped_room"], mdp_params={}, num_players=2, gameTime=30, playerZero='human', playerOne='human', showPotential=False, randomized=False, **kwargs):
+    def __init__(self, layouts=["cramped_room"], mdp_params={}, num_players=2, gameTime=30, playerZero='human', playerOne='human', showPotential=False, randomized=False, clock=time, npc_executor=None, **kwargs):
         super(OvercookedGame, self).__init__(**kwargs)
+        self.clock = clock
+        self.npc_executor = npc_executor if npc_executor is not None else NPC_EXECUTOR if NPC_EXECUTOR is not None else InlineNPCExecutor()
         self.show_potential = showPotential
         self.mdp_params = mdp_params
         self.layouts = layouts
         self.max_players = int(num_players)
         self.mdp = None
         self.mp = None
+        self.navigation = None
         self.score = 0
         self.phi = 0
         self.max_time = min(int(gameTime), MAX_GAME_TIME)
         self.npc_policies = {}
-        self.npc_state_queues = {}
         self.action_to_overcooked_action = {
             "STAY" : Action.STAY,
             "UP" : Direction.NORTH,
@@ -356,11 +371,10 @@ class OvercookedGame(Game):
             self.add_player(npc_id, idx=i, buff_size=1, is_human=False)
             self.npc_policies[npc_id] = FSMAI(self)
             self.npc_policies[npc_id].agent_id = i
-            self.npc_state_queues[npc_id] = LifoQueue()
 
 
     def _curr_game_over(self):
-        return time() - self.start_time >= self.max_time
+        return self.clock() - self.start_time >= self.max_time
 
 
     def needs_reset(self):
@@ -387,13 +401,8 @@ class OvercookedGame(Game):
                 raise ValueError("Inconsistent state")
 
 
-    def npc_policy_consumer(self, policy_id):
-        queue = self.npc_state_queues[policy_id]
-        policy = self.npc_policies[policy_id]
-        while self._is_active:
-            state = queue.get()
-            npc_action, _ = policy.action(state)
-            super(OvercookedGame, self).enqueue_action(policy_id, npc_action)
+    def enqueue_npc_action(self, npc_id, action):
+        super(OvercookedGame, self).enqueue_action(npc_id, action)
 
     def is_full(self):
         return self.num_players >= self.max_players
@@ -418,6 +427,7 @@ class OvercookedGame(Game):
         pass
 
     def apply_actions(self):
+        start_time = perf_counter()
         # Default joint action, as NPC policies and clients probably don't enqueue actions fast
         # enough to produce one at every tick
         joint_action = [Action.STAY] * len(self.players)
@@ -431,19 +441,25 @@ class OvercookedGame(Game):
 
         # Apply overcooked game logic to get state transition
         prev_state = self.state
+        start = perf_counter()
         self.state, info = self.mdp.get_state_transition(prev_state, joint_action)
+        transition_time = perf_counter() - start
         if self.show_potential:
             self.phi = self.mdp.potential_function(prev_state, self.mp, gamma=0.99)
 
-        # Send next state to all background consumers if needed
+        # Send next state to the NPC policies if needed
         if self.curr_tick % self.ticks_per_ai_action == 0:
             for npc_id in self.npc_policies:
-                self.npc_state_queues[npc_id].put(self.state, block=False)
+                self.npc_executor.submit(self, npc_id, self.state)
 
         # Update score based on soup deliveries that might have occured
         curr_reward = sum(info['sparse_reward_by_agent'])
         self.score += curr_reward
 
+        if self.metrics is not None:
+            self.metrics.record("state transition", transition_time)
+            self.metrics.record("apply actions", perf_counter() - start_time - transition_time)
+
         # Return about the current transition
         return prev_state, joint_action, info
 
@@ -476,28 +492,23 @@ class OvercookedGame(Game):
         if self.show_potential:
             self.mp = MotionPlanner.from_pickle_or_compute(self.mdp, counter_goals=NO_COUNTERS_PARAMS)
         self.state = self.mdp.get_standard_start_state()
+        self.precompute_visibility()
+        self.navigation = NAVIGATION.get_grid(self.mdp.terrain_mtx)
         if self.show_potential:
             self.phi = self.mdp.potential_function(self.state, self.mp, gamma=0.99)
-        self.start_time = time()
+        self.start_time = self.clock()
         self.curr_tick = 0
         self.score = 0
-        self.threads = []
         for npc_policy in self.npc_policies:
             self.npc_policies[npc_policy].reset()
-            self.npc_state_queues[npc_policy].put(self.state)
-            t = Thread(target=self.npc_policy_consumer, args=(npc_policy,))
-            self.threads.append(t)
-            t.start()
+        self.npc_executor.start(self)
+        for npc_policy in self.npc_policies:
+            self.npc_executor.submit(self, npc_policy, self.state)
 
     def deactivate(self):
         super(OvercookedGame, self).deactivate()
-        # Ensure the background consumers do not hang
-        for npc_policy in self.npc_policies:
-            self.npc_state_queues[npc_policy].put(self.state)
-
-        # Wait for all background threads to exit
-        for t in self.threads:
-            t.join()
+        # Drop the NPC forward passes that have not run yet
+        self.npc_executor.stop(self)
 
         # Clear all action queues
         self.clear_pending_actions()
@@ -507,8 +518,11 @@ class OvercookedGame(Game):
         state_dict['potential'] = self.phi if self.show_potential else None
         state_dict['state'] = self.state.to_dict()
         state_dict['score'] = self.score
+        start = perf_counter()
         state_dict['state']['visibility'] = self.get_visibility()
-        state_dict['time_left'] = max(self.max_time - (time() - self.start_time), 0)
+        if self.metrics is not None:
+            self.metrics.record("visibility", perf_counter() - start)
+        state_dict['time_left'] = max(self.max_time - (self.clock() - self.start_time), 0)
         state_dict['layout'] = self.curr_layout
         return state_dict
 
@@ -523,57 +537,21 @@ class OvercookedGame(Game):
         # return DummyAI()  # Jack: replacing this DummyAI with a FSMAI
 
     def get_visibility(self):
-        visible = []
-        width = len(self.mdp.terrain_mtx[0])
-        height = len(self.mdp.terrain_mtx)
-        for row in range(height):
-            visible.append([])
-            for col in range(width):
-                visible[row].append([
-                    self.can_see(self.visibility, self.state.players[i].orientation, col - self.state.players[i].position[0], row - (self.state.players[i].position[1])) for i in range(self.num_players)
-                ])
-        return visible
-
+        # stack the cached per-player masks into the row, col, player grid sent to the clients
+        shape = (len(self.mdp.terrain_mtx), len(self.mdp.terrain_mtx[0]))
+        masks = [
+            MASKS.get_mask(self.visibility, self.visibility_range, self.state.players[i].position, self.state.players[i].orientation, shape) for i in range(self.num_players)
+        ]
+        return np.stack(masks, axis=-1).tolist()
+
+    # precomputes the visibility masks of every pose the players can reach on the layout
+    def precompute_visibility(self):
+        shape = (len(self.mdp.terrain_mtx), len(self.mdp.terrain_mtx[0]))
+        MASKS.precompute(self.visibility, self.visibility_range, self.mdp.get_valid_player_positions(), shape)
 
     # checks whether the agent can see the object
     def can_see(self, visibility, agent_orientation, dX, dY):
-        # V visibility: agents sees everything in front of them with 90deg field of view (45deg angles)
-        if visibility == "V":
-            # agent facing right, ignore items to left of agent and beyond 45deg (dY > dX)
-            if agent_orientation == (1, 0) and (dX < 0 or abs(dY) > abs(dX) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing left, ignore items to right of agent and beyond 45deg (dY > dX)
-            if agent_orientation == (-1, 0) and (dX > 0 or abs(dY) > abs(dX) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing up, ignore items to down of agent and beyond 45deg (dX > dY)
-            if agent_orientation == (0, 1) and (dY < 0 or abs(dX) > abs(dY) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing down, ignore items to up of agent and beyond 45deg (dX > dY)
-            if agent_orientation == (0, -1) and (dY > 0 or abs(dX) > abs(dY) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-
-        # D visibility: agents see everything in front of them to a radius
-        elif visibility == "D":
-            # agent facing right, ignore items to left of agent and where dist > max
-            if agent_orientation == (1, 0) and (dX < 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing left, ignore items to right of agent and where dist > max
-            if agent_orientation == (-1, 0) and (dX > 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing up, ignore items to down of agent and where dist > max
-            if agent_orientation == (0, 1) and (dY < 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing down, ignore items to up of agent and where dist > max
-            if agent_orientation == (0, -1) and (dY > 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-
-        # O visibility: agents see everything around them to a radius
-        elif visibility == "O":
-            # ignore items where dist > max
-            if dY * dY + dX * dX > self.visibility_range * self.visibility_range:
-                return False
-
-        return True
+        return MASKS.is_visible(visibility, self.visibility_range, agent_orientation, dX, dY)
 
 class DummyOvercookedGame(OvercookedGame):
     """
@@ -607,66 +585,33 @@ class FSMAI():
         # FSM params
         self.plan = []
 
-    # for A*: gets heuristic (squared dist)
+    # pickles the policy with only the parts of the game it reads, for running it in another process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["game"] = NPCContext(self.game)
+        return state
+
+    # gets heuristic (squared dist)
     def h(self, curr, goal):
         return (goal[0] - curr[0]) * (goal[0] - curr[0]) + (goal[1] - curr[1]) * (goal[1] - curr[1])
 
-    # for A*: checks whether a block is a floor
+    # checks whether a block is a floor
     def check_floor(self, loc):
-        # check bounds
-        # X
-        if loc[0] >= len(self.game.mdp.terrain_mtx[0]) or loc[0] < 0:
-            return False
-        # Y
-        if loc[1] >= len(self.game.mdp.terrain_mtx) or loc[1] < 0:
-            return False
         # open space
-        if self.game.mdp.terrain_mtx[loc[1]][loc[0]] != ' ' and not self.game.mdp.terrain_mtx[loc[1]][loc[0]].isdigit():
+        if not self.game.navigation.is_floor(loc):
             return False
         # player is there
         if [True for i in range(self.game.num_players) if self.state.players[i].position == loc and self.agent_id != i] != []:
             return False
         return True
 
-    # for A*: checks whether a square is valid and adds it to the frontier
-    def frontier_push(self, loc, goal, frontier, paths, parent):
-        if (loc not in paths and self.check_floor(loc)) or loc == goal:
-            frontier.put((self.h(loc, goal), loc))
-            paths[loc] = parent
-        return frontier, paths
-
-    # for A*: find the path to the goal
-    def a_star(self, curr, goal):
-        # make the queue
-        paths = {}
-        frontier = PriorityQueue()
-        frontier.put((0, curr))
-        # run A*
-        while frontier.qsize() > 0:
-            # pull from the queue
-            loc = frontier.get()[1]
-            # end if the goal
-            if loc == goal:
-                break
-            # add neighbors to frontier and paths
-            frontier, paths = self.frontier_push((loc[0], loc[1]-1), goal, frontier, paths, loc)
-            frontier, paths = self.frontier_push((loc[0]+1, loc[1]), goal, frontier, paths, loc)
-            frontier, paths = self.frontier_push((loc[0], loc[1]+1), goal, frontier, paths, loc)
-            frontier, paths = self.frontier_push((loc[0]-1, loc[1]), goal, frontier, paths, loc)
-        # if no paths to goal, return empty
-        if goal not in paths:
-            return []
-        # reconstruct the path
-        stone = goal
-        path = [goal]
-        while stone != curr:
-            stone = paths[stone]
-            path.append(stone)
-        return path
+    # gets the positions of the other players, which block the paths
+    def get_blocked(self):
+        return set([self.state.players[i].position for i in range(self.game.num_players) if i != self.agent_id])
 
-    # uses A* to plan to a go to a square
+    # looks up the path to a square in the layout's navigation grid
     def go_to_square(self, curr, goal):
-        path = self.a_star(curr, goal)
+        path = self.game.navigation.get_path(curr, goal, blocked=self.get_blocked())
         return path
 
     # determine the action needed for the agent to face a goal
@@ -695,24 +640,21 @@ class FSMAI():
         appliance_position = None
         appliance_dist = float("inf")
         pot_states = self.game.mdp.get_pot_states(self.state)
-        for row in range(len(self.game.mdp.terrain_mtx)):
-            for col in range(len(self.game.mdp.terrain_mtx[row])):
-                position = (col, row)
-                # check if the terrain is this appliance
-                if self.game.mdp.terrain_mtx[row][col] == appliance:
-                    # if appliance is a pot, check the pot state
-                    if appliance == 'P' and pot_state != "":
-                        # if looking for unfilled pots
-                        if pot_state == "unfilled" and position not in pot_states['empty'] and position not in pot_states['1_items'] and position not in pot_states['2_items']:
-                            continue
-                        # if looking for cooking pots
-                        if pot_state == "cooking" and position not in pot_states['cooking'] and position not in pot_states['ready']:
-                            continue
-                    # if dist is closer update the target ingredient
-                    dist = self.h((row, col), player_position)
-                    if dist < appliance_dist:
-                        appliance_dist = dist
-                        appliance_position = position
+        for position in self.game.navigation.get_appliances(appliance):
+            col, row = position
+            # if appliance is a pot, check the pot state
+            if appliance == 'P' and pot_state != "":
+                # if looking for unfilled pots
+                if pot_state == "unfilled" and position not in pot_states['empty'] and position not in pot_states['1_items'] and position not in pot_states['2_items']:
+                    continue
+                # if looking for cooking pots
+                if pot_state == "cooking" and position not in pot_states['cooking'] and position not in pot_states['ready']:
+                    continue
+            # if dist is closer update the target ingredient
+            dist = self.h((row, col), player_position)
+            if dist < appliance_dist:
+                appliance_dist = dist
+                appliance_position = position
         return appliance_position
 
     # pick a random direction to go
@@ -953,6 +895,17 @@ class FSMAI():
         pass
 
 
+class NPCContext():
+    """
+    The parts of a game an NPC policy reads (the mdp, the navigation grid and the number of players), pickled with
+    the policy in place of the game when the policy runs in another process
+    """
+    def __init__(self, game):
+        self.mdp = game.mdp
+        self.navigation = game.navigation
+        self.num_players = game.num_players
+
+
 class DummyAI():
     """
     Randomly samples actions. Used for debugging
@@ -0,0 +1,488 @@
+import os, queue, datetime, struct
+from time import perf_counter
+from threading import Lock, Event
+from env.server.utils import ThreadSafeSet, ThreadSafeDict
+from env.server.game import OvercookedGame
+from env.server.live_smm import LiveSMM
+from env.server.log_writer import get_log_writer
+from env.server.session import Session
+from env.server.state_delta import StateDeltaEncoder
+from env.server.metrics import TickMetrics
+import env.server.binary_codec
+
+LAYOUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layouts")  # Folder of the layouts
+
+# Mapping of string game names to corresponding classes
+GAME_NAME_TO_CLS = {
+    "overcooked" : OvercookedGame,
+}
+
+def timestamp():
+    return int(datetime.datetime.timestamp(datetime.datetime.now()))
+
+def get_room(game_id):
+    """
+    Returns the socketio room of a game. Rooms are named rather than using the game id directly, since socketio
+    broadcasts to every client when emitting to a falsy room such as game 0
+    """
+    return "game-" + str(game_id)
+
+# utility function for getting agent names
+def get_agent_names(agent_dir):
+    return [d for d in os.listdir(agent_dir) if os.path.isdir(os.path.join(agent_dir, d))]
+
+class GameServer():
+    """
+    The games, players and study sessions of a server, and the steps of the games' tick loops, independent of how
+    the server talks to its clients. The threaded Flask server (app.py) and the asyncio server (async_app.py) each
+    keep one GameServer, and only add the socketio rooms, emits and the scheduling of the tick loops.
+
+    Methods do not send anything: those whose clients must be told of a change return what to send, and the caller
+    emits it. The state is kept in thread-safe containers, so the threaded server can share it across its handler
+    and tick threads, and the asyncio server, which only touches it from its event loop, pays little for the locks
+    """
+
+    def __init__(self, max_games, keyframe_interval=50, log_writer={}, metrics_path=None, live_smm=False):
+        """
+        max_games (int):            Maximum number of games that can run concurrently
+        keyframe_interval (int):    Number of ticks between full states in the delta-encoded state_pong
+        log_writer (dict):          Parameters of the session log writers, see LogWriter
+        metrics_path (str):         Folder the tick loop metrics of each game are written to at the end of the game,
+                                    None to not write them
+        live_smm (bool):            Whether to run the SMMs live during games and send their belief states
+        """
+        self.max_games = max_games
+        self.keyframe_interval = keyframe_interval
+        self.log_writer = log_writer
+        self.metrics_path = metrics_path
+        self.live_smm = live_smm
+
+        self.free_ids = queue.Queue(maxsize=max_games)  # Queue of available IDs. This is how we sync game creation and keep track of how many games are in memory
+        self.free_map = ThreadSafeDict()  # Bitmap that indicates whether ID is currently in use. Game with ID=i is "freed" by setting free_map[i] = True
+        for i in range(max_games):
+            self.free_ids.put(i)
+            self.free_map[i] = True
+
+        self.games = ThreadSafeDict()  # Mapping of game-id to game objects
+        self.active_games = ThreadSafeSet()  # Set of games IDs that are currently being played
+        self.waiting_games = queue.Queue()  # Queue of games IDs that are waiting for additional players to join. Note that some of these IDs might be stale (i.e. if free_map[id] = True)
+        self.user_rooms = ThreadSafeDict()  # Mapping of user id's to the current game (room) they are in
+        self.sessions = ThreadSafeDict()  # Mapping of participant user ids (the user_id URL parameter) to their study sessions
+        self.sessions_lock = Lock()  # Serializes session creation
+        self.user_sessions = ThreadSafeDict()  # Mapping of socket user id's to the participant user id of their session
+        self.game_events = ThreadSafeDict()  # Mapping of game-id to an event that is set while the game's tick loop should keep running
+        self.state_encoders = ThreadSafeDict()  # Mapping of game-id to the delta encoder of the game's state_pong messages
+        self.metrics = ThreadSafeDict()  # Mapping of game-id to the per-phase timers of the game's tick loop
+        self.binary_users = ThreadSafeSet()  # Set of socket user id's that negotiated the binary transport
+
+    #################
+    # Game Registry #
+    #################
+
+    def try_create_game(self, game_name, session=None, **kwargs):
+        """
+        Tries to create a brand new Game object based on parameters in `kwargs`
+
+        Returns (Game, Error) that represent a pointer to a game object, and error that occured
+        during creation, if any. In case of error, `Game` returned in None. In case of sucess,
+        `Error` returned is None
+
+        Possible Errors:
+            - Runtime error if server is at max game capacity
+            - Propogate any error that occured in game __init__ function
+        """
+
+        # end the session's previous game, the games of other sessions keep running
+        if session is not None and session.game_id is not None:
+            self.stop_game(session.game_id)
+            print("REMOVED GAME", session.game_id)
+
+        # create the game
+        try:
+            curr_id = self.free_ids.get(block=False)
+        except queue.Empty:
+            return None, RuntimeError("Server at max capacity")
+        try:
+            assert self.free_map[curr_id], "Current id is already in use"
+            game_cls = GAME_NAME_TO_CLS.get(game_name, OvercookedGame)
+            game = game_cls(id=curr_id, **kwargs)
+        except Exception as e:
+            self.free_ids.put(curr_id)
+            return None, e
+        self.games[game.id] = game
+        self.free_map[game.id] = False
+        if session is not None:
+            session.game_id = game.id
+        return game, None
+
+    def stop_game(self, game_id):
+        """
+        Ends a game's tick loop after its current tick, which then ends the game for its players and cleans it up
+        """
+        event = self.game_events.get(game_id, None)
+        if event is not None:
+            event.clear()
+
+    def cleanup_game(self, game):
+        """
+        Frees a game's id and forgets the game and its players. The caller closes the game's socketio room
+        """
+        if self.free_map[game.id]:
+            raise ValueError("Double free on a game")
+
+        # User tracking
+        for user_id in game.players:
+            self.leave_curr_room(user_id)
+
+        # Game tracking
+        self.free_map[game.id] = True
+        self.free_ids.put(game.id)
+        del self.games[game.id]
+        del self.game_events[game.id]
+        del self.state_encoders[game.id]
+        del self.metrics[game.id]
+        self.active_games.remove(game.id)
+
+    def get_game(self, game_id):
+        return self.games.get(game_id, None)
+
+    def get_curr_game(self, user_id):
+        return self.get_game(self.get_curr_room(user_id))
+
+    def get_curr_room(self, user_id):
+        return self.user_rooms.get(user_id, None)
+
+    def set_curr_room(self, user_id, room_id):
+        self.user_rooms[user_id] = room_id
+
+    def leave_curr_room(self, user_id):
+        del self.user_rooms[user_id]
+
+    def get_waiting_game(self):
+        """
+        Return a pointer to a waiting game, if one exists
+
+        Note: The use of a queue ensures that no two threads will ever receive the same pointer, unless
+        the waiting game's ID is re-added to the waiting_games queue
+        """
+        try:
+            waiting_id = self.waiting_games.get(block=False)
+            while self.free_map[waiting_id]:
+                waiting_id = self.waiting_games.get(block=False)
+        except queue.Empty:
+            return None
+        else:
+            return self.get_game(waiting_id)
+
+    def get_game_metrics(self):
+        """
+        Returns the rolling per-phase timings of the tick loop of each running game, in milliseconds
+        """
+        games = {}
+        for game_id, game_metrics in list(self.metrics.items()):
+            game = self.get_game(game_id)
+            if game is None:
+                continue
+            games[game_id] = dict(game_metrics.get_summary(), layout=getattr(game, "curr_layout", None), players=list(getattr(game, "human_players", [])))
+        return games
+
+    ############
+    # Sessions #
+    ############
+
+    def get_session(self, user_id):
+        """
+        Returns the study session of a participant, starting one if the participant does not have one (e.g. after a
+        server restart)
+        """
+        with self.sessions_lock:
+            if user_id not in self.sessions:
+                self.sessions[user_id] = Session(user_id)
+            return self.sessions[user_id]
+
+    def restart_session(self, user_id):
+        """
+        Starts a participant's session over, ending the game of their previous page. Other sessions are not affected
+        """
+        with self.sessions_lock:
+            session = self.sessions.get(user_id, None)
+            if session is not None and session.game_id is not None:
+                self.stop_game(session.game_id)
+            self.sessions[user_id] = Session(user_id)
+
+    def get_socket_session(self, user_id):
+        """
+        Returns the study session of a socket user id, or None if the socket has not identified its participant
+        """
+        session_id = self.user_sessions.get(user_id, None)
+        return None if session_id is None else self.sessions.get(session_id, None)
+
+    def identify_socket(self, user_id, session):
+        self.user_sessions[user_id] = session.user_id
+
+    def remove_socket(self, user_id):
+        """
+        Forgets a disconnected socket, once it has left its game
+        """
+        del self.user_sessions[user_id]
+        self.binary_users.remove(user_id)
+
+    def pause_session(self, user_id, paused):
+        session = self.get_socket_session(user_id)
+        if not session:
+            return
+        with session.lock:
+            session.paused = bool(paused)
+
+    ###################
+    # Players & Games #
+    ###################
+
+    def get_create_params(self, session, params={}):
+        """
+        Returns the parameters of a session's game, the client's `params` with the session's layout and game time
+        """
+        params = dict(params)
+        #hardcoded since there is no input for toggling this flag
+        #defnitely want to change this in the future
+        params["num_players"] = 2  # change this to set the number of players in the game
+        params["mdp_params"] = {"old_dynamics":True}
+        params["layout"] = session.layout + ".layout"
+        params["layouts"] = [session.layout]
+        print("    game layout to " + session.layout + ".layout")
+        params["gameTime"] = str(session.game_time)
+        return params
+
+    def add_user(self, game, user_id):
+        """
+        Adds `user_id` to a newly created game, as a player if the game has room and as a spectator otherwise.
+        Returns whether the user is spectating
+        """
+        if not game.is_full():
+            game.add_player(user_id)
+            print("Added human player", user_id, game.human_players)
+            spectating = False
+        else:
+            game.add_spectator(user_id)
+            print("Added spectator", user_id)
+            spectating = True
+        self.set_curr_room(user_id, game.id)
+        return spectating
+
+    def activate_created_game(self, game, smm=None):
+        """
+        Activates a newly created game on its first layout if it is ready, otherwise the game waits for players.
+        Returns whether the game was activated, and its live SMMs
+        """
+        print("Game is ready?", game.is_ready(), game.is_full())
+        if not game.is_ready():
+            self.waiting_games.put(game.id)
+            return False, smm
+        curr_layout = game.layouts.pop()
+        print("Activating!", game.human_players, game.npc_players, game.players)
+        game.activate(curr_layout=curr_layout, folder=LAYOUT_PATH)
+        if smm is None and self.live_smm:
+            smm = LiveSMM(curr_layout, game.visibility + str(game.visibility_range))
+        self.active_games.add(game.id)
+        return True, smm
+
+    def join_game(self, game, user_id):
+        """
+        Adds `user_id` as a player of a waiting game, and activates the game if it is ready. Returns whether the game
+        was activated, otherwise it keeps waiting for players, and the study session of the user, which logs the game
+        and can pause it
+        """
+        session = self.get_socket_session(user_id)
+        self.set_curr_room(user_id, game.id)
+        game.add_player(user_id)
+        if session is not None:
+            session.game_id = game.id
+        if not game.is_ready():
+            self.waiting_games.put(game.id)
+            return False, session
+        game.activate()
+        self.active_games.add(game.id)
+        return True, session
+
+    def leave_game(self, game, user_id):
+        """
+        Removes `user_id` from its game, the caller holds the game's lock. Returns whether the game was active before
+        the user left.
+
+        Leaving an active game force-ends the game for all other users, if they exist. Leaving a waiting game leaves
+        it waiting: the caller cleans it up if it is now empty, and tells the remaining users otherwise
+        """
+        # Update user data maintained by this server
+        self.leave_curr_room(user_id)
+
+        # Update game state maintained by game object
+        if user_id in game.players:
+            game.remove_player(user_id)
+        else:
+            game.remove_spectator(user_id)
+
+        # Whether the game was active before the user left
+        was_active = game.id in self.active_games
+
+        # Active -> Empty and Active -> Waiting end the game, Active -> Active keeps playing
+        if was_active and (game.is_empty() or not game.is_ready()):
+            game.deactivate()
+        return was_active
+
+    def enqueue_action(self, user_id, action):
+        game = self.get_curr_game(user_id)
+        if not game:
+            return
+        game.enqueue_action(user_id, action)
+
+    #############
+    # Transport #
+    #############
+
+    def negotiate_transport(self, user_id, data, binary_transport=True):
+        """
+        Content negotiation of a socket, clients that do not negotiate (or do not know the binary version) receive
+        JSON. Returns the response to the client
+        """
+        formats = data.get("formats", []) if isinstance(data, dict) else []
+        if binary_transport and "binary" in formats and data.get("version", None) == env.server.binary_codec.BINARY_VERSION:
+            self.binary_users.add(user_id)
+            return { "format" : "binary", "schema" : env.server.binary_codec.get_schema() }
+        self.binary_users.remove(user_id)
+        return { "format" : "json" }
+
+    def request_keyframe(self, user_id):
+        """
+        Sends the full state with the next state_pong of a socket's game, after the client missed a state_pong and
+        can not apply the following deltas
+        """
+        game = self.get_curr_game(user_id)
+        if not game:
+            return
+        encoder = self.state_encoders.get(game.id, None)
+        if encoder is not None:
+            encoder.request_keyframe()
+
+    def encode_state_pong(self, game, message):
+        """
+        Encodes a state_pong message once per transport. Returns the clients of the game that negotiated the binary
+        transport with their binary payload, and whether the rest of the game's room receives the JSON message
+        """
+        binary_users = [x for x in list(game.human_players) + list(game.spectators) if x in self.binary_users]
+        payload = None
+        if len(binary_users) > 0:
+            try:
+                start = perf_counter()
+                payload = env.server.binary_codec.encode(message)
+                if game.metrics is not None:
+                    game.metrics.record("binary encoding", perf_counter() - start)
+            except (TypeError, struct.error) as e:
+                # a value outside the binary schema, send this message as JSON to everyone
+                print("Failed to binary encode state_pong, sending JSON", e)
+                binary_users = []
+        return binary_users, payload, len(binary_users) < len(game.human_players) + len(game.spectators)
+
+    #############
+    # Game Loop #
+    #############
+
+    def start_game(self, game, fps):
+        """
+        Sets up the tick loop state of an activated game, before its tick loop is scheduled
+        """
+        event = Event()
+        event.set()
+        self.game_events[game.id] = event
+        self.state_encoders[game.id] = StateDeltaEncoder(self.keyframe_interval)
+        game.metrics = TickMetrics(fps=fps)
+        self.metrics[game.id] = game.metrics
+
+    def hold_paused(self, game, session=None):
+        """
+        Returns whether the session paused its game, so the tick loop skips this tick. When the game is unpaused,
+        its timer is pushed back by the time it was paused for
+        """
+        if session is None:
+            return False
+        if session.paused:
+            # if just paused, record the pause time
+            if session.pause_time == 0:
+                session.pause_time = timestamp()
+            return True
+        # if just unpaused, add to time remaining
+        if session.pause_time != 0:
+            game.start_time += timestamp() - session.pause_time
+            session.pause_time = 0
+        return False
+
+    def tick_game(self, game):
+        """
+        Cycles one tick of a game, returns the game's status
+        """
+        with game.lock:
+            with game.metrics.time("tick"):
+                return game.tick()
+
+    def get_reset_message(self, game):
+        """
+        Returns the reset_game message of a game in its RESET state
+        """
+        with game.lock:
+            data = game.get_data()
+        return { "state" : game.to_json(), "timeout" : game.reset_timeout, "data" : data}
+
+    def step_game(self, game, session=None, smm=None, tick=0):
+        """
+        Logs a game's state after a tick, hands it to the live SMMs, and returns the game's state_pong message: the
+        changes since the previous tick, or the full state on keyframes, with the SMMs' latest belief states
+
+        game (Game object):         Game that was just ticked
+        session (Session object):   Study session of the game's participant, games without a session are not logged
+        smm (LiveSMM object):       Optional SMMs updated with every tick, their latest belief states are sent with
+                                    the state. The models run on their own thread and never slow down the game loop
+        tick (int):                 Number of the tick, for the SMMs
+        """
+        metrics = game.metrics
+        with metrics.time("get state"):
+            state = game.get_state()
+        # log the state
+        if session is not None:
+            with metrics.time("logging"):
+                get_log_writer(session.user_id, **self.log_writer).write(state)
+
+        # hand the state to the live SMMs and send their latest belief states, which may be a few ticks old
+        belief_state = {}
+        smm_info = None
+        if smm is not None:
+            with metrics.time("smm"):
+                smm.submit(tick, state)
+                latest = smm.get_latest()
+            if latest is not None:
+                belief_state = latest["belief_states"]
+                smm_info = { "tick" : latest["tick"], "latency" : latest["latency"], "age" : latest["age"], "dropped" : latest["dropped"] }
+        # send the changes since the previous tick, or the full state on keyframes
+        with metrics.time("serialization"):
+            message = self.state_encoders[game.id].encode(state)
+        message["smm"] = belief_state
+        message["smm_info"] = smm_info
+        return message
+
+    def end_game(self, game, session=None, smm=None, ticks=0):
+        """
+        Wraps up a game whose tick loop ended: writes its metrics, stops its SMMs and detaches it from its session.
+        Returns the game's data for the end_game message, the caller then deactivates and cleans up the game
+        """
+        print("End game", game.id)
+        if self.metrics_path is not None:
+            name = (session.user_id if session is not None else "game") + "_" + str(game.id) + "_" + str(timestamp()) + ".json"
+            try:
+                game.metrics.dump(os.path.join(self.metrics_path, name), user=session.user_id if session is not None else None, layout=getattr(game, "curr_layout", None), ticks=ticks)
+            except OSError as e:
+                print("Failed to write the metrics of game", game.id, e)
+        if smm is not None:
+            smm.stop()
+            print("Live SMM", smm.get_stats())
+        if session is not None and session.game_id == game.id:
+            session.game_id = None
+        with game.lock:
+            return game.get_data()
@@ -0,0 +1,131 @@
+from threading import Lock, Thread
+from queue import Queue, Empty, Full
+from time import time
+import smm.smm
+
+class LiveSMM():
+    """
+    Runs the ground truth, agent and estimated human SMMs of a game on a worker thread, so the game loop never
+    waits for the models.
+
+    States are submitted every tick with `submit`, and only the latest state is kept: if the models fall behind,
+    states that have not started updating are dropped. The belief states of the last updated tick are read with
+    `get_latest`. The models are chained as in grader.py: the agent model observes the ground truth belief state,
+    and the estimated human model observes the agent's belief state
+    """
+
+    def __init__(self, layout, visibility, human_visibility="D4", agent="A0", human="A1"):
+        self.true_model = smm.smm.SMM("predicates", visibility="O20", agent=agent)  # robot model with full observability, ground truth
+        self.agent_model = smm.smm.SMM("predicates", visibility=visibility, agent=agent)  # robot model with partial observability
+        self.estimated_human_model = smm.smm.SMM("predicates", visibility=human_visibility, agent=human)  # estimated human model with partial observability
+        self.true_model.init_belief_state_from_file(layout)
+        self.first_view = True
+
+        # Holds at most the latest submitted (tick, state, submit time), None stops the worker
+        self.states = Queue(maxsize=1)
+        self.lock = Lock()
+        self.latest = None
+        self.num_updates = 0
+        self.num_dropped = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, tick, state):
+        """
+        Queues a game state (as returned by `OvercookedGame.get_state`) for the models, replacing a queued state
+        that has not started updating yet. Never blocks
+        """
+        self._put((tick, state, time()))
+
+    def get_latest(self):
+        """
+        Returns the result of the last updated tick, or None if no tick has been updated yet. The result has
+            tick: the tick of the state the models were updated with
+            belief_states: the visible belief state of each model, frozen snapshots that must not be modified
+            latency: seconds spent updating the models for the tick
+            age: seconds between submitting the state and the end of its update
+            dropped: number of states dropped so far because the models fell behind
+        """
+        with self.lock:
+            return self.latest
+
+    def get_stats(self):
+        """
+        Returns the number of updated and dropped ticks, and the mean and max model latency in seconds
+        """
+        with self.lock:
+            return {
+                "updated": self.num_updates,
+                "dropped": self.num_dropped,
+                "mean_latency": self.total_latency / self.num_updates if self.num_updates > 0 else 0,
+                "max_latency": self.max_latency,
+            }
+
+    def stop(self):
+        """
+        Stops the worker after its current update, dropping any queued state
+        """
+        self._put(None)
+        self.thread.join()
+
+    def _put(self, item):
+        try:
+            self.states.put(item, block=False)
+        except Full:
+            # Replace the stale state, this is the only producer so there is room after removing it
+            try:
+                stale = self.states.get(block=False)
+                if stale is not None:
+                    with self.lock:
+                        self.num_dropped += 1
+                else:
+                    item = None  # never replace a stop request
+            except Empty:
+                pass
+            self.states.put(item, block=False)
+
+    def _update(self, state):
+        state = smm.smm.convert_log_to_state(state)
+        self.true_model.update(state, debug=False)
+        true_belief_state = self.true_model.get_visible_belief_state()
+        if self.first_view:
+            # the agent and estimated human models start from the same copy of the ground truth
+            self.agent_model.set_belief_state(true_belief_state)
+            self.estimated_human_model.set_belief_state(self.agent_model.belief_state, copy=False)
+            self.first_view = False
+        self.agent_model.update(true_belief_state, debug=False)
+        agent_belief_state = self.agent_model.get_visible_belief_state()
+        self.estimated_human_model.update(agent_belief_state, debug=False)
+        return {
+            "true": true_belief_state,
+            "agent": agent_belief_state,
+            "estimated human": self.estimated_human_model.get_visible_belief_state(),
+        }
+
+    def _run(self):
+        while True:
+            item = self.states.get()
+            if item is None:
+                return
+            tick, state, submit_time = item
+            start_time = time()
+            try:
+                belief_states = self._update(state)
+            except Exception as e:
+                print("Live SMM failed to update tick", tick, e)
+                continue
+            end_time = time()
+            with self.lock:
+                self.num_updates += 1
+                self.total_latency += end_time - start_time
+                self.max_latency = max(self.max_latency, end_time - start_time)
+                self.latest = {
+                    "tick": tick,
+                    "belief_states": belief_states,
+                    "latency": end_time - start_time,
+                    "age": end_time - submit_time,
+                    "dropped": self.num_dropped,
+                }
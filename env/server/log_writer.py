@@ -0,0 +1,243 @@
+from threading import Lock, Thread
+from queue import Queue, Empty
+from time import time
+import os, re, ast, gzip, zlib, pickle
+
+# Path of the user logs, rotated segments are moved to the rotated folder inside it
+LOG_PATH = "env/server/logs/"
+ROTATED_FOLDER = "rotated"
+
+# Log formats: text logs have one str(record) per line, binary logs are gzip compressed streams of pickled records
+TEXT_EXTENSION = ".txt"
+BINARY_EXTENSION = ".pkl.gz"
+EXTENSIONS = [TEXT_EXTENSION, BINARY_EXTENSION]
+
+
+class LogWriter():
+    """
+    Appends a session's log records (game states and client events) to the session's log file on a background
+    thread, so the game loop and request handlers never wait on the disk.
+
+    Records are queued in a bounded queue, and written and flushed in batches of up to `batch_size` records, or
+    every `flush_interval` seconds. When the queue is full, `write` waits for the writer to catch up rather than
+    dropping records. The active log is rotated into the rotated folder once it reaches `max_bytes` or has been
+    open for `max_age` seconds, use `get_log_files` or `iter_log_records` to read a log across its segments.
+
+    Records must not be modified after they are written, they are serialized by the background thread
+    """
+
+    def __init__(self, user, log_path=LOG_PATH, binary=False, max_queue=1000, batch_size=50, flush_interval=1.0, max_bytes=64 * 1024 * 1024, max_age=None):
+        self.user = user
+        self.log_path = log_path
+        self.binary = binary
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.path = os.path.join(log_path, user + (BINARY_EXTENSION if binary else TEXT_EXTENSION))
+        self.records = Queue(maxsize=max_queue)
+        self.file = None
+        self.opened_time = None
+        self.closed = False
+
+        os.makedirs(log_path, exist_ok=True)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        """
+        Queues a record to be appended to the log
+        """
+        if self.closed:
+            raise ValueError("Cannot write to the closed log of " + self.user)
+        self.records.put(record)
+
+    def flush(self):
+        """
+        Waits until every queued record has been written and flushed
+        """
+        self.records.join()
+
+    def close(self):
+        """
+        Writes the queued records and closes the log
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.records.put(None)
+        self.thread.join()
+
+    def _open(self):
+        if self.binary:
+            self.file = gzip.open(self.path, "ab")
+        else:
+            self.file = open(self.path, "a")
+        self.opened_time = time()
+
+    def _write_batch(self, batch):
+        if self.file is None:
+            self._open()
+        for record in batch:
+            if self.binary:
+                pickle.dump(record, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                self.file.write(str(record) + "\n")
+        self.file.flush()
+
+    def _should_rotate(self):
+        if self.file is None:
+            return False
+        if self.max_age is not None and time() - self.opened_time >= self.max_age:
+            return True
+        return self.max_bytes is not None and os.path.getsize(self.path) >= self.max_bytes
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        rotated_path = os.path.join(self.log_path, ROTATED_FOLDER)
+        os.makedirs(rotated_path, exist_ok=True)
+        segments = get_rotated_segments(self.user, self.log_path)
+        sequence = segments[-1][0] + 1 if len(segments) > 0 else 1
+        extension = BINARY_EXTENSION if self.binary else TEXT_EXTENSION
+        os.replace(self.path, os.path.join(rotated_path, self.user + "." + str(sequence).zfill(6) + extension))
+
+    def _run(self):
+        done = False
+        while not done:
+            # Wait for a record, then take whatever else is queued up to the batch size
+            try:
+                batch = [self.records.get(timeout=self.flush_interval)]
+            except Empty:
+                if self._should_rotate():
+                    self._rotate()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get(block=False))
+                except Empty:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            try:
+                if len(batch) > 0:
+                    self._write_batch(batch)
+                if self._should_rotate():
+                    self._rotate()
+            except Exception as e:
+                print("Failed to write", len(batch), "records to the log of", self.user, e)
+            finally:
+                for _ in range(len(batch) + (1 if done else 0)):
+                    self.records.task_done()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Log writers of the sessions, by user
+WRITERS = {}
+WRITERS_LOCK = Lock()
+
+def get_log_writer(user, **kwargs):
+    """
+    Returns the log writer of a user, starting one with the given parameters if the user does not have one
+    """
+    with WRITERS_LOCK:
+        if user not in WRITERS or WRITERS[user].closed:
+            WRITERS[user] = LogWriter(user, **kwargs)
+        return WRITERS[user]
+
+def close_log_writers():
+    """
+    Writes every queued record and closes all log writers
+    """
+    with WRITERS_LOCK:
+        writers = list(WRITERS.values())
+        WRITERS.clear()
+    for writer in writers:
+        writer.close()
+
+
+###############
+# Log Readers #
+###############
+
+def get_rotated_segments(user, log_path=LOG_PATH):
+    """
+    Returns the (sequence number, path) of a user's rotated log segments, in the order they were written
+    """
+    rotated_path = os.path.join(log_path, ROTATED_FOLDER)
+    if not os.path.isdir(rotated_path):
+        return []
+    pattern = re.compile(re.escape(user) + r"\.(\d+)(" + "|".join([re.escape(x) for x in EXTENSIONS]) + ")$")
+    segments = []
+    for name in os.listdir(rotated_path):
+        match = pattern.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(rotated_path, name)))
+    return sorted(segments)
+
+def get_log_files(user, log_path=LOG_PATH):
+    """
+    Returns the paths of a user's log segments in the order they were written: the rotated segments, then the
+    active text log, then the active binary log
+    """
+    paths = [path for _, path in get_rotated_segments(user, log_path)]
+    for extension in EXTENSIONS:
+        path = os.path.join(log_path, user + extension)
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
+
+def get_log_users(log_path=LOG_PATH):
+    """
+    Returns the users that have a log, active or rotated, sorted
+    """
+    users = set()
+    for name in os.listdir(log_path):
+        for extension in EXTENSIONS:
+            if name.endswith(extension):
+                users.add(name[:-len(extension)])
+    rotated_path = os.path.join(log_path, ROTATED_FOLDER)
+    if os.path.isdir(rotated_path):
+        pattern = re.compile(r"(.+)\.(\d+)(" + "|".join([re.escape(x) for x in EXTENSIONS]) + ")$")
+        for name in os.listdir(rotated_path):
+            match = pattern.match(name)
+            if match:
+                users.add(match.group(1))
+    return sorted(users)
+
+def get_log_fingerprint(user, log_path=LOG_PATH):
+    """
+    Returns the (path, size, modification time) of each of a user's log segments, which changes whenever the log does
+    """
+    fingerprint = []
+    for path in get_log_files(user, log_path):
+        stat = os.stat(path)
+        fingerprint.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+def iter_log_file(path):
+    """
+    Iterates over the records of a log segment. A binary segment that was cut off while being written ends at its
+    last complete record
+    """
+    if path.endswith(BINARY_EXTENSION):
+        with gzip.open(path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except (EOFError, gzip.BadGzipFile, zlib.error):
+                    return
+    else:
+        with open(path, "r") as f:
+            for line in f:
+                yield ast.literal_eval(line)
+
+def iter_log_records(user, log_path=LOG_PATH):
+    """
+    Iterates over every record of a user's log, across its segments, in the order they were written
+    """
+    for path in get_log_files(user, log_path):
+        yield from iter_log_file(path)
@@ -0,0 +1,112 @@
+from threading import Lock
+from collections import deque
+from time import perf_counter, time
+import os, json
+import numpy as np
+
+# Upper bounds (in milliseconds) of the histogram bins of the phase timings, the last bin has no upper bound
+HISTOGRAM_BINS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200]
+
+class TickMetrics():
+    """
+    Per-phase timers of a game's tick loop, to see where each frame's budget (1/fps seconds) goes.
+
+    Each phase keeps its last `window` durations, so the summaries and histograms are rolling. Phases are timed with
+    `record` or the `time` context manager, and may be timed from any thread (e.g. the NPC policy threads). The
+    phases of the server's tick loop are
+        tick: the whole of `Game.tick`, which includes
+            apply actions: building the joint action and updating the score, excluding the state transition
+            state transition: `OvercookedGridworld.get_state_transition`
+        get state: the whole of `OvercookedGame.get_state`, which includes
+            visibility: the visibility grid of `OvercookedGame.get_visibility`
+        logging: queuing the state to the session's log writer
+        smm: handing the state to the live SMMs and reading their latest belief states
+        serialization: delta encoding the state_pong message
+        emit: sending the state_pong message, including socketio's JSON encoding, which includes
+            binary encoding: encoding the message once for the clients that negotiated the binary transport
+        frame: the whole tick loop step, from the tick to the end of the emit
+        npc policy: one forward pass of an NPC policy, on the NPC executor's thread or process
+        npc latency: from submitting a state to the NPC executor to enqueueing the NPC's action
+    """
+
+    def __init__(self, fps=10, window=1000):
+        self.fps = fps
+        self.window = window
+        self.phases = {}
+        self.lock = Lock()
+        self.start_time = time()
+
+    def record(self, phase, seconds):
+        """
+        Records a duration of a phase
+        """
+        with self.lock:
+            durations = self.phases.get(phase, None)
+            if durations is None:
+                durations = deque(maxlen=self.window)
+                self.phases[phase] = durations
+            durations.append(seconds)
+
+    def time(self, phase):
+        """
+        Returns a context manager that records the duration of its block as a phase
+        """
+        return PhaseTimer(self, phase)
+
+    def get_summary(self):
+        """
+        Returns the rolling summary of each phase: the number of samples, the mean, percentiles and max in
+        milliseconds, the mean as a percent of the frame budget, and the histogram of the durations keyed by the
+        bins' upper bounds in milliseconds
+        """
+        with self.lock:
+            phases = {phase : np.array(self.phases[phase]) * 1000 for phase in self.phases}
+        budget = 1000 / self.fps
+        summary = {}
+        for phase, durations in phases.items():
+            if len(durations) == 0:
+                continue
+            p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+            counts = np.histogram(durations, bins=[0] + HISTOGRAM_BINS + [np.inf])[0]
+            summary[phase] = {
+                "samples": len(durations),
+                "mean": float(np.mean(durations)),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                "max": float(np.max(durations)),
+                "budget %": float(100 * np.mean(durations) / budget),
+                "histogram": {str(bound) : int(count) for bound, count in zip(HISTOGRAM_BINS + ["inf"], counts)},
+            }
+        return {"fps": self.fps, "budget": budget, "window": self.window, "start_time": self.start_time, "phases": summary}
+
+    def dump(self, path, **info):
+        """
+        Writes the summary, with any extra info (e.g. the user and layout), to a JSON file
+        """
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(dict(info, **self.get_summary()), f, indent=2)
+
+
+class PhaseTimer():
+    """
+    Context manager that records the duration of its block as a phase of a `TickMetrics`
+    """
+
+    __slots__ = ["metrics", "phase", "start"]
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.record(self.phase, perf_counter() - self.start)
+        return False
@@ -0,0 +1,146 @@
+from collections import deque
+
+# Moves in the order the FSM bots expand neighbors: up, right, down, left (0,0 is at the top left)
+MOVES = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+
+class NavigationGrid():
+    """
+    Shortest paths between the walkable cells of a layout, precomputed so the FSM bots plan with lookups.
+
+    Walkable cells are the floor (' ') and the players' start cells (digits). For every pair of walkable cells the
+    grid stores the distance and the next hop, found with a BFS from each cell, and it indexes the positions of each
+    terrain type (e.g. every 'P' pot) in row-major order. Positions are (x, y).
+
+    The table ignores the players. Teammates are an overlay: a path that runs into one of the `blocked` cells is
+    replanned with a BFS that avoids them, which only happens when a teammate stands on the precomputed path
+    """
+
+    def __init__(self, terrain_mtx):
+        self.height = len(terrain_mtx)
+        self.width = len(terrain_mtx[0]) if self.height > 0 else 0
+        self.floor = set()
+        self.appliances = {}
+        for row in range(self.height):
+            for col in range(len(terrain_mtx[row])):
+                terrain = terrain_mtx[row][col]
+                if terrain == ' ' or terrain.isdigit():
+                    self.floor.add((col, row))
+                self.appliances.setdefault(terrain, []).append((col, row))
+        self.distances = {}
+        self.next_hops = {}
+        for position in self.floor:
+            self.distances[position] = {}
+            self.next_hops[position] = {}
+        for goal in self.floor:
+            self._fill_from(goal)
+
+    def _fill_from(self, goal):
+        # a BFS from the goal: the cell a neighbor was reached from is the neighbor's next hop towards the goal
+        self.distances[goal][goal] = 0
+        self.next_hops[goal][goal] = goal
+        frontier = deque([goal])
+        while len(frontier) > 0:
+            loc = frontier.popleft()
+            for neighbor in self.get_neighbors(loc):
+                if goal not in self.distances[neighbor]:
+                    self.distances[neighbor][goal] = self.distances[loc][goal] + 1
+                    self.next_hops[neighbor][goal] = loc
+                    frontier.append(neighbor)
+
+    def is_floor(self, loc):
+        """
+        Whether a cell is walkable, ignoring the players
+        """
+        return (loc[0], loc[1]) in self.floor
+
+    def get_neighbors(self, loc):
+        """
+        Returns the walkable cells next to a cell
+        """
+        return [(loc[0] + dx, loc[1] + dy) for dx, dy in MOVES if (loc[0] + dx, loc[1] + dy) in self.floor]
+
+    def get_appliances(self, terrain):
+        """
+        Returns the positions of a terrain type (e.g. 'P' for pots), in row-major order
+        """
+        return self.appliances.get(terrain, [])
+
+    def get_distance(self, curr, goal):
+        """
+        Returns the number of moves between two walkable cells, or None if there is no path
+        """
+        return self.distances.get(curr, {}).get(goal, None)
+
+    def get_path(self, curr, goal, blocked=()):
+        """
+        Returns the path from a walkable cell to a goal cell (e.g. a counter or an appliance) as [goal, ..., curr]:
+        the walkable cells that lead next to the goal, in reverse order. The goal is reached from any cell next to
+        it. Returns [] if there is no path that avoids the blocked cells, or if the current cell is the goal
+        """
+        curr, goal = (curr[0], curr[1]), (goal[0], goal[1])
+        if curr == goal:
+            return []
+        distances = self.distances.get(curr, None)
+        if distances is None:
+            return self._search(curr, goal, blocked)
+        # the closest cell next to the goal, ignoring the players
+        end = None
+        for neighbor in self.get_neighbors(goal):
+            if neighbor in blocked and neighbor != curr:
+                continue
+            if neighbor in distances and (end is None or distances[neighbor] < distances[end]):
+                end = neighbor
+        if end is None:
+            return []
+        # walk the next hops, replan around the teammates if one is in the way
+        path = [curr]
+        while path[-1] != end:
+            loc = self.next_hops[path[-1]][end]
+            if loc in blocked:
+                return self._search(curr, goal, blocked)
+            path.append(loc)
+        path.append(goal)
+        path.reverse()
+        return path
+
+    def _search(self, curr, goal, blocked):
+        # BFS from the current cell that avoids the blocked cells, until a cell next to the goal is reached
+        parents = {curr: None}
+        frontier = deque([curr])
+        while len(frontier) > 0:
+            loc = frontier.popleft()
+            if abs(loc[0] - goal[0]) + abs(loc[1] - goal[1]) == 1:
+                path = [goal]
+                while loc is not None:
+                    path.append(loc)
+                    loc = parents[loc]
+                return path
+            for neighbor in self.get_neighbors(loc):
+                if neighbor not in parents and neighbor not in blocked:
+                    parents[neighbor] = loc
+                    frontier.append(neighbor)
+        return []
+
+
+class NavigationCache():
+    """
+    Cache of the navigation grid of each layout's terrain, shared by every game in the process
+    """
+
+    def __init__(self):
+        self.grids = {}
+
+    def get_grid(self, terrain_mtx):
+        """
+        Returns the navigation grid of a terrain, building it the first time the terrain is seen
+        """
+        key = tuple(tuple(row) for row in terrain_mtx)
+        grid = self.grids.get(key, None)
+        if grid is None:
+            grid = NavigationGrid(terrain_mtx)
+            self.grids[key] = grid
+        return grid
+
+
+# Navigation grids shared by every game in the process
+NAVIGATION = NavigationCache()
@@ -0,0 +1,369 @@
+from abc import ABC, abstractmethod
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from queue import Empty
+import multiprocessing, traceback, asyncio
+from env.server.metrics import TickMetrics
+
+# Names of the NPC execution strategies, see `make_npc_executor`
+STRATEGIES = ["inline", "threads", "processes", "asyncio"]
+
+
+class NPCExecutor(ABC):
+    """
+    Runs the forward passes of the NPC policies of games, and hands the resulting actions back to the games.
+
+    A game calls `start` when it is activated, `submit` with its latest state every `ticks_per_ai_action` ticks, and
+    `stop` when it is deactivated. Each executor reports its own latency metrics:
+        npc policy: one forward pass of an NPC policy
+        npc latency: from submitting a state to enqueueing the NPC's action, including the wait for a worker
+    The game's own metrics, if any, record the same phases
+    """
+
+    name = None
+
+    def __init__(self, fps=10):
+        self.metrics = TickMetrics(fps=fps)
+        self.lock = Lock()
+        self.num_submitted = 0
+        self.num_completed = 0
+        self.num_dropped = 0
+        self.started = set()  # ids of the started games, the actions of the stopped games are dropped
+
+    def start(self, game):
+        """
+        Prepares to run the NPC policies of a game
+        """
+        with self.lock:
+            self.started.add(id(game))
+
+    @abstractmethod
+    def submit(self, game, npc_id, state):
+        """
+        Computes the NPC's next action from a state
+        """
+        pass
+
+    def stop(self, game):
+        """
+        Forgets a game, the actions computed for it from now on are dropped, including those of the forward passes
+        that are already running
+        """
+        with self.lock:
+            self.started.discard(id(game))
+
+    def shutdown(self):
+        """
+        Stops the workers of the executor
+        """
+        pass
+
+    def get_stats(self):
+        """
+        Returns the strategy, the number of submitted, completed and dropped forward passes (a submitted state is
+        dropped when a newer state of the same NPC replaces it before it starts, or when its game is stopped before it
+        completes), and the latency summaries
+        """
+        with self.lock:
+            stats = {"strategy": self.name, "submitted": self.num_submitted, "completed": self.num_completed, "dropped": self.num_dropped}
+        stats["latency"] = self.metrics.get_summary()["phases"]
+        return stats
+
+    def _complete(self, game, npc_id, action, submit_time, compute_time):
+        latency = perf_counter() - submit_time
+        with self.lock:
+            if id(game) not in self.started:
+                # the game was stopped while the forward pass ran
+                self.num_dropped += 1
+                return
+            self.num_completed += 1
+        game.enqueue_npc_action(npc_id, action)
+        for metrics in [self.metrics, game.metrics]:
+            if metrics is not None:
+                metrics.record("npc policy", compute_time)
+                metrics.record("npc latency", latency)
+
+
+class InlineNPCExecutor(NPCExecutor):
+    """
+    Runs the NPC policies on the thread that submits the state, inside the game's `apply_actions`. The action is
+    used on the next tick, and a simulated game is deterministic for its random seed, but a slow policy slows down
+    the tick loop
+    """
+
+    name = "inline"
+
+    def submit(self, game, npc_id, state):
+        with self.lock:
+            self.num_submitted += 1
+        submit_time = perf_counter()
+        action, _ = game.npc_policies[npc_id].action(state)
+        self._complete(game, npc_id, action, submit_time, perf_counter() - submit_time)
+
+
+class ThreadPoolNPCExecutor(NPCExecutor):
+    """
+    Runs the NPC policies of every game on a shared pool of worker threads, so the number of threads does not grow
+    with the number of games. At most one forward pass of an NPC runs at a time: a state submitted while the NPC's
+    previous forward pass is running waits for it, and replaces any older state that is still waiting
+    """
+
+    name = "threads"
+
+    def __init__(self, num_workers=4, fps=10):
+        super(ThreadPoolNPCExecutor, self).__init__(fps=fps)
+        self.num_workers = num_workers
+        self.pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="npc-worker")
+        self.running = set()  # (game, npc id) keys with a forward pass running
+        self.pending = {}  # (game, npc id) key to the (game, state, submit time) waiting for the running forward pass
+
+    def submit(self, game, npc_id, state):
+        key = (id(game), npc_id)
+        submit_time = perf_counter()
+        with self.lock:
+            self.num_submitted += 1
+            if key in self.running:
+                if key in self.pending:
+                    self.num_dropped += 1
+                self.pending[key] = (game, state, submit_time)
+                return
+            self.running.add(key)
+        self.pool.submit(self._run, key, game, npc_id, state, submit_time)
+
+    def stop(self, game):
+        super(ThreadPoolNPCExecutor, self).stop(game)
+        with self.lock:
+            for key in [x for x in self.pending if x[0] == id(game)]:
+                del self.pending[key]
+                self.num_dropped += 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+    def _run(self, key, game, npc_id, state, submit_time):
+        try:
+            start = perf_counter()
+            action, _ = game.npc_policies[npc_id].action(state)
+            self._complete(game, npc_id, action, submit_time, perf_counter() - start)
+        except Exception:
+            traceback.print_exc()
+        # run the state that waited for this forward pass, if any
+        with self.lock:
+            waiting = self.pending.pop(key, None)
+            if waiting is None:
+                self.running.discard(key)
+                return
+        game, state, submit_time = waiting
+        self.pool.submit(self._run, key, game, npc_id, state, submit_time)
+
+
+class AsyncioNPCExecutor(NPCExecutor):
+    """
+    Runs the NPC policies of the asyncio server (see async_app.py). Each forward pass runs on a shared pool of worker
+    threads and is awaited by a task on the server's event loop, which then hands the action to the game, so the tick
+    loop never waits for a policy and the actions are enqueued on the event loop's thread. Like the thread pool, at
+    most one forward pass of an NPC runs at a time and a newer state replaces an older one that is still waiting.
+
+    `submit` must be called from the event loop's thread, i.e. from the ticks of the asyncio server's games
+    """
+
+    name = "asyncio"
+
+    def __init__(self, num_workers=4, fps=10):
+        super(AsyncioNPCExecutor, self).__init__(fps=fps)
+        self.num_workers = num_workers
+        self.pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="npc-worker")
+        self.running = set()  # (game, npc id) keys with a forward pass running
+        self.pending = {}  # (game, npc id) key to the (game, state, submit time) waiting for the running forward pass
+        self.tasks = set()  # running forward pass tasks, the event loop only keeps weak references to them
+
+    def submit(self, game, npc_id, state):
+        key = (id(game), npc_id)
+        submit_time = perf_counter()
+        with self.lock:
+            self.num_submitted += 1
+            if key in self.running:
+                if key in self.pending:
+                    self.num_dropped += 1
+                self.pending[key] = (game, state, submit_time)
+                return
+            self.running.add(key)
+        task = asyncio.get_running_loop().create_task(self._run(key, game, npc_id, state, submit_time))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def stop(self, game):
+        super(AsyncioNPCExecutor, self).stop(game)
+        with self.lock:
+            for key in [x for x in self.pending if x[0] == id(game)]:
+                del self.pending[key]
+                self.num_dropped += 1
+
+    def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        self.pool.shutdown(wait=True)
+
+    async def _run(self, key, game, npc_id, state, submit_time):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                action, compute_time = await loop.run_in_executor(self.pool, _timed_action, game.npc_policies[npc_id], state)
+                self._complete(game, npc_id, action, submit_time, compute_time)
+            except Exception:
+                traceback.print_exc()
+            # run the state that waited for this forward pass, if any
+            with self.lock:
+                waiting = self.pending.pop(key, None)
+                if waiting is None:
+                    self.running.discard(key)
+                    return
+            game, state, submit_time = waiting
+
+
+def _timed_action(policy, state):
+    # one forward pass of a policy on a worker thread, and its duration
+    start = perf_counter()
+    action, _ = policy.action(state)
+    return action, perf_counter() - start
+
+
+class ProcessPoolNPCExecutor(NPCExecutor):
+    """
+    Runs the NPC policies in worker processes, for policies heavy enough that the GIL would slow down the tick loops.
+
+    Each NPC is assigned to a worker when its game starts, and the worker keeps a copy of the NPC's policy (pickled
+    with the parts of the game it reads, see `FSMAI.__getstate__`), so the policy's own state carries over between
+    forward passes in the worker and the game's copy is not updated. A worker drains its requests before running
+    them, so only the latest state of each NPC is run. Actions are collected by a thread of the server process.
+
+    The workers are spawned when the first game starts, so importing the server (e.g. in a spawned worker) does not
+    spawn processes
+    """
+
+    name = "processes"
+
+    def __init__(self, num_workers=2, fps=10):
+        super(ProcessPoolNPCExecutor, self).__init__(fps=fps)
+        self.num_workers = num_workers
+        self.results = None
+        self.requests = []
+        self.processes = []
+        self.collector = None
+        self.games = {}  # (game, npc id) key to the (game, worker index) of each started NPC
+        self.next_worker = 0
+
+    def _start_workers(self):
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        for i in range(self.num_workers):
+            requests = context.Queue()
+            process = context.Process(target=_run_npc_worker, args=(requests, self.results), name="npc-worker-" + str(i), daemon=True)
+            process.start()
+            self.requests.append(requests)
+            self.processes.append(process)
+        self.collector = Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def start(self, game):
+        super(ProcessPoolNPCExecutor, self).start(game)
+        with self.lock:
+            if self.collector is None:
+                self._start_workers()
+        for npc_id, policy in game.npc_policies.items():
+            key = (id(game), npc_id)
+            with self.lock:
+                worker = self.next_worker
+                self.next_worker = (self.next_worker + 1) % self.num_workers
+                self.games[key] = (game, worker)
+            self.requests[worker].put(("start", key, policy))
+
+    def submit(self, game, npc_id, state):
+        key = (id(game), npc_id)
+        with self.lock:
+            self.num_submitted += 1
+            _, worker = self.games[key]
+        self.requests[worker].put(("act", key, (state, perf_counter())))
+
+    def stop(self, game):
+        super(ProcessPoolNPCExecutor, self).stop(game)
+        with self.lock:
+            keys = [x for x in self.games if x[0] == id(game)]
+            workers = [self.games.pop(key)[1] for key in keys]
+        for key, worker in zip(keys, workers):
+            self.requests[worker].put(("stop", key, None))
+
+    def shutdown(self):
+        if self.collector is None:
+            return
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        self.collector.join()
+
+    def _collect(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            key, action, submit_time, compute_time, dropped = result
+            with self.lock:
+                self.num_dropped += dropped
+                game = self.games.get(key, (None, None))[0]
+            if game is not None:
+                self._complete(game, key[1], action, submit_time, compute_time)
+
+
+def _run_npc_worker(requests, results):
+    # the loop of a process pool worker: keeps the policies of its NPCs and runs the latest state of each NPC
+    policies = {}
+    while True:
+        batch = [requests.get()]
+        while True:
+            try:
+                batch.append(requests.get(block=False))
+            except Empty:
+                break
+        latest = {}
+        dropped = {}
+        for request in batch:
+            if request is None:
+                return
+            kind, key, payload = request
+            if kind == "start":
+                policies[key] = payload
+            elif kind == "stop":
+                policies.pop(key, None)
+                latest.pop(key, None)
+            elif kind == "act":
+                if key in latest:
+                    dropped[key] = dropped.get(key, 0) + 1
+                latest[key] = payload
+        for key, (state, submit_time) in latest.items():
+            if key not in policies:
+                continue
+            try:
+                start = perf_counter()
+                action, _ = policies[key].action(state)
+                results.put((key, action, submit_time, perf_counter() - start, dropped.get(key, 0)))
+            except Exception:
+                traceback.print_exc()
+
+
+def make_npc_executor(strategy="threads", num_workers=4, fps=10):
+    """
+    Returns an NPC executor of a strategy: "inline", "threads", "processes", or "asyncio" (only for the asyncio
+    server)
+    """
+    if strategy == "inline":
+        return InlineNPCExecutor(fps=fps)
+    if strategy == "threads":
+        return ThreadPoolNPCExecutor(num_workers=num_workers, fps=fps)
+    if strategy == "processes":
+        return ProcessPoolNPCExecutor(num_workers=num_workers, fps=fps)
+    if strategy == "asyncio":
+        return AsyncioNPCExecutor(num_workers=num_workers, fps=fps)
+    raise ValueError("Unknown NPC execution strategy " + str(strategy) + ", strategies are: " + ", ".join(STRATEGIES))
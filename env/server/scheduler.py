@@ -0,0 +1,177 @@
+from threading import Condition, Thread
+from time import time
+import heapq, itertools, traceback, asyncio
+
+class TickScheduler():
+    """
+    Runs the tick loops of many games on a fixed number of worker threads, so the number of threads does not grow
+    with the number of games.
+
+    A task is a generator that runs one step (e.g. one game tick) each time it is resumed, and yields the number of
+    seconds to wait before it is resumed again. A task is run by at most one worker at a time, and is dropped when it
+    returns or raises. Tasks that are due are resumed in the order they became due, so when the workers are all busy
+    every game slows down evenly instead of one game starving the others
+    """
+
+    def __init__(self, num_workers=4):
+        self.num_workers = num_workers
+        self.tasks = []  # heap of (due time, sequence, task)
+        self.sequence = itertools.count()  # breaks ties between tasks due at the same time, in scheduling order
+        self.condition = Condition()
+        self.num_tasks = 0
+        self.stopped = False
+        self.threads = []
+        for i in range(num_workers):
+            t = Thread(target=self._run, name="tick-worker-" + str(i), daemon=True)
+            self.threads.append(t)
+            t.start()
+
+    def start(self, task, delay=0):
+        """
+        Schedules a task to run its first step after `delay` seconds
+        """
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("Cannot start a task on a stopped scheduler")
+            self.num_tasks += 1
+            self._push(task, time() + delay)
+
+    def get_stats(self):
+        """
+        Returns the number of workers, the number of running tasks, and the number of tasks that are due but waiting
+        for a free worker
+        """
+        with self.condition:
+            now = time()
+            return {
+                "workers": self.num_workers,
+                "tasks": self.num_tasks,
+                "overdue": len([x for x in self.tasks if x[0] <= now]),
+            }
+
+    def stop(self):
+        """
+        Stops the workers after their current step, the remaining tasks are not resumed
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for t in self.threads:
+            t.join()
+
+    def _push(self, task, due_time):
+        heapq.heappush(self.tasks, (due_time, next(self.sequence), task))
+        self.condition.notify()
+
+    def _run(self):
+        while True:
+            # wait for the earliest task to be due
+            with self.condition:
+                while not self.stopped and (len(self.tasks) == 0 or self.tasks[0][0] > time()):
+                    self.condition.wait(None if len(self.tasks) == 0 else self.tasks[0][0] - time())
+                if self.stopped:
+                    return
+                _, _, task = heapq.heappop(self.tasks)
+
+            # run one step of the task outside the lock, then reschedule it
+            try:
+                delay = next(task)
+            except StopIteration:
+                delay = None
+            except Exception:
+                traceback.print_exc()
+                delay = None
+            with self.condition:
+                if delay is None:
+                    self.num_tasks -= 1
+                elif not self.stopped:
+                    self._push(task, time() + delay)
+
+
+class AsyncTickScheduler():
+    """
+    Runs the tick loops of many games on one asyncio event loop, on a shared fixed-rate clock.
+
+    A task is an async generator that runs one step each time it is resumed and yields the number of seconds to wait
+    before it is resumed again, like the tasks of `TickScheduler`. The clock wakes up every 1/fps seconds and resumes
+    the tasks that are due in that frame concurrently, so a step that awaits (e.g. emitting to a slow client) does not
+    hold up the other games. Delays are rounded to whole frames. When the steps of a frame overrun the frame, the
+    missed frames are skipped rather than run late back to back, and counted as late frames.
+
+    The clock runs while there are tasks, and must be started from the event loop's thread
+    """
+
+    def __init__(self, fps=10):
+        self.fps = fps
+        self.period = 1 / fps
+        self.tasks = {}  # task to the frame it is due in
+        self.frame = 0  # current frame of the clock
+        self.num_late_frames = 0
+        self.frame_time = 0  # seconds the steps of the last frame took
+        self.clock = None
+        self.stopped = False
+
+    def start(self, task, delay=0):
+        """
+        Schedules a task to run its first step in the first frame after `delay` seconds
+        """
+        if self.stopped:
+            raise RuntimeError("Cannot start a task on a stopped scheduler")
+        self.tasks[task] = self.frame + max(1, round(delay * self.fps))
+        if self.clock is None:
+            self.clock = asyncio.get_running_loop().create_task(self._run())
+
+    def get_stats(self):
+        """
+        Returns the frame rate, the number of running tasks, the number of frames run and skipped, and the duration
+        of the last frame in milliseconds
+        """
+        return {
+            "fps": self.fps,
+            "tasks": len(self.tasks),
+            "frames": self.frame,
+            "late frames": self.num_late_frames,
+            "frame time": self.frame_time * 1000,
+        }
+
+    def stop(self):
+        """
+        Stops the clock, the remaining tasks are not resumed
+        """
+        self.stopped = True
+        self.tasks.clear()
+        if self.clock is not None:
+            self.clock.cancel()
+            self.clock = None
+
+    async def _step(self, task):
+        # run one step of the task, then reschedule it
+        try:
+            delay = await task.__anext__()
+        except StopAsyncIteration:
+            delay = None
+        except Exception:
+            traceback.print_exc()
+            delay = None
+        if delay is None:
+            self.tasks.pop(task, None)
+        elif task in self.tasks:
+            self.tasks[task] = self.frame + max(1, round(delay * self.fps))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        start_time = loop.time() - self.frame * self.period
+        while not self.stopped:
+            if len(self.tasks) == 0:
+                self.clock = None
+                return
+            frame_start = loop.time()
+            due = [task for task, frame in self.tasks.items() if frame <= self.frame]
+            await asyncio.gather(*[self._step(task) for task in due])
+            now = loop.time()
+            self.frame_time = now - frame_start
+            # the next frame on the clock that has not started yet
+            next_frame = max(self.frame + 1, int((now - start_time) / self.period) + 1)
+            self.num_late_frames += next_frame - self.frame - 1
+            self.frame = next_frame
+            await asyncio.sleep(max(0, start_time + self.frame * self.period - loop.time()))
@@ -0,0 +1,47 @@
+from threading import Lock
+
+# Layout and game time (in seconds) of each study stage
+STAGES = {
+    "intro": ("RSMM1", 60),
+    "practice": ("RSMM2", 93),
+    "round1": ("RSMM3", 93),
+    "round2": ("RSMM4", 93),
+    "round3": ("RSMM5", 93),
+    "round4": ("RSMM6", 93),
+}
+
+class Session():
+    """
+    State of one participant's study session, so a server can run the sessions of many participants at once.
+
+    A session is identified by the participant's user id (the `user_id` URL parameter), and outlives the sockets
+    of the participant's page: reloading the page starts over with a fresh session of the same user
+    """
+
+    def __init__(self, user_id, layout="RSMM1", game_time=0):
+        """
+        user_id (str):      Identifier of the participant, also the name of the session's log
+        layout (str):       Layout of the session's next game, set by the study stage
+        game_time (int):    Length of the session's next game in seconds, set by the study stage
+        paused (bool):      Whether the participant paused the session's game (e.g. to answer questions)
+        pause_time (int):   Timestamp the game was paused at, 0 if the game is not paused
+        game_id (int):      Id of the session's current game, or None. The game's socketio room is get_room(game_id) in game_server.py
+        lock (Lock):        Serializes updates to the session
+        """
+        self.user_id = user_id
+        self.layout = layout
+        self.game_time = game_time
+        self.paused = False
+        self.pause_time = 0
+        self.game_id = None
+        self.lock = Lock()
+
+    def set_stage(self, stage):
+        """
+        Sets the layout and game time of the session's next game from a study stage, other stages keep the current
+        layout. Returns the layout
+        """
+        with self.lock:
+            if stage in STAGES:
+                self.layout, self.game_time = STAGES[stage]
+            return self.layout
@@ -0,0 +1,137 @@
+class StateDeltaEncoder():
+    """
+    Encodes a game's states (as returned by `OvercookedGame.get_state`) as periodic keyframes and per-tick deltas,
+    so each state_pong only carries what changed since the previous tick. The matching client applier is
+    static/js/state_delta.js, and `apply_state_delta` is the reference applier.
+
+    Every message has a sequence number `seq` that increases by one per tick, and is either
+        {"seq": n, "keyframe": True, "state": the full state}
+        {"seq": n, "keyframe": False, "delta": the changes from state n - 1}
+    A delta has the top level values that changed (score, time_left, ...), and a "state" dict of the changes to
+    the inner state:
+        players: {player index: player} of the players that changed
+        objects: {"set": {position key: object}, "removed": [position key]}, keyed by "x,y" since a cell holds at
+                 most one object
+        visibility: [[y, x, cell]] of the grid cells whose per-player visibility changed
+        any other key (timestep, orders, ...): its new value
+    A client that misses a message can not apply the following deltas, and requests a keyframe instead
+    """
+
+    def __init__(self, keyframe_interval=50):
+        """
+        keyframe_interval (int):    Number of ticks between keyframes, so clients recover from lost messages
+                                    even if their keyframe requests are lost too
+        """
+        self.keyframe_interval = keyframe_interval
+        self.seq = -1
+        self.previous = None
+        self.keyframe_requested = True
+
+    def request_keyframe(self):
+        """
+        Makes the next message a keyframe, e.g. when a client joins or missed a message
+        """
+        self.keyframe_requested = True
+
+    def encode(self, state):
+        """
+        Returns the message of the next tick's state. The state must not be modified afterwards, it is the base of
+        the next delta
+        """
+        self.seq += 1
+        delta = None
+        if not self.keyframe_requested and self.seq % self.keyframe_interval != 0:
+            delta = get_state_delta(self.previous, state)
+        self.previous = state
+        if delta is None:
+            self.keyframe_requested = False
+            return {"seq": self.seq, "keyframe": True, "state": state}
+        return {"seq": self.seq, "keyframe": False, "delta": delta}
+
+
+def get_position_key(position):
+    """
+    Returns the key of an object's position in a delta
+    """
+    return str(position[0]) + "," + str(position[1])
+
+def get_state_delta(previous, state):
+    """
+    Returns the delta from the previous state to the state, or None if the states differ in shape (e.g. a different
+    number of players or grid size) and need a keyframe
+    """
+    if set(previous.keys()) != set(state.keys()):
+        return None
+
+    previous_inner, inner = previous["state"], state["state"]
+    if set(previous_inner.keys()) != set(inner.keys()) or len(previous_inner["players"]) != len(inner["players"]):
+        return None
+    previous_visibility, visibility = previous_inner["visibility"], inner["visibility"]
+    if len(previous_visibility) != len(visibility) or any([len(previous_visibility[y]) != len(visibility[y]) for y in range(len(visibility))]):
+        return None
+
+    delta = {key : state[key] for key in state if key != "state" and previous[key] != state[key]}
+    inner_delta = {}
+    for key in inner:
+        if key == "players":
+            players = {}
+            for i in range(len(inner["players"])):
+                if previous_inner["players"][i] != inner["players"][i]:
+                    players[i] = inner["players"][i]
+            if len(players) > 0:
+                inner_delta["players"] = players
+        elif key == "objects":
+            previous_objects = {get_position_key(x["position"]) : x for x in previous_inner["objects"]}
+            objects = {get_position_key(x["position"]) : x for x in inner["objects"]}
+            changed = {x : objects[x] for x in objects if x not in previous_objects or previous_objects[x] != objects[x]}
+            removed = [x for x in previous_objects if x not in objects]
+            if len(changed) > 0 or len(removed) > 0:
+                inner_delta["objects"] = {"set": changed, "removed": removed}
+        elif key == "visibility":
+            cells = []
+            for y in range(len(visibility)):
+                if previous_visibility[y] != visibility[y]:
+                    for x in range(len(visibility[y])):
+                        if previous_visibility[y][x] != visibility[y][x]:
+                            cells.append([y, x, visibility[y][x]])
+            if len(cells) > 0:
+                inner_delta["visibility"] = cells
+        elif previous_inner[key] != inner[key]:
+            inner_delta[key] = inner[key]
+    if len(inner_delta) > 0:
+        delta["state"] = inner_delta
+    return delta
+
+def apply_state_delta(previous, delta):
+    """
+    Returns the state resulting from applying a delta to the previous state, without modifying the previous state
+    """
+    state = dict(previous)
+    for key in delta:
+        if key != "state":
+            state[key] = delta[key]
+    inner = dict(previous["state"])
+    for key, value in delta.get("state", {}).items():
+        if key == "players":
+            inner["players"] = list(inner["players"])
+            for i in value:
+                inner["players"][int(i)] = value[i]
+        elif key == "objects":
+            # objects that stay keep their order, new objects are appended like in the game's object dict
+            objects = {get_position_key(x["position"]) : x for x in inner["objects"]}
+            for x in value["removed"]:
+                del objects[x]
+            objects.update(value["set"])
+            inner["objects"] = list(objects.values())
+        elif key == "visibility":
+            inner["visibility"] = list(inner["visibility"])
+            rows = set()
+            for y, x, cell in value:
+                if y not in rows:
+                    inner["visibility"][y] = list(inner["visibility"][y])
+                    rows.add(y)
+                inner["visibility"][y][x] = cell
+        else:
+            inner[key] = value
+    state["state"] = inner
+    return state
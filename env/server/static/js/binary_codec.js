@@ -0,0 +1,122 @@
+// Decodes the binary payloads of env/server/binary_codec.py, see encode there for the format
+
+// value tags, in the order of binary_codec.py
+const BINARY_TAGS = {
+  NONE: 0,
+  FALSE: 1,
+  TRUE: 2,
+  INT8: 3,
+  INT32: 4,
+  FLOAT64: 5,
+  STRING: 6,
+  ENUM: 7,
+  OBJECT_ID: 8,
+  POSITION: 9,
+  ORIENTATION: 10,
+  TUPLE: 11,
+  LIST: 12,
+  DICT: 13,
+  BOOL_GRID: 14,
+  INT64: 15,
+};
+const BINARY_VERSION = 1;
+
+// the string and orientation tables sent by the server when the binary transport is negotiated
+var binarySchema = undefined;
+
+// returns the value encoded in an ArrayBuffer, tuples are decoded as arrays
+function decodeBinary(buffer) {
+  let view = new DataView(buffer);
+  let bytes = new Uint8Array(buffer);
+  let offset = 0;
+  let utf8 = new TextDecoder("utf-8");
+
+  function decodeValue() {
+    let tag = bytes[offset++];
+    let value, length;
+    switch (tag) {
+      case BINARY_TAGS.NONE:
+        return null;
+      case BINARY_TAGS.FALSE:
+        return false;
+      case BINARY_TAGS.TRUE:
+        return true;
+      case BINARY_TAGS.INT8:
+        value = view.getInt8(offset);
+        offset += 1;
+        return value;
+      case BINARY_TAGS.INT32:
+        value = view.getInt32(offset, true);
+        offset += 4;
+        return value;
+      case BINARY_TAGS.INT64:
+        value = Number(view.getBigInt64(offset, true));
+        offset += 8;
+        return value;
+      case BINARY_TAGS.FLOAT64:
+        value = view.getFloat64(offset, true);
+        offset += 8;
+        return value;
+      case BINARY_TAGS.STRING:
+        length = view.getUint16(offset, true);
+        value = utf8.decode(bytes.subarray(offset + 2, offset + 2 + length));
+        offset += 2 + length;
+        return value;
+      case BINARY_TAGS.ENUM:
+        return binarySchema.strings[bytes[offset++]];
+      case BINARY_TAGS.OBJECT_ID:
+        value = "O" + view.getUint16(offset, true);
+        offset += 2;
+        return value;
+      case BINARY_TAGS.POSITION:
+        value = [bytes[offset], bytes[offset + 1]];
+        offset += 2;
+        return value;
+      case BINARY_TAGS.ORIENTATION:
+        return binarySchema.orientations[bytes[offset++]].slice();
+      case BINARY_TAGS.TUPLE:
+      case BINARY_TAGS.LIST:
+        length = view.getUint16(offset, true);
+        offset += 2;
+        value = [];
+        for (let i = 0; i < length; i++) {
+          value.push(decodeValue());
+        }
+        return value;
+      case BINARY_TAGS.DICT:
+        length = view.getUint16(offset, true);
+        offset += 2;
+        value = {};
+        for (let i = 0; i < length; i++) {
+          let key = decodeValue();
+          value[key] = decodeValue();
+        }
+        return value;
+      case BINARY_TAGS.BOOL_GRID:
+        let height = bytes[offset];
+        let width = bytes[offset + 1];
+        let depth = bytes[offset + 2];
+        offset += 3;
+        value = [];
+        let bit = 0;
+        for (let y = 0; y < height; y++) {
+          let row = [];
+          for (let x = 0; x < width; x++) {
+            let cell = [];
+            for (let z = 0; z < depth; z++) {
+              cell.push(((bytes[offset + (bit >> 3)] >> (7 - (bit & 7))) & 1) == 1);
+              bit++;
+            }
+            row.push(cell);
+          }
+          value.push(row);
+        }
+        offset += (height * width * depth + 7) >> 3;
+        return value;
+      default:
+        throw new Error("Unknown binary tag " + tag);
+    }
+  }
+
+  return decodeValue();
+}
@@ -6,6 +6,20 @@ $(document).ready(function () {
   socket = io.connect("/");
 });
 
+// negotiate binary state payloads on every (re)connection, the server sends JSON until it agrees
+socket.on("connect", function () {
+  binarySchema = undefined;
+  socket.emit(
+    "transport",
+    { formats: ["binary", "json"], version: BINARY_VERSION },
+    function (reply) {
+      if (reply && reply.format == "binary") {
+        binarySchema = reply.schema;
+      }
+    },
+  );
+});
+
 $(window).on("beforeunload", function () {
   socket.close();
 });
@@ -28,6 +42,7 @@ function startGame(layout) {
       params: params,
       game_name: "overcooked",
       create_if_not_found: false,
+      user_id: userID,
     };
     socket.emit("create", paramsData);
     // starts the in-situ question timeout if not on the intro stage
@@ -74,6 +89,7 @@ function setInSituButtonLoading(timeout, after) {
 
 window.intervalID = -1;
 window.spectating = true;
+window.keyframeRequested = false;
 
 socket.on("waiting", function (data) {
   // Show game lobby
@@ -113,6 +129,8 @@ socket.on("creation_failed", function (data) {
 
 socket.on("start_game", function (data) {
   paused = false; // unpause in case the game is already paused
+  resetStateDelta(); // the game's states start over with a keyframe
+  window.keyframeRequested = false;
 
   // Hide game-over and lobby, show game title header
   if (window.intervalID !== -1) {
@@ -165,13 +183,39 @@ socket.on("reset_game", function (data) {
 });
 
 socket.on("state_pong", function (data) {
-  drawState(data["state"]); // Draw state update
+  if (data instanceof ArrayBuffer) {
+    data = decodeBinary(data);
+  }
+  let state = applyStatePong(data); // rebuild the full state from the keyframe or delta
+  if (data.keyframe) {
+    window.keyframeRequested = false;
+  }
+  if (state === undefined) {
+    // missed a message, ask for a keyframe once until one arrives
+    if (!window.keyframeRequested) {
+      socket.emit("keyframe_request", { seq: data.seq });
+      window.keyframeRequested = true;
+    }
+  } else {
+    drawState(state); // Draw state update
+  }
   displaySMM(data["smm"]); // update the SMM
 });
 
 function displaySMM(smm) {
   // format the SMM dictionary onto the browser panel
-  let s = JSON.stringify(smm, null, 4)
+  // positions and orientations are shown as (x, y)
+  let s = JSON.stringify(
+    smm,
+    (key, value) =>
+      Array.isArray(value) &&
+      value.length == 2 &&
+      typeof value[0] == "number" &&
+      typeof value[1] == "number"
+        ? "(" + value[0] + ", " + value[1] + ")"
+        : value,
+    4,
+  )
     .replace(/[{},'"[\]]/g, "")
     .replace(/(^[ \t]*\n)/gm, "")
     .replace(/^(    +)/gm, (match, tabs) => tabs.replace(/    /, ""));
@@ -317,7 +361,7 @@ async function setStudyStage(s, indicator = "") {
       Accept: "application/json",
       "Content-Type": "application/json",
     },
-    body: JSON.stringify({ level: s }),
+    body: JSON.stringify({ level: s, user_id: userID }),
   });
   let data = await resp.json();
   let layout = data["layout"];
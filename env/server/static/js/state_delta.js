@@ -0,0 +1,74 @@
+// Applies the delta-encoded state_pong messages of env/server/state_delta.py, see StateDeltaEncoder for the format
+
+// last applied sequence number and state, reset at the start of every game
+var deltaSeq = -1;
+var deltaState = undefined;
+
+function resetStateDelta() {
+  deltaSeq = -1;
+  deltaState = undefined;
+}
+
+// returns the full state of a state_pong message, or undefined if a message was missed and a keyframe is needed
+function applyStatePong(data) {
+  if (data.keyframe) {
+    deltaSeq = data.seq;
+    deltaState = data.state;
+    return deltaState;
+  }
+  if (deltaState === undefined || data.seq !== deltaSeq + 1) {
+    // missed a message, wait for the next keyframe
+    return undefined;
+  }
+  deltaSeq = data.seq;
+  deltaState = applyStateDelta(deltaState, data.delta);
+  return deltaState;
+}
+
+// returns the state resulting from applying a delta to the previous state, without modifying the previous state
+function applyStateDelta(previous, delta) {
+  let state = Object.assign({}, previous);
+  for (let key in delta) {
+    if (key != "state") {
+      state[key] = delta[key];
+    }
+  }
+  let inner = Object.assign({}, previous.state);
+  let changes = delta.state || {};
+  for (let key in changes) {
+    let value = changes[key];
+    if (key == "players") {
+      inner.players = inner.players.slice();
+      for (let i in value) {
+        inner.players[parseInt(i)] = value[i];
+      }
+    } else if (key == "objects") {
+      // objects that stay keep their order, new objects are appended
+      let objects = new Map();
+      inner.objects.forEach((obj) => {
+        objects.set(obj.position[0] + "," + obj.position[1], obj);
+      });
+      value.removed.forEach((position) => {
+        objects.delete(position);
+      });
+      for (let position in value.set) {
+        objects.set(position, value.set[position]);
+      }
+      inner.objects = Array.from(objects.values());
+    } else if (key == "visibility") {
+      inner.visibility = inner.visibility.slice();
+      let rows = new Set();
+      value.forEach(([y, x, cell]) => {
+        if (!rows.has(y)) {
+          inner.visibility[y] = inner.visibility[y].slice();
+          rows.add(y);
+        }
+        inner.visibility[y][x] = cell;
+      });
+    } else {
+      inner[key] = value;
+    }
+  }
+  state.state = inner;
+  return state;
+}
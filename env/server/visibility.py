@@ -0,0 +1,132 @@
+import numpy as np
+
+# Orientations for which the V and D visibility types restrict the field of view. Any other orientation (e.g. the
+# "(0,0)" placeholder of an agent that has not been seen yet) does not restrict the V and D visibility types
+ORIENTATIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+def can_see(visibility, visibility_range, agent_orientation, dX, dY):
+    """
+    Whether an agent can see a cell given the cell's dX and dY relative to the agent. This is the reference
+    implementation, prefer the cached masks of `VisibilityMasks`
+    """
+    # V visibility: agents sees everything in front of them with 90deg field of view (45deg angles)
+    if visibility == "V":
+        # agent facing right, ignore items to left of agent and beyond 45deg (dY > dX)
+        if agent_orientation == (1, 0) and (dX < 0 or abs(dY) > abs(dX) or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+        # agent facing left, ignore items to right of agent and beyond 45deg (dY > dX)
+        if agent_orientation == (-1, 0) and (dX > 0 or abs(dY) > abs(dX) or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+        # agent facing up, ignore items to down of agent and beyond 45deg (dX > dY)
+        if agent_orientation == (0, 1) and (dY < 0 or abs(dX) > abs(dY) or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+        # agent facing down, ignore items to up of agent and beyond 45deg (dX > dY)
+        if agent_orientation == (0, -1) and (dY > 0 or abs(dX) > abs(dY) or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+
+    # D visibility: agents see everything in front of them to a radius
+    elif visibility == "D":
+        # agent facing right, ignore items to left of agent and where dist > max
+        if agent_orientation == (1, 0) and (dX < 0 or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+        # agent facing left, ignore items to right of agent and where dist > max
+        if agent_orientation == (-1, 0) and (dX > 0 or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+        # agent facing up, ignore items to down of agent and where dist > max
+        if agent_orientation == (0, 1) and (dY < 0 or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+        # agent facing down, ignore items to up of agent and where dist > max
+        if agent_orientation == (0, -1) and (dY > 0 or dY * dY + dX * dX > visibility_range * visibility_range):
+            return False
+
+    # O visibility: agents see everything around them to a radius
+    elif visibility == "O":
+        # ignore items where dist > max
+        if dY * dY + dX * dX > visibility_range * visibility_range:
+            return False
+
+    return True
+
+
+class VisibilityMasks():
+    """
+    Cache of precomputed boolean visibility masks, shared by the game server and the SMMs.
+
+    A stencil is a (2R+1, 2R+1) mask of the offsets an agent can see for a (visibility type, range R, orientation),
+    indexed by [dY + R, dX + R]. Offsets outside the stencil are never visible. Grid masks are the stencils placed at
+    an agent's position on a layout, and are cached per (visibility type, range, position, orientation, grid shape)
+
+    Unrestricted cases (an unknown visibility type, or a V/D visibility with an orientation that is not one of
+    `ORIENTATIONS`) have no stencil, every offset is visible
+    """
+
+    def __init__(self):
+        self.stencils = {}
+        self.grid_masks = {}
+
+    def get_stencil(self, visibility, visibility_range, agent_orientation):
+        """
+        Returns the stencil of the visibility, or None if every offset is visible
+        """
+        if visibility == "O":
+            agent_orientation = None  # O visibility does not depend on the orientation
+        elif visibility not in ["V", "D"] or agent_orientation not in ORIENTATIONS:
+            return None
+        key = (visibility, visibility_range, agent_orientation)
+        stencil = self.stencils.get(key, None)
+        if stencil is None:
+            offsets = np.arange(-visibility_range, visibility_range + 1)
+            stencil = np.array([[can_see(visibility, visibility_range, agent_orientation, dX, dY) for dX in offsets] for dY in offsets], dtype=bool)
+            stencil.setflags(write=False)
+            self.stencils[key] = stencil
+        return stencil
+
+    def is_visible(self, visibility, visibility_range, agent_orientation, dX, dY):
+        """
+        Whether an agent can see a cell given the cell's dX and dY relative to the agent, same as `can_see`
+        """
+        stencil = self.get_stencil(visibility, visibility_range, agent_orientation)
+        if stencil is None:
+            return True
+        if dX < -visibility_range or dX > visibility_range or dY < -visibility_range or dY > visibility_range:
+            return False
+        return stencil.item(dY + visibility_range, dX + visibility_range)
+
+    def get_mask(self, visibility, visibility_range, position, agent_orientation, shape):
+        """
+        Returns the read-only (height, width) mask of the grid cells an agent at the position can see
+        """
+        key = (visibility, visibility_range, position, agent_orientation if agent_orientation in ORIENTATIONS else None, shape)
+        mask = self.grid_masks.get(key, None)
+        if mask is None:
+            mask = self._compute_mask(visibility, visibility_range, position, agent_orientation, shape)
+            self.grid_masks[key] = mask
+        return mask
+
+    def precompute(self, visibility, visibility_range, positions, shape):
+        """
+        Computes the grid masks of every orientation at each of the positions, e.g. every floor cell of a layout
+        """
+        for position in positions:
+            for agent_orientation in ORIENTATIONS:
+                self.get_mask(visibility, visibility_range, position, agent_orientation, shape)
+
+    def _compute_mask(self, visibility, visibility_range, position, agent_orientation, shape):
+        height, width = shape
+        stencil = self.get_stencil(visibility, visibility_range, agent_orientation)
+        if stencil is None:
+            mask = np.ones(shape, dtype=bool)
+        else:
+            # place the stencil centered on the position, clipped to the grid
+            mask = np.zeros(shape, dtype=bool)
+            x, y = position
+            row_start, row_end = max(0, y - visibility_range), min(height, y + visibility_range + 1)
+            col_start, col_end = max(0, x - visibility_range), min(width, x + visibility_range + 1)
+            if row_start < row_end and col_start < col_end:
+                mask[row_start:row_end, col_start:col_end] = stencil[row_start - y + visibility_range:row_end - y + visibility_range, col_start - x + visibility_range:col_end - x + visibility_range]
+        mask.setflags(write=False)
+        return mask
+
+
+# Masks shared by every game and SMM in the process
+MASKS = VisibilityMasks()
@@ -2,26 +2,179 @@ import grader  # for running through a user and grading them with the various SM
 import pickle  # for saving pickled data
 import os  # for pulling all files in a directory
 import sys  # for args
+import multiprocessing  # for grading users in parallel
+import hashlib  # for the content-addressed result cache
+import functools  # for passing the log path to the worker processes
+import traceback  # for reporting the jobs that fail
+import env.server.log_writer  # for listing the user logs and their segments
 
-def main(visibility:str):
+LOG_PATH = "./env/server/logs/"  # path of user data logs
+LAYOUT_PATH = "./env/server/layouts/"  # path of the layouts
+PROCESSED_USER_DATA_PATH = "./processed_data/"  # path of processed data logs
+CACHE_PATH = PROCESSED_USER_DATA_PATH + "cache/"  # path of the graded job results, named by the hash of their inputs
+MODEL_FILES = ["grader.py", "replay.py", "env/server/log_writer.py", "smm/smm.py", "smm/models/predicates.py", "env/server/visibility.py"]  # code that determines a graded result, part of the SMM model version
+ROUNDS = [1, 2, 3, 4]  # rounds to grade for each user
+IGNORED_USERS = ["123", "124"]  # Jack's tests
+
+# gets the users that have a log, sorted so the merged outputs do not depend on the directory listing order
+def get_users(log_path:str=LOG_PATH)->list:
+    users = []
+    for user in env.server.log_writer.get_log_users(log_path):
+        if user in IGNORED_USERS:  # ignore Jack's tests
+            continue
+        users.append(user)
+    return users
+
+# gets the name of the processed data file of a (user, round, visibility) job
+def get_job_filename(user:str, round:int, visibility:str)->str:
+    return user + "_" + str(round) + "_" + visibility
+
+# gets the sha256 hex digest of a file's contents
+def get_file_hash(path:str)->str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# gets the sha256 hex digest of a user's log, across its segments
+def get_log_hash(user:str, log_path:str=LOG_PATH)->str:
+    sha = hashlib.sha256()
+    for path in env.server.log_writer.get_log_files(user, log_path):
+        sha.update(get_file_hash(path).encode())
+    return sha.hexdigest()
+
+# gets the SMM model version, the hash of the code that grades users, so results are regraded when the models change
+def get_model_version()->str:
+    sha = hashlib.sha256()
+    for path in MODEL_FILES:
+        sha.update(path.encode())
+        sha.update(get_file_hash(path).encode())
+    return sha.hexdigest()
+
+# gets the path of the layout file of a round
+def get_layout_path(round:int)->str:
+    layout = [x for x in grader.rounds if grader.rounds[x] == round][0]
+    return LAYOUT_PATH + layout + ".layout"
+
+# gets the cache key of a (user, round, visibility) job from the hashes of its inputs
+def get_cache_key(log_hash:str, layout_hash:str, model_version:str, round:int, visibility:str)->str:
+    return hashlib.sha256("_".join([log_hash, layout_hash, model_version, str(round), visibility]).encode()).hexdigest()
+
+# saves a pickle, writing to a temporary file first so an interrupted run never leaves a partial file
+def save_pickle(path:str, data):
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(temp_path, path)
+
+# loads a cached job result, returns None if the job has not been graded with these inputs
+def load_cached_result(key:str, cache_path:str=CACHE_PATH):
+    try:
+        with open(cache_path + key + ".pkl", "rb") as f:
+            return pickle.load(f)["result"]
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, KeyError):
+        return None
+
+# grades a single (user, round, visibilities) job in one pass over the user's log, runs in a worker process
+#   returns the job and a dictionary of visibility to grading result, without the visibilities that failed, or None as the result if the user could not be processed
+def grade_job(job:tuple, log_path:str=LOG_PATH):
+    user, round, visibilities = job
+    # this will create new SMMs, so data does not carry over between users and rounds
+    try:
+        result = grader.grade_user_visibilities(user=user, round=round, visibilities=list(visibilities), debug=False, log_path=log_path)
+    except Exception:
+        traceback.print_exc()
+        print("Failed to process user:", ", ".join([get_job_filename(user, round, v) for v in visibilities]), "skipping")
+        return job, None
+    failed = [v for v in visibilities if v not in result]
+    if len(failed) > 0:  # the grader reports the error of each visibility that failed
+        print("Failed to process user:", ", ".join([get_job_filename(user, round, v) for v in failed]), "skipping")
+    return job, result
+
+# grades all the jobs of a user in order, runs in a worker process so the user's log is only parsed by one worker
+#   returns a list of (job, result)
+def grade_user_jobs(user_jobs:list, log_path:str=LOG_PATH)->list:
+    return [grade_job(job, log_path) for job in user_jobs]
+
+# grades the jobs across a pool of worker processes, yielding (job, result) in the same order as the jobs
+#   jobs: list of (user, round, visibilities), ordered so all jobs of a user are adjacent
+#   workers: number of worker processes, 1 grades in this process
+#   log_path: folder of the user logs
+def grade_jobs(jobs:list, workers:int=None, log_path:str=LOG_PATH):
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield grade_job(job, log_path)
+        return
+
+    # hand each worker all the jobs of a user at once, so each worker only parses that user's log once
+    jobs_by_user = {}
+    for job in jobs:
+        jobs_by_user.setdefault(job[0], []).append(job)
+
+    with multiprocessing.Pool(processes=min(workers, len(jobs_by_user))) as pool:
+        for results in pool.imap(functools.partial(grade_user_jobs, log_path=log_path), list(jobs_by_user.values()), chunksize=1):
+            for job, result in results:
+                yield job, result
+
+def main(visibility, workers:int=None, log_path:str=LOG_PATH):
+    visibilities = [visibility] if isinstance(visibility, str) else list(visibility)
+
+    processed_user_data_path = PROCESSED_USER_DATA_PATH
+    os.makedirs(processed_user_data_path, exist_ok=True)
+    os.makedirs(CACHE_PATH, exist_ok=True)
+
+    # load the (user, round, visibility) results that were already graded from the same log, layout and model code
+    #   results are cached as each job completes, so an interrupted sweep resumes where it stopped
+    users = get_users(log_path)
+    model_version = get_model_version()
+    layout_hashes = {round : get_file_hash(get_layout_path(round)) for round in ROUNDS}
+    cache_keys = {}
+    user_data = {}
+    for user in users:
+        log_hash = get_log_hash(user, log_path)
+        for round in ROUNDS:
+            for v in visibilities:
+                cache_keys[(user, round, v)] = get_cache_key(log_hash, layout_hashes[round], model_version, round, v)
+                result = load_cached_result(cache_keys[(user, round, v)])
+                if result is not None:  # if the user has already been processed, use that instead
+                    user_data[(user, round, v)] = result
+    print("Resuming with", len(user_data), "of", len(cache_keys), "graded results cached")
+
+    # grade the remaining visibilities of each (user, round) in one pass, keeping the jobs of each user adjacent
+    jobs = []
+    for user in users:
+        for round in ROUNDS:
+            remaining = tuple([v for v in visibilities if (user, round, v) not in user_data])
+            if len(remaining) > 0:
+                jobs.append((user, round, remaining))
+
+    # save each user's data as it completes
+    for (user, round, _), result in grade_jobs(jobs, workers=workers, log_path=log_path):
+        if result is None:
+            continue
+        for v in result:
+            user_data[(user, round, v)] = list(result[v])
+            save_pickle(CACHE_PATH + cache_keys[(user, round, v)] + ".pkl", {"user": user, "round": round, "visibility": v, "result": user_data[(user, round, v)]})
+            save_pickle(processed_user_data_path + get_job_filename(user, round, v) + ".pkl", user_data[(user, round, v)])  # save the user's data
+
+    # merge the job results in a fixed (visibility, user, round) order
+    for v in visibilities:
+        merge_results(v, users, user_data, processed_user_data_path)
+
+    print("Processing complete! See the output .pkl files.")
+
+# merges the per-job results of a visibility into the response and score records, and saves them
+def merge_results(visibility:str, users:list, user_data:dict, processed_user_data_path:str=PROCESSED_USER_DATA_PATH):
     question_responses = {}  # responses invariant to the user nor round
     round_responses = {}  # responses for each round, invariant of the user
     user_responses = {}  # responses for each user, invariant of the round
     structured_responses = {}  # responses for each user, for each round
     structured_scores = {}  # scores for each user, for each round
 
-    log_path = "./env/server/logs/"  # path of user data logs
-
-    processed_user_data_path = "./processed_data/"  # path of processed data logs
-    processed_users = [x.replace(".pkl", "") for x in os.listdir(processed_user_data_path)]  # all processed data file names, removing the .pkl extension
-
     # for each user
-    for user in os.listdir(log_path):
-        if ".txt" not in user: # ignore if this is not a text file
-            continue
-        if user == "123.txt" or user == "124.txt":  # ignore Jack's tests
-            continue
-        user = user.replace(".txt", "")  # remove the trailing .txt from the file name
+    for user in users:
         if user not in user_responses:  # ensure user is in the user responses
             user_responses[user] = {}
         if user not in structured_responses:  # ensure user is in the structured responses
@@ -30,7 +183,7 @@ def main(visibility:str):
             structured_scores[user] = {}
 
         # for each round
-        for round in [1, 2, 3, 4]:
+        for round in ROUNDS:
             if round not in round_responses:  # ensure round is in round responses
                 round_responses[round] = {}
             if round not in structured_responses[user]:  # ensure round is in the structured responses for the user
@@ -38,28 +191,10 @@ def main(visibility:str):
             if round not in structured_scores[user]:  # ensure round is in the structured scores for the user
                 structured_scores[user][round] = {}
 
-            # run through the round and gather the Q/A for the user and mental models
-            filename = user + "_" + str(round) + "_" + visibility
-            if filename in processed_users:  # if the user has already been processed, use that instead
-                with open(processed_user_data_path + filename + ".pkl", "rb") as f:
-                    user_data = pickle.load(f)
-                    responses = user_data[0]
-                    user_score_wrt_true = user_data[1]
-                    agent_score_wrt_true = user_data[2]
-                    estimated_human_score_wrt_true = user_data[3]
-                    true_score_wrt_user = user_data[4]
-                    agent_score_wrt_user = user_data[5]
-                    estimated_human_score_wrt_user = user_data[6]
-                    num_questions = user_data[7]
-            else:  # otherwise, process the user logs
-                # this will create new SMMs, so data does not carry over between users and rounds
-                try:
-                    responses, user_score_wrt_true, agent_score_wrt_true, estimated_human_score_wrt_true, true_score_wrt_user, agent_score_wrt_user, estimated_human_score_wrt_user, num_questions = grader.grade_user(user=user, round=round, visibility=visibility, debug=False)
-                except:
-                    print("Failed to process user:", filename, "skipping")
-                    continue
-                with open(processed_user_data_path + filename + ".pkl", "wb") as f:  # save the user's data
-                    pickle.dump([responses, user_score_wrt_true, agent_score_wrt_true, estimated_human_score_wrt_true, true_score_wrt_user, agent_score_wrt_user, estimated_human_score_wrt_user, num_questions], f)
+            # skip jobs that failed to process
+            if (user, round, visibility) not in user_data:
+                continue
+            responses, user_score_wrt_true, agent_score_wrt_true, estimated_human_score_wrt_true, true_score_wrt_user, agent_score_wrt_user, estimated_human_score_wrt_user, num_questions = user_data[(user, round, visibility)]
 
             # record the score information
             structured_scores[user][round]["user wrt full"] = user_score_wrt_true
@@ -100,10 +235,22 @@ def main(visibility:str):
     with open(processed_user_data_path + visibility + "_smm_scores_by_user_and_round.pkl", "wb") as f:
         pickle.dump(structured_scores, f)
 
-    print("Processing complete! See the output .pkl files.")
-
 if __name__ == "__main__":
-    visibility = sys.argv[1]
-    if visibility is None or visibility[0] not in ["V", "O", "D"] or visibility[1] not in ["1", "2", "3", "4", "5", "6", "7", "8", "9"]:  # check the visibility
-        raise ValueError("Invalid visibility argument! Must be of type O, D, V, and radii 1-9, for example, O4")
-    main(visibility=visibility)
+    # usage: python extract_results.py O4 [D4 V5 ...] [--workers=N] [--log-path=path]
+    workers = None
+    log_path = LOG_PATH
+    visibilities = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--workers="):
+            workers = int(arg.split("=")[1])
+            continue
+        if arg.startswith("--log-path="):
+            log_path = arg.split("=")[1]
+            continue
+        visibilities.append(arg)
+    if len(visibilities) == 0:
+        raise ValueError("Missing visibility argument! Must be of type O, D, V, and radii 1-9, for example, O4")
+    for visibility in visibilities:
+        if visibility is None or visibility[0] not in ["V", "O", "D"] or visibility[1] not in ["1", "2", "3", "4", "5", "6", "7", "8", "9"]:  # check the visibility
+            raise ValueError("Invalid visibility argument! Must be of type O, D, V, and radii 1-9, for example, O4")
+    main(visibility=visibilities, workers=workers, log_path=log_path)
@@ -1,7 +1,10 @@
 # grader.py: processes a world state to determine the ground truth, for comparisan with the user response and belief state estimate
 
-import ast  # for converting log line to dictionary
 import re  # for removing HTML tags from question strings
+import functools  # for caching parsed logs and compiled questions
+import weakref  # for caching facts derived from each SMM's belief state
+import traceback  # for reporting the visibilities that fail
+import replay  # for reading the parsed user logs
 import smm.smm  # for constructing the ground truth SMM (logical predicates with full observability)
 import make_smm  # for visualizing the SMM
 
@@ -39,113 +42,160 @@ def clean_question_string(text):
     clean = re.compile('<.*?>')
     return re.sub(clean, '', text).lower()
 
+# reads a user's log as (kind, layout, payload) replay records, cached so each worker process only loads a log once across rounds
+@functools.lru_cache(maxsize=4)
+def read_log(user:str, log_path:str=replay.LOG_PATH)->tuple:
+    return tuple(replay.iter_log(user, log_path))
+
 # processes a user's logs to determine their accuracy
-def grade_user(user:str, round:int, visibility:str, debug=False):
+def grade_user(user:str, round:int, visibility:str, debug=False, log_path:str=replay.LOG_PATH):
+    return grade_user_visibilities(user=user, round=round, visibilities=[visibility], debug=debug, log_path=log_path)[visibility]
+
+# processes a user's logs to determine their accuracy for several robot visibilities in a single pass over the log
+#   the ground truth model is shared, and its visible belief state is fanned out to one agent/estimated human model pair per visibility
+#   a visibility whose models raise is dropped from the results and the others are still graded, as if each were graded on its own
+#   returns a dictionary of visibility to the grade_user results for that visibility, raises the first error if every visibility failed
+def grade_user_visibilities(user:str, round:int, visibilities:list, debug=False, log_path:str=replay.LOG_PATH)->dict:
     # get the layout from the round
     layout = [x for x in rounds if rounds[x] == round]
     layout = None if len(layout) == 0 else layout[0]
     if layout is None:
         raise ValueError("Provided round is not valid! Rounds are: " + ",".join([x for x in rounds]))
-    
-    responses = {}  # record of the user's question responses: dict{question:[user response, ground truth response, score]}
 
     # process the user
     user.replace(".txt", "").replace(".log", "")  # remove the extension
-    with open("env/server/logs/" + user + ".txt", "r") as f:
-        print("Now processing user", user, "round", round)
-        lines = f.readlines()  # read every line of the log
-        num_lines = len(lines)
-        state = None  # the current game state
-        true_model = smm.smm.SMM("predicates", visibility="O20", agent="A0")  # robot model with full observability, ground truth
-        agent_model = smm.smm.SMM("predicates", visibility=visibility, agent="A0")  # robot model with partial observability
-        estimated_human_model = smm.smm.SMM("predicates", visibility="D4", agent="A1")  # estimated human model with partial observability
-
-        # scores
-        user_score_wrt_true = 0
-        agent_score_wrt_true = 0
-        estimated_human_score_wrt_true = 0
-        true_score_wrt_user = 0
-        agent_score_wrt_user = 0
-        estimated_human_score_wrt_user = 0
-        
-        num_questions = 0
-        line_count = 1
-        first_view = True
-        for line in lines:
-            # keep track of progress
-            if line_count % 100 == 0 and true_model.initialized:
-                print("    ", int(100 * line_count / num_lines), "%", "[", user,"]")
-            line_count += 1
-
-            log_dict = ast.literal_eval(line)
-            # handle state updates
-            if "state" in log_dict:
-                state = log_dict  # pull the state
-                if state["layout"] != layout:  # ignore if incorrect layout
-                    continue
-
-                # initialize the SMMs if they have not been initialized
-                if not true_model.initialized:
-                    true_model.init_belief_state_from_file(state["layout"] + ".layout")
+    print("Now processing user", user, "round", round, "visibilities", ",".join(visibilities))
+    lines = read_log(user, log_path)  # every line of the log, already parsed and with the states converted for the SMMs
+    num_lines = len(lines)
+    state = None  # the current game state
+    true_model = smm.smm.SMM("predicates", visibility="O20", agent="A0")  # robot model with full observability, ground truth
+
+    # the models, record of the user's question responses, and scores of each visibility
+    graded = {}
+    for visibility in visibilities:
+        graded[visibility] = {
+            "agent model": smm.smm.SMM("predicates", visibility=visibility, agent="A0"),  # robot model with partial observability
+            "estimated human model": smm.smm.SMM("predicates", visibility="D4", agent="A1"),  # estimated human model with partial observability
+            "responses": {},  # record of the user's question responses: dict{question:[user response, ground truth response, score]}
+            "user wrt true": 0,
+            "agent wrt true": 0,
+            "estimated human wrt true": 0,
+            "true wrt user": 0,
+            "agent wrt user": 0,
+            "estimated human wrt user": 0,
+            "num questions": 0,
+            "error": None,  # the exception that stopped grading the visibility, if any
+        }
+
+    # stops grading a visibility whose models raised, reporting which visibility failed
+    def fail(visibility:str, e:Exception):
+        print("Failed to grade user", user, "round", round, "visibility", visibility)
+        traceback.print_exc()
+        graded[visibility]["error"] = e
+
+    line_count = 1
+    first_view = True
+    for kind, state_layout, log_dict in lines:
+        # keep track of progress
+        if line_count % 100 == 0 and true_model.initialized:
+            print("    ", int(100 * line_count / num_lines), "%", "[", user,"]")
+        line_count += 1
+
+        # handle state updates
+        if kind == replay.STATE:
+            if state_layout != layout:  # ignore if incorrect layout
+                continue
 
-                # update the mental models
-                state = true_model.convert_log_to_state(state)
-                true_model.update(state, debug=False)
-                true_belief_state = true_model.get_visible_belief_state()
+            # initialize the SMMs if they have not been initialized
+            if not true_model.initialized:
+                true_model.init_belief_state_from_file(state_layout + ".layout")
 
-                if first_view:
-                    agent_model.model.domain_knowledge = true_belief_state
-                    estimated_human_model.model.domain_knowledge = true_belief_state
-                    first_view = False
+            # update the mental models, the ground truth once per tick
+            state = log_dict  # the state is already converted
+            true_model.update(state, debug=False)
+            true_belief_state = true_model.get_visible_belief_state()
 
-                agent_model.update(true_belief_state, debug=False)
-                agent_belief_state = agent_model.get_visible_belief_state()
-                estimated_human_model.update(agent_belief_state, debug=False)
+            for visibility in visibilities:
+                if graded[visibility]["error"] is not None:
+                    continue
+                agent_model = graded[visibility]["agent model"]
+                estimated_human_model = graded[visibility]["estimated human model"]
+                try:
+                    if first_view:
+                        # the agent and estimated human models of a visibility start from the same copy of the ground truth
+                        agent_model.set_belief_state(true_belief_state)
+                        estimated_human_model.set_belief_state(agent_model.belief_state, copy=False)
+
+                    agent_model.update(true_belief_state, debug=False)
+                    agent_belief_state = agent_model.get_visible_belief_state()
+                    estimated_human_model.update(agent_belief_state, debug=False)
+                except Exception as e:
+                    fail(visibility, e)
+            first_view = False
+
+        if not true_model.initialized:
+            continue
 
-            if not true_model.initialized:
+        # handle in-situ questions
+        if kind == replay.EVENT and "type" in log_dict:
+            if log_dict["stage"] != "round" + str(round):
                 continue
-
-            # handle in-situ questions
-            if "type" in log_dict:
-                if log_dict["stage"] != "round" + str(round):
+            if log_dict["type"] == "in situ submission":
+                question = clean_question_string(log_dict["question"])  # clean the question
+                print("Question:", question)
+                # ignore the completion question
+                if "do you think your team" in question:
                     continue
-                if log_dict["type"] == "in situ submission":
-                    question = clean_question_string(log_dict["question"])  # clean the question
-                    print("Question:", question)
-                    # ignore the completion question
-                    if "do you think your team" in question:
+                user_response = log_dict["response"].lower()  # get the user response
+                true_response = answer_question(true_model, question)
+                true_visible_belief_state = None  # the ground truth record, shared by the visibilities
+                for visibility in visibilities:
+                    g = graded[visibility]
+                    if g["error"] is not None:
                         continue
-                    user_response = log_dict["response"].lower()  # get the user response                    
-                    true_response = answer_question(true_model, question)
-                    agent_response = answer_question(agent_model, question)
-                    estimated_human_response = answer_question(estimated_human_model, question)
-                    print("User Response:", user_response, "True Response:", true_response, "Agent Response:", agent_response, "Estimated Human Response:", estimated_human_response, "User Score:", score_response(question, user_response, true_response))
-                    if true_response is not None:  # None indicates the question is being intentionally ignored in scoring
-                        # score the responses
-                        # user w.r.t. truth
-                        _user_score_wrt_true = score_response(question, user_response, true_response)
-                        user_score_wrt_true += _user_score_wrt_true
-                        # agent w.r.t. truth
-                        _agent_score_wrt_true = score_response(question, agent_response, true_response)
-                        agent_score_wrt_true += _agent_score_wrt_true
-                        # estimated human w.r.t. truth
-                        _estimated_human_score_wrt_true = score_response(question, estimated_human_response, true_response)
-                        estimated_human_score_wrt_true += _estimated_human_score_wrt_true
-                        # truth w.r.t. user
-                        _true_score_wrt_user = score_response(question, true_response, user_response)
-                        true_score_wrt_user += _true_score_wrt_user
-                        # agent w.r.t. user
-                        _agent_score_wrt_user = score_response(question, agent_response, user_response)
-                        agent_score_wrt_user += _agent_score_wrt_user
-                        # estimated human w.r.t. user
-                        _estimated_human_score_wrt_user = score_response(question, estimated_human_response, user_response)
-                        estimated_human_score_wrt_user += _estimated_human_score_wrt_user
-                        num_questions += 1
-                        if question not in responses:  # ensure the question is in the seen responses
-                            responses[question] = []
-                        responses[question].append([user_response, true_response, _user_score_wrt_true, _true_score_wrt_user, agent_response, _agent_score_wrt_true, _agent_score_wrt_user, estimated_human_response, _estimated_human_score_wrt_true, _estimated_human_score_wrt_user, true_model.get_visible_belief_state(), agent_model.get_visible_belief_state(), estimated_human_model.get_visible_belief_state()])  # add the record for the question
-    print("User:", user, "Round", round, "True Score:", user_score_wrt_true, "Agent Score:", agent_score_wrt_user, "Estimated Human Score:", estimated_human_score_wrt_user, "/", num_questions)
-    return responses, user_score_wrt_true, agent_score_wrt_true, estimated_human_score_wrt_true, true_score_wrt_user, agent_score_wrt_user, estimated_human_score_wrt_user, num_questions
+                    try:
+                        agent_response = answer_question(g["agent model"], question)
+                        estimated_human_response = answer_question(g["estimated human model"], question)
+                        print("User Response:", user_response, "True Response:", true_response, "Agent Response (" + visibility + "):", agent_response, "Estimated Human Response:", estimated_human_response, "User Score:", score_response(question, user_response, true_response))
+                        if true_response is not None:  # None indicates the question is being intentionally ignored in scoring
+                            # score the responses
+                            # user w.r.t. truth
+                            _user_score_wrt_true = score_response(question, user_response, true_response)
+                            g["user wrt true"] += _user_score_wrt_true
+                            # agent w.r.t. truth
+                            _agent_score_wrt_true = score_response(question, agent_response, true_response)
+                            g["agent wrt true"] += _agent_score_wrt_true
+                            # estimated human w.r.t. truth
+                            _estimated_human_score_wrt_true = score_response(question, estimated_human_response, true_response)
+                            g["estimated human wrt true"] += _estimated_human_score_wrt_true
+                            # truth w.r.t. user
+                            _true_score_wrt_user = score_response(question, true_response, user_response)
+                            g["true wrt user"] += _true_score_wrt_user
+                            # agent w.r.t. user
+                            _agent_score_wrt_user = score_response(question, agent_response, user_response)
+                            g["agent wrt user"] += _agent_score_wrt_user
+                            # estimated human w.r.t. user
+                            _estimated_human_score_wrt_user = score_response(question, estimated_human_response, user_response)
+                            g["estimated human wrt user"] += _estimated_human_score_wrt_user
+                            g["num questions"] += 1
+                            if true_visible_belief_state is None:
+                                true_visible_belief_state = true_model.get_visible_belief_state()
+                            if question not in g["responses"]:  # ensure the question is in the seen responses
+                                g["responses"][question] = []
+                            g["responses"][question].append([user_response, true_response, _user_score_wrt_true, _true_score_wrt_user, agent_response, _agent_score_wrt_true, _agent_score_wrt_user, estimated_human_response, _estimated_human_score_wrt_true, _estimated_human_score_wrt_user, true_visible_belief_state, g["agent model"].get_visible_belief_state(), g["estimated human model"].get_visible_belief_state()])  # add the record for the question
+                    except Exception as e:
+                        fail(visibility, e)
+
+    results = {}
+    for visibility in visibilities:
+        g = graded[visibility]
+        if g["error"] is not None:
+            continue
+        print("User:", user, "Round", round, "Visibility", visibility, "True Score:", g["user wrt true"], "Agent Score:", g["agent wrt user"], "Estimated Human Score:", g["estimated human wrt user"], "/", g["num questions"])
+        results[visibility] = (g["responses"], g["user wrt true"], g["agent wrt true"], g["estimated human wrt true"], g["true wrt user"], g["agent wrt user"], g["estimated human wrt user"], g["num questions"])
+    if len(results) == 0:
+        raise graded[visibilities[0]]["error"]
+    return results
 
 # score a question's response between 0 (incorrect) and 1 (correct)
 #   candidate_response: the user or agent's response
@@ -304,45 +354,117 @@ def score_response(question:str, candidate_response:str, ground_truth_response:s
 
     raise ValueError("Reached end of response scoring without catching the response type, responses were: " + question + " cand: " + str(candidate_response) + ", truth: " + str(ground_truth_response))
 
-# get the SMM's response to a question
-def answer_question(smm:smm.smm.SMM, question):
+# compiles a question to the function and arguments that answer it, so each distinct question is only parsed once
+#   returns (function, arguments), the function is None if the question is intentionally not answered
+@functools.lru_cache(maxsize=None)
+def compile_question(question:str)->tuple:
     # Where is you/teammate?
     if "where are you" in question:
-        response = get_location_semantic(smm, "player")
+        return get_location_semantic, ("player",)
     elif "where is your teammate" in question:
-        response = get_location_semantic(smm, "teammate")
+        return get_location_semantic, ("teammate",)
     # Where is the nearest available onion/tomato?
     elif "where is the nearest available" in question:
-        response = get_location_semantic(smm, [x for x in INGREDIENTS if x in question][0])
+        return get_location_semantic, ([x for x in INGREDIENTS if x in question][0],)
     # What are you doing?
     elif "what are you doing" in question:
-        response = get_current_action_semantic(smm, "player")
+        return get_current_action_semantic, ("player",)
     # What is your teammate doing?
     elif "what is your teammate doing" in question:
-        response = get_current_action_semantic(smm, "teammate")
+        return get_current_action_semantic, ("teammate",)
     # What will you/teammate be doing in ~10 seconds from now?
     elif "what will you be doing ~10 seconds from now" in question:
-        response = None  # get_future_action_semantic(smm, "player")
+        return None, ()  # get_future_action_semantic(smm, "player")
     elif "what will your teammate be doing ~10 seconds from now" in question:
-        response = None  # get_future_action_semantic(smm, "teammate")
+        return None, ()  # get_future_action_semantic(smm, "teammate")
     # How many more soups can be made/delivered, including soups in-progress?
     elif "how many more soups" in question:
-        response = get_remaining_soups(smm)
+        return get_remaining_soups, ()
     # What is the leftmost/rightmost pot's status?
     elif "pot's status" in question:
-        response = get_pot_status(smm, [x for x in ["left", "right"] if x in question][0], "state")
+        return get_pot_status, ([x for x in ["left", "right"] if x in question][0], "state")
     # How full is the leftmost/rightmost pot?
     elif "how full" in question:
-        response = get_pot_status(smm, [x for x in ["left", "right"] if x in question][0], "full")
+        return get_pot_status, ([x for x in ["left", "right"] if x in question][0], "full")
     # Is there at one available onion/tomato?
     elif "is there at least one available" in question:
-        response = get_ingredient_available(smm, [x for x in INGREDIENTS if x in question][0])
+        return get_ingredient_available, ([x for x in INGREDIENTS if x in question][0],)
     # Do you think your team will complete all the dishes in time?
     elif "complete all the dishes" in question:
-        response = None  # not worried about level 3 yet
+        return None, ()  # not worried about level 3 yet
     else:
         raise ValueError("SMM is trying to answer a question that is not handled: " + question)
-    return response
+
+# get the SMM's response to a question
+def answer_question(smm:smm.smm.SMM, question):
+    function, arguments = compile_question(question)
+    if function is None:
+        return None
+    return function(smm, *arguments)
+
+# facts derived from each SMM's belief state, shared by the question handlers so a belief state is only scanned once
+#   SMM -> (belief state, number of updates of the belief state, facts)
+belief_state_facts = weakref.WeakKeyDictionary()
+
+# gets the facts derived from an SMM's belief state, recomputed when the belief state is replaced or updated
+#   left pot, right pot: ID of the leftmost and rightmost pot, the first pot in the belief state wins ties
+#   visible by position: position to the IDs of the visible objects at that position
+#   nearest ingredient: ingredient name to the position of the nearest ingredient of that name to the player, visible or not
+#   ingredients on counters: number of visible ingredients
+#   soups on counters: number of ingredients in visible soups
+#   ingredient available: ingredient name to whether a visible object of that name exists
+def get_belief_state_facts(smm:smm.smm.SMM)->dict:
+    belief_state = smm.belief_state
+    num_updates = belief_state.get("updates", 0)
+    cached = belief_state_facts.get(smm, None)
+    if cached is not None and cached[0] is belief_state and cached[1] == num_updates:
+        return cached[2]
+
+    objects = belief_state["objects"]
+    user_position = belief_state["agents"]["A0"]["position"] if "A0" in belief_state["agents"] else None
+    facts = {
+        "left pot": None,
+        "right pot": None,
+        "visible by position": {},
+        "nearest ingredient": {},
+        "ingredients on counters": 0,
+        "soups on counters": 0,
+        "ingredient available": {ingredient : False for ingredient in INGREDIENTS},
+    }
+    nearest_ingredient_dist = {}
+    for obj in objects:
+        name = objects[obj]["propertyOf"]["name"]
+        # the leftmost and rightmost pots
+        if name == "pot":
+            if facts["left pot"] is None or objects[obj]["position"][0] < objects[facts["left pot"]]["position"][0]:
+                facts["left pot"] = obj
+            if facts["right pot"] is None or objects[obj]["position"][0] > objects[facts["right pot"]]["position"][0]:
+                facts["right pot"] = obj
+        # the closest ingredient of each type
+        if name in INGREDIENTS and user_position is not None:
+            dist = (objects[obj]["position"][0] - user_position[0]) ** 2 + (objects[obj]["position"][1] - user_position[1]) ** 2
+            if dist < nearest_ingredient_dist.get(name, float("infinity")):
+                nearest_ingredient_dist[name] = dist
+                facts["nearest ingredient"][name] = objects[obj]["position"]
+        if not objects[obj]["visible"]:
+            continue
+        # visible objects, by position
+        position = tuple(objects[obj]["position"])
+        if position not in facts["visible by position"]:
+            facts["visible by position"][position] = []
+        facts["visible by position"][position].append(obj)
+        # visible ingredients, and ingredients in soups (only complete soups have + in the name), the -1 is to ignore the "soup" prefix
+        if name in INGREDIENTS:
+            facts["ingredients on counters"] += 1
+        if "+" in objects[obj]["propertyOf"]["title"] or ":" in objects[obj]["propertyOf"]["title"]:
+            facts["soups on counters"] += len(objects[obj]["propertyOf"]["title"].replace(":", "+").split("+")) - 1
+        if objects[obj]["visible"] == True:
+            for ingredient in INGREDIENTS:
+                if ingredient in name:
+                    facts["ingredient available"][ingredient] = True
+
+    belief_state_facts[smm] = (belief_state, num_updates, facts)
+    return facts
 
 # get location semantic, e.g., "tomato" could return "top left".
 def get_location_semantic(smm:smm.smm.SMM, object:str)->str:
@@ -356,15 +478,7 @@ def get_location_semantic(smm:smm.smm.SMM, object:str)->str:
         position = user_position
     # get the position of the closest ingredient of the given object type (onion, tomato)
     if object in INGREDIENTS:
-        closest_ingredient_position = None
-        closest_ingredient_dist = float("infinity")
-        for obj in smm.belief_state["objects"]:
-            # ignore incorrect ingredients
-            if smm.belief_state["objects"][obj]["propertyOf"]["name"] == object:
-                dist = (smm.belief_state["objects"][obj]["position"][0] - user_position[0]) ** 2 + (smm.belief_state["objects"][obj]["position"][1] - user_position[1]) ** 2
-                if dist < closest_ingredient_dist:
-                    closest_ingredient_dist = dist
-                    closest_ingredient_position = smm.belief_state["objects"][obj]["position"]
+        closest_ingredient_position = get_belief_state_facts(smm)["nearest ingredient"].get(object, None)
         # error if there are no ingredients of that type
         if closest_ingredient_position is None:
             raise ValueError("Tried to get the location of the closest ingredient " + object + ", however there were no ingredients of that type!")
@@ -415,18 +529,22 @@ def get_future_action_semantic(smm:smm.smm.SMM, object:str)->str:
 
 # get the number of soups that can be made
 def get_remaining_soups(smm:smm.smm.SMM)->str:
-    objects = get_visible_objects(smm)
+    facts = get_belief_state_facts(smm)
     # get number of ingredients on counters and held (working)
-    ingredients_on_counters = len([obj for obj in objects if smm.belief_state["objects"][obj]["propertyOf"]["name"] in INGREDIENTS])
-    # get number of soups on counters (only complete soups have + in the name), the -1 is to ignore the "soup" prefix
-    soups_on_counters = sum([len(smm.belief_state["objects"][obj]["propertyOf"]["title"].replace(":", "+").split("+"))-1 for obj in objects if "+" in smm.belief_state["objects"][obj]["propertyOf"]["title"] or ":" in smm.belief_state["objects"][obj]["propertyOf"]["title"]])
+    ingredients_on_counters = facts["ingredients on counters"]
+    # get number of soups on counters
+    soups_on_counters = facts["soups on counters"]
     # number of soups are: ingredients on counters/3 + ingredients held/3 + ingredients in uncooked pot/3 + number of filled cooking/cooked pot + number of carried soups + number of soups on counter
     remaining = int(ingredients_on_counters / 3 + soups_on_counters / 3)  # the int() will floor the result
     return str(remaining) + " soups"
 
 # get whether an ingredient is available
 def get_ingredient_available(smm:smm.smm.SMM, ingredient:str)->str:
-    ingredient_available = len([obj for obj in smm.belief_state["objects"] if ingredient in smm.belief_state["objects"][obj]["propertyOf"]["name"] and smm.belief_state["objects"][obj]["visible"] == True]) > 0
+    facts = get_belief_state_facts(smm)
+    if ingredient in facts["ingredient available"]:
+        ingredient_available = facts["ingredient available"][ingredient]
+    else:
+        ingredient_available = len([obj for obj in smm.belief_state["objects"] if ingredient in smm.belief_state["objects"][obj]["propertyOf"]["name"] and smm.belief_state["objects"][obj]["visible"] == True]) > 0
     return str(ingredient_available).lower()
 
 # get the status of a pot
@@ -436,19 +554,14 @@ def get_pot_status(smm:smm.smm.SMM, side:str, knowledge:str)->str:
         raise ValueError("The 'side' parameter of get_pot_status must be \"left\" or \"right\"")
     if knowledge not in ["state", "full"]:
         raise ValueError("The 'knowledge' parameter of get_pot_status must be \"status\" or \"full\"")
+    facts = get_belief_state_facts(smm)
     # find the target pot (leftmost or rightmost)
-    target_pot = None
-    for obj in smm.belief_state["objects"]:
-        if smm.belief_state["objects"][obj]["propertyOf"]["name"] != "pot":  # ignore everything but pots
-            continue
-        if target_pot is None or (side == "left" and smm.belief_state["objects"][obj]["position"][0] < smm.belief_state["objects"][target_pot]["position"][0]):
-            target_pot = obj
-        elif target_pot is None or (side == "right" and smm.belief_state["objects"][obj]["position"][0] > smm.belief_state["objects"][target_pot]["position"][0]):
-            target_pot = obj
+    target_pot = facts[side + " pot"]
+    # get ingredients on this pot
+    ing = [x for x in facts["visible by position"].get(tuple(smm.belief_state["objects"][target_pot]["position"]), []) if x != target_pot]
+    num_ingredients = 0 if len(ing) == 0 else len(smm.belief_state["objects"][ing[0]]["propertyOf"]["title"].split("+"))
     # if we are looking for the status of the pot
     if knowledge == "state":
-        ing = [x for x in smm.belief_state["objects"] if x != target_pot and smm.belief_state["objects"][x]["visible"] and tuple(smm.belief_state["objects"][x]["position"]) == tuple(smm.belief_state["objects"][target_pot]["position"])]
-        num_ingredients = 0 if len(ing) == 0 else len(smm.belief_state["objects"][ing[0]]["propertyOf"]["title"].split("+"))
         if num_ingredients == 0:
             return "empty"
         elif smm.belief_state["objects"][ing[0]]["propertyOf"]["isReady"]:
@@ -462,9 +575,6 @@ def get_pot_status(smm:smm.smm.SMM, side:str, knowledge:str)->str:
             raise ValueError("Unsure how this many ingredients were not handled: num ingredients in pot: " + str(num_ingredients) + " state " + str(smm.belief_state["objects"][ing[0]]))
     # if we are looking for the number of ingredients 
     elif knowledge == "full":
-        # get ingredients on this pot
-        ing = [x for x in smm.belief_state["objects"] if x != target_pot and smm.belief_state["objects"][x]["visible"] and tuple(smm.belief_state["objects"][x]["position"]) == tuple(smm.belief_state["objects"][target_pot]["position"])]
-        num_ingredients = 0 if len(ing) == 0 else len(smm.belief_state["objects"][ing[0]]["propertyOf"]["title"].split("+"))
         if num_ingredients == 0:
             return "Empty"
         elif num_ingredients < 3:
@@ -0,0 +1,241 @@
+# load_test.py: measures how many concurrent games the game server sustains at MAX_FPS
+#   runs the server in this process and drives it with scripted bot participants through Socket.IO test clients,
+#   so no network or browser is needed. Each bot goes through the study client's flow (load the page, set the level,
+#   negotiate the transport, create a game with the FSMAI partner), presses keys at human-like rates, and rebuilds
+#   the states from the state_pong messages like the browser client
+
+import os  # for the load test's metrics folder
+import sys  # for args
+import time  # for timing the ticks
+import random  # for the bots' key presses
+import tempfile  # for writing the load test's session logs outside the real logs
+import threading  # for the bots' key press driver
+import numpy as np  # for percentiles
+import env.server.app as app  # the game server
+import env.server.binary_codec  # for decoding binary state_pong payloads
+from env.server.state_delta import apply_state_delta  # for rebuilding states from delta messages
+from env.server.scheduler import TickScheduler  # for resizing the tick worker pool
+from env.server.npc_executor import make_npc_executor  # for switching the NPC execution strategy
+import env.server.game  # for switching the NPC execution strategy
+
+ACTIONS = ["UP", "DOWN", "LEFT", "RIGHT", "SPACE", "STAY"]  # keys a bot presses
+ACTIONS_PER_SECOND = 4  # mean key presses per second of a bot, presses are a poisson process
+LEVEL = "round1"  # study stage the bots play
+
+# a scripted participant, records the arrival time of every state_pong it receives
+class Bot():
+    def __init__(self, user_id:str, flask_client, binary:bool=False):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.arrivals = []  # arrival time of each applied state_pong
+        self.seq = -1  # sequence number of the last applied state_pong
+        self.state = None  # the state rebuilt from the state_pong messages
+        self.keyframe_requested = False
+        self.missed = 0  # number of state_pong messages that could not be applied
+        self.failed = False  # whether creating the bot's game failed
+
+        # load the page and set the level, like the study client
+        flask_client.get("/?user_id=" + user_id)
+        flask_client.post("/level", json={"level": LEVEL, "user_id": user_id})
+        self.client = app.socketio.test_client(app.app, flask_test_client=flask_client)
+        # receive the server's messages as they are sent instead of polling the test client's queue
+        self.client.queue = BotQueue(self)
+        if binary:
+            reply = self.client.emit("transport", {"formats": ["binary", "json"], "version": env.server.binary_codec.BINARY_VERSION}, callback=True)
+            assert reply["format"] == "binary", "The server refused the binary transport"
+        self.client.emit("create", {"params": {"playerZero": "FSMAI", "playerOne": "human"}, "game_name": "overcooked", "create_if_not_found": False, "user_id": user_id})
+
+    # handles a message sent to the bot, on the server thread that sent it
+    def on_message(self, message:dict):
+        if message["name"] == "creation_failed":
+            self.failed = True
+        if message["name"] != "state_pong":
+            return
+        arrival = time.perf_counter()
+        data = message["args"][0]
+        if isinstance(data, bytes):
+            data = env.server.binary_codec.decode(data)
+        with self.lock:
+            if data["keyframe"]:
+                self.state = data["state"]
+                self.keyframe_requested = False
+            elif self.state is not None and data["seq"] == self.seq + 1:
+                self.state = apply_state_delta(self.state, data["delta"])
+            else:
+                # missed a message, ask for a keyframe once until one arrives
+                self.missed += 1
+                if not self.keyframe_requested:
+                    self.keyframe_requested = True
+                    threading.Thread(target=self.client.emit, args=("keyframe_request", {"seq": data["seq"]})).start()
+                return
+            self.seq = data["seq"]
+            self.arrivals.append(arrival)
+
+    # presses a key
+    def act(self):
+        self.client.emit("action", {"action": random.choice(ACTIONS)})
+
+    # takes the arrival times recorded since the last call
+    def take_arrivals(self)->list:
+        with self.lock:
+            arrivals, self.arrivals = self.arrivals, []
+            return arrivals
+
+    def disconnect(self):
+        self.client.disconnect()
+
+# stands in for a test client's message queue, handing each message to its bot as it arrives
+class BotQueue(list):
+    def __init__(self, bot:Bot):
+        super().__init__()
+        self.bot = bot
+
+    def append(self, message:dict):
+        self.bot.on_message(message)
+
+# presses the bots' keys at poisson distributed times until stopped
+def drive_bots(bots:list, stop:threading.Event):
+    next_times = [time.perf_counter() + random.expovariate(ACTIONS_PER_SECOND) for _ in bots]
+    while not stop.is_set():
+        i = int(np.argmin(next_times))
+        delay = next_times[i] - time.perf_counter()
+        if delay > 0 and stop.wait(delay):
+            return
+        bots[i].act()
+        next_times[i] += random.expovariate(ACTIONS_PER_SECOND)
+
+# times every state_pong emit of the server, an emit includes encoding the message and sending it to the room
+#   emits are serialized, since the Socket.IO test clients can not receive binary payloads from several threads at once
+def instrument_emits(emit_times:list):
+    emit = app.emit_state_pong
+    lock = threading.Lock()
+    def timed_emit_state_pong(game, message):
+        with lock:
+            start = time.perf_counter()
+            emit(game, message)
+            emit_times.append(time.perf_counter() - start)
+    app.emit_state_pong = timed_emit_state_pong
+
+# waits until the server has cleaned up every game
+def wait_for_games(timeout:float=10):
+    end = time.perf_counter() + timeout
+    while len(app.SERVER.games) > 0 and time.perf_counter() < end:
+        time.sleep(0.05)
+
+# runs a number of concurrent sessions for a duration, returns their measurements
+def run_level(num_sessions:int, duration:float, fps:int, binary:bool, emit_times:list, warmup:float=1)->dict:
+    flask_client = app.app.test_client()
+    bots = [Bot("load" + str(num_sessions) + "_" + str(i), flask_client, binary=binary) for i in range(num_sessions)]
+    stop = threading.Event()
+    driver = threading.Thread(target=drive_bots, args=(bots, stop), daemon=True)
+    driver.start()
+
+    # let the games start, then measure
+    time.sleep(warmup)
+    for bot in bots:
+        bot.take_arrivals()
+    emit_times.clear()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    time.sleep(duration)
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    arrivals = [bot.take_arrivals() for bot in bots]
+    emits = list(emit_times)
+
+    # end the games
+    stop.set()
+    driver.join()
+    for game_id in list(app.SERVER.games.keys()):
+        app.SERVER.stop_game(game_id)
+    wait_for_games()
+    for bot in bots:
+        bot.disconnect()
+
+    npc_latency = app.NPC_EXECUTOR.get_stats()["latency"].get("npc latency", {})
+    running = [i for i in range(num_sessions) if not bots[i].failed]
+    rates = [len(arrivals[i]) / wall for i in running]
+    gaps = np.concatenate([np.diff(arrivals[i]) for i in running if len(arrivals[i]) > 1] + [np.zeros(0)])
+    jitter = np.abs(gaps - 1 / fps) * 1000
+    return {
+        "sessions": num_sessions,
+        "running": len(running),
+        "fps": float(np.mean(rates)) if len(rates) > 0 else 0,
+        "min fps": float(np.min(rates)) if len(rates) > 0 else 0,
+        "jitter p50": float(np.percentile(jitter, 50)) if len(jitter) > 0 else 0,
+        "jitter p99": float(np.percentile(jitter, 99)) if len(jitter) > 0 else 0,
+        "emit p50": float(np.percentile(emits, 50)) * 1000 if len(emits) > 0 else 0,
+        "emit p99": float(np.percentile(emits, 99)) * 1000 if len(emits) > 0 else 0,
+        "npc p50": npc_latency.get("p50", 0),
+        "npc p99": npc_latency.get("p99", 0),
+        "cpu per game": 100 * cpu / wall / max(1, len(running)),
+        "missed": sum([bot.missed for bot in bots]),
+    }
+
+# prints the measurements of each level as a table
+def print_report(results:list, fps:int):
+    columns = ["sessions", "running", "fps", "min fps", "degradation %", "jitter p50", "jitter p99", "emit p50", "emit p99", "npc p50", "npc p99", "cpu per game", "missed"]
+    print("tick rate target", fps, "fps; jitter is |state_pong inter-arrival - 1/fps| in ms; emit latency in ms; npc latency (state submitted to action enqueued, rolling) in ms; cpu per game in % of a core")
+    print(" ".join([x.rjust(13) for x in columns]))
+    for result in results:
+        result["degradation %"] = 100 * (1 - result["fps"] / fps)
+        print(" ".join([(str(result[x]) if isinstance(result[x], int) else "%.2f" % result[x]).rjust(13) for x in columns]))
+
+def main(sessions:list, duration:float, fps:int=None, workers:int=None, binary:bool=False, live_smm:bool=False, npc:str=None, npc_workers:int=None):
+    # write the load test's logs and game metrics to a temporary folder, and apply the server settings
+    log_path = tempfile.mkdtemp(prefix="load_test_logs_")
+    app.SERVER.log_writer = dict(app.SERVER.log_writer, log_path=log_path)
+    app.SERVER.metrics_path = os.path.join(log_path, "metrics")
+    app.SERVER.live_smm = live_smm
+    if fps is not None:
+        app.MAX_FPS = fps
+    if workers is not None:
+        app.TICK_SCHEDULER.stop()
+        app.TICK_SCHEDULER = TickScheduler(workers)
+    if npc is not None or npc_workers is not None:
+        app.NPC_EXECUTOR.shutdown()
+        app.NPC_EXECUTOR = make_npc_executor(app.NPC_EXECUTOR_STRATEGY if npc is None else npc, app.NPC_WORKERS if npc_workers is None else npc_workers, fps=app.MAX_FPS)
+        env.server.game.NPC_EXECUTOR = app.NPC_EXECUTOR
+    print("Load testing", sessions, "sessions,", app.TICK_SCHEDULER.num_workers, "tick workers,", app.NPC_EXECUTOR.name, "NPC executor,", "binary" if binary else "JSON", "transport,", "live SMMs" if live_smm else "no SMMs", "logs in", log_path)
+
+    emit_times = []
+    instrument_emits(emit_times)
+    results = []
+    for num_sessions in sessions:
+        if num_sessions > app.MAX_GAMES:
+            print("Skipping", num_sessions, "sessions, the server runs at most MAX_GAMES =", app.MAX_GAMES)
+            continue
+        results.append(run_level(num_sessions, duration, app.MAX_FPS, binary, emit_times))
+    app.close_log_writers()
+    app.NPC_EXECUTOR.shutdown()
+    print_report(results, app.MAX_FPS)
+    return results
+
+if __name__ == "__main__":
+    # usage: python load_test.py [--sessions=1,2,4,8] [--duration=10] [--fps=N] [--workers=N] [--binary] [--live-smm] [--npc=inline|threads|processes] [--npc-workers=N]
+    sessions = [1, 2, 4, 8]
+    duration = 10
+    fps = None
+    workers = None
+    binary = False
+    live_smm = False
+    npc = None
+    npc_workers = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--sessions="):
+            sessions = [int(x) for x in arg.split("=")[1].split(",")]
+        elif arg.startswith("--duration="):
+            duration = float(arg.split("=")[1])
+        elif arg.startswith("--fps="):
+            fps = int(arg.split("=")[1])
+        elif arg.startswith("--workers="):
+            workers = int(arg.split("=")[1])
+        elif arg == "--binary":
+            binary = True
+        elif arg == "--live-smm":
+            live_smm = True
+        elif arg.startswith("--npc="):
+            npc = arg.split("=")[1]
+        elif arg.startswith("--npc-workers="):
+            npc_workers = int(arg.split("=")[1])
+        else:
+            raise ValueError("Unknown argument " + arg)
+    main(sessions, duration, fps=fps, workers=workers, binary=binary, live_smm=live_smm, npc=npc, npc_workers=npc_workers)
@@ -1,5 +1,11 @@
-import env.server.app
+import sys
 import smm.smm
 
 if __name__ == "__main__":
-    env.server.app.run()
+    # `python main.py --async` runs the asyncio server (env/server/async_app.py), otherwise the threaded Flask server
+    if "--async" in sys.argv:
+        sys.argv.remove("--async")
+        import env.server.async_app as server
+    else:
+        import env.server.app as server
+    server.run()
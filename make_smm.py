@@ -1,7 +1,7 @@
 # make_smm.py: processes logs to construct a mental model
 
 import smm.smm
-import ast
+import replay
 import networkx as nx
 import matplotlib.pyplot as plt
 import matplotlib
@@ -32,9 +32,8 @@ matplotlib.rcParams["font.sans-serif"] = "Roboto"
 # matplotlib.rcParams['figure.dpi'] = 600
 
 def run_smm(user_id, round):
-    # pull the lines from the log file
-    with open("env/server/logs/" + user_id + ".txt", "r") as f:
-        lines = f.readlines()
+    # pull the parsed records from the log file
+    records = replay.iter_log(user_id)
 
     # init models
     observed_model = smm.smm.SMM("predicates", visibility="O20", agent="A0")  # model that only uses observations, no updates
@@ -48,31 +47,27 @@ def run_smm(user_id, round):
     first_view = True  # on the first view, sync all belief states to the ground truth
     
     # process each line
-    for line in lines:
-        # convert to a state dict
-        state = ast.literal_eval(line)
-
+    for kind, layout, state in records:
         # ignore non-state logs
-        if "stage" in state:
+        if kind != replay.STATE:
             continue
 
         # ignore incorrect rounds
-        if "layout" not in state or state["layout"] not in rounds or rounds[state["layout"]] != round:  # ignore if incorrect layout/round
+        if layout not in rounds or rounds[layout] != round:  # ignore if incorrect layout/round
             continue
 
         # make sure the model is initialized
         if not true_model.initialized:
-            true_model.init_belief_state_from_file(state["layout"] + ".layout")
+            true_model.init_belief_state_from_file(layout + ".layout")
 
-        # update the mental models
-        state = true_model.convert_log_to_state(state)
+        # update the mental models (the state is already converted)
         observed_model.belief_state = state  # directly set the belief state of the observed model
         true_model.update(state, debug=False)
         true_belief_state = true_model.get_visible_belief_state()
 
         if first_view:
-            agent_model.model.domain_knowledge = true_belief_state
-            human_model.model.domain_knowledge = true_belief_state
+            agent_model.set_belief_state(true_belief_state)
+            human_model.set_belief_state(agent_model.belief_state, copy=False)
             first_view = False
 
         agent_model.update(true_belief_state, debug=False)
@@ -0,0 +1,674 @@
+"""
+Batched transitions for many states of one OvercookedGridworld layout.
+
+A BatchedOvercookedStates holds N states as NumPy arrays, and a
+BatchedOvercookedGridworld steps all of them with one joint action per state.
+Every rule of OvercookedGridworld.get_state_transition (interacts, movement and
+collisions, cooking) is computed as array operations over the N states. Players
+still resolve their interacts in index order within each state, as in the
+scalar path, so the only Python loop is over the (few) players.
+
+The batched path computes the next states and the sparse and shaped rewards. It
+does not compute the event infos, the potentials, or the illegal action early
+return of the scalar path (joint actions are action indices, which are always
+legal). Use verify_batched_transitions to check it against the scalar path on
+random rollouts.
+
+BatchedOvercookedGridworld.lossless_state_encoding encodes the packed states
+without unpacking them.
+"""
+
+import random
+
+import numpy as np
+
+from overcooked_ai.src.overcooked_ai_py.mdp.actions import Action, Direction
+from overcooked_ai.src.overcooked_ai_py.mdp.overcooked_mdp import (
+    LOSSLESS_LAYERS,
+    LOSSLESS_NUM_PLAYER_LAYERS,
+    LOSSLESS_URGENCY_LAYER,
+    ObjectState,
+    OvercookedState,
+    PlayerState,
+    Recipe,
+    SoupState,
+)
+
+# Object codes of the object arrays
+NO_OBJECT, ONION, TOMATO, DISH, SOUP = 0, 1, 2, 3, 4
+OBJECT_NAMES = [None, Recipe.ONION, Recipe.TOMATO, "dish", "soup"]
+OBJECT_CODES = {name: code for code, name in enumerate(OBJECT_NAMES) if name}
+
+# Terrain codes of the terrain array
+TERRAIN_CODES = {" ": 0, "X": 1, "P": 2, "O": 3, "T": 4, "D": 5, "S": 6}
+(
+    FLOOR,
+    COUNTER,
+    POT,
+    ONION_DISPENSER,
+    TOMATO_DISPENSER,
+    DISH_DISPENSER,
+    SERVING,
+) = range(7)
+
+# (dx, dy) of each action index, STAY and INTERACT do not move
+ACTION_DELTAS = np.array(
+    [
+        Direction.NORTH,
+        Direction.SOUTH,
+        Direction.EAST,
+        Direction.WEST,
+        Action.STAY,
+        Action.STAY,
+    ]
+)
+STAY_INDEX = Action.ACTION_TO_INDEX[Action.STAY]
+INTERACT_INDEX = Action.ACTION_TO_INDEX[Action.INTERACT]
+
+
+class BatchedOvercookedStates(object):
+    """
+    N OvercookedStates of the same layout, as arrays. Positions are (x, y) and
+    grids are indexed [n, y, x].
+
+    Players: positions (N, P, 2), orientations (N, P) as Direction indices, and
+    held objects (N, P) as object codes.
+    Objects not held by players: object codes (N, H, W). Soups, held or not,
+    also have their ingredients in the order they were added as object codes
+    (N, ..., MAX_NUM_INGREDIENTS) padded with NO_OBJECT, and their cooking tick
+    (-1 until they start cooking)
+    """
+
+    def __init__(
+        self,
+        positions,
+        orientations,
+        held,
+        held_ingredients,
+        held_ticks,
+        objects,
+        ingredients,
+        ticks,
+        timesteps,
+        bonus_orders,
+        all_orders,
+    ):
+        self.positions = positions
+        self.orientations = orientations
+        self.held = held
+        self.held_ingredients = held_ingredients
+        self.held_ticks = held_ticks
+        self.objects = objects
+        self.ingredients = ingredients
+        self.ticks = ticks
+        self.timesteps = timesteps
+        self.bonus_orders = bonus_orders
+        self.all_orders = all_orders
+
+    def __len__(self):
+        return len(self.timesteps)
+
+    def copy(self):
+        return BatchedOvercookedStates(
+            self.positions.copy(),
+            self.orientations.copy(),
+            self.held.copy(),
+            self.held_ingredients.copy(),
+            self.held_ticks.copy(),
+            self.objects.copy(),
+            self.ingredients.copy(),
+            self.ticks.copy(),
+            self.timesteps.copy(),
+            self.bonus_orders,
+            self.all_orders,
+        )
+
+    @staticmethod
+    def from_states(states, shape):
+        """
+        Packs OvercookedStates of a layout with grid `shape` (width, height).
+        The states must share their orders
+        """
+        width, height = shape
+        n, num_players = len(states), len(states[0].players)
+        max_ingredients = Recipe.MAX_NUM_INGREDIENTS
+        batch = BatchedOvercookedStates(
+            positions=np.zeros((n, num_players, 2), dtype=np.int64),
+            orientations=np.zeros((n, num_players), dtype=np.int64),
+            held=np.zeros((n, num_players), dtype=np.int8),
+            held_ingredients=np.zeros(
+                (n, num_players, max_ingredients), dtype=np.int8
+            ),
+            held_ticks=np.full((n, num_players), -1, dtype=np.int64),
+            objects=np.zeros((n, height, width), dtype=np.int8),
+            ingredients=np.zeros(
+                (n, height, width, max_ingredients), dtype=np.int8
+            ),
+            ticks=np.full((n, height, width), -1, dtype=np.int64),
+            timesteps=np.zeros(n, dtype=np.int64),
+            bonus_orders=[order.to_dict() for order in states[0].bonus_orders],
+            all_orders=[order.to_dict() for order in states[0].all_orders],
+        )
+        for i, state in enumerate(states):
+            batch.timesteps[i] = state.timestep
+            for p, player in enumerate(state.players):
+                batch.positions[i, p] = player.position
+                batch.orientations[i, p] = Direction.DIRECTION_TO_INDEX[
+                    player.orientation
+                ]
+                if player.held_object is not None:
+                    batch.held[i, p], tick, ingredients = _pack_object(
+                        player.held_object
+                    )
+                    batch.held_ticks[i, p] = tick
+                    batch.held_ingredients[i, p, : len(ingredients)] = (
+                        ingredients
+                    )
+            for (x, y), obj in state.objects.items():
+                batch.objects[i, y, x], tick, ingredients = _pack_object(obj)
+                batch.ticks[i, y, x] = tick
+                batch.ingredients[i, y, x, : len(ingredients)] = ingredients
+        return batch
+
+    def to_states(self):
+        """
+        Unpacks the states into OvercookedStates
+        """
+        states = []
+        for i in range(len(self)):
+            players = []
+            for p in range(self.positions.shape[1]):
+                position = tuple(int(c) for c in self.positions[i, p])
+                held_object = _unpack_object(
+                    self.held[i, p],
+                    position,
+                    self.held_ingredients[i, p],
+                    self.held_ticks[i, p],
+                )
+                players.append(
+                    PlayerState(
+                        position,
+                        Direction.INDEX_TO_DIRECTION[self.orientations[i, p]],
+                        held_object,
+                    )
+                )
+            objects = {}
+            for y, x in zip(*np.nonzero(self.objects[i])):
+                position = (int(x), int(y))
+                objects[position] = _unpack_object(
+                    self.objects[i, y, x],
+                    position,
+                    self.ingredients[i, y, x],
+                    self.ticks[i, y, x],
+                )
+            states.append(
+                OvercookedState(
+                    players,
+                    objects,
+                    bonus_orders=self.bonus_orders,
+                    all_orders=self.all_orders,
+                    timestep=int(self.timesteps[i]),
+                )
+            )
+        return states
+
+
+def _pack_object(obj):
+    # returns the code, cooking tick and ingredient codes of an object
+    if obj.name not in OBJECT_CODES:
+        raise ValueError("Unknown object {}".format(obj.name))
+    if obj.name != "soup":
+        return OBJECT_CODES[obj.name], -1, []
+    return (
+        SOUP,
+        obj._cooking_tick,
+        [OBJECT_CODES[name] for name in obj.ingredients],
+    )
+
+
+def _unpack_object(code, position, ingredients, tick):
+    if code == NO_OBJECT:
+        return None
+    if code != SOUP:
+        return ObjectState(OBJECT_NAMES[code], position)
+    ingredients = [
+        ObjectState(OBJECT_NAMES[c], position)
+        for c in ingredients
+        if c != NO_OBJECT
+    ]
+    return SoupState(position, ingredients, int(tick))
+
+
+class BatchedOvercookedGridworld(object):
+    """
+    Steps many states of an OvercookedGridworld layout at once, see
+    BatchedOvercookedStates.
+
+    The recipe values and cooking times are tabled by the number of onions and
+    tomatoes of a soup when the engine is built, from the Recipe configuration
+    of the mdp and the orders of `reference_state` (the mdp's standard start
+    state by default), so the states stepped must have the same orders
+    """
+
+    def __init__(self, mdp, reference_state=None):
+        self.mdp = mdp
+        self.num_players = mdp.num_players
+        self.old_dynamics = mdp.old_dynamics
+        self.terrain = np.array(
+            [
+                [TERRAIN_CODES.get(c, -1) for c in row]
+                for row in mdp.terrain_mtx
+            ],
+            dtype=np.int8,
+        )
+        self.pot_cells = np.array(
+            [(y, x) for x, y in mdp.get_pot_locations()], dtype=np.int64
+        ).reshape(-1, 2)
+        self.counter_mask = self.terrain == COUNTER
+        self.floor_mask = np.zeros(self.terrain.shape, dtype=bool)
+        for x, y in mdp.get_valid_player_positions():
+            self.floor_mask[y, x] = True
+        self.shaping = mdp.reward_shaping_params
+        # the terrain channels of the lossless state encoding, by [y, x]
+        self.base_map_layers = np.stack(
+            [
+                self.terrain == t
+                for t in [
+                    POT,
+                    COUNTER,
+                    ONION_DISPENSER,
+                    TOMATO_DISPENSER,
+                    DISH_DISPENSER,
+                    SERVING,
+                ]
+            ],
+            axis=-1,
+        )
+
+        # values and cooking times of the soups by [onions, tomatoes]
+        reference_state = (
+            mdp.get_standard_start_state()
+            if reference_state is None
+            else reference_state
+        )
+        size = Recipe.MAX_NUM_INGREDIENTS + 1
+        self.cook_times = np.zeros((size, size), dtype=np.int64)
+        self.values = np.zeros((size, size), dtype=np.float64)
+        for onions in range(size):
+            for tomatoes in range(size - onions):
+                if onions + tomatoes == 0:
+                    continue
+                recipe = Recipe(
+                    [Recipe.ONION] * onions + [Recipe.TOMATO] * tomatoes
+                )
+                self.cook_times[onions, tomatoes] = recipe.time
+                self.values[onions, tomatoes] = mdp.get_recipe_value(
+                    reference_state, recipe
+                )
+
+    def from_states(self, states):
+        return BatchedOvercookedStates.from_states(states, self.mdp.shape)
+
+    def _soup_cook_times(self, ingredients):
+        onions = (ingredients == ONION).sum(axis=-1)
+        tomatoes = (ingredients == TOMATO).sum(axis=-1)
+        return self.cook_times[onions, tomatoes]
+
+    def get_state_transitions(self, batch, joint_actions):
+        """
+        Steps every state of a batch with its joint action, given as action
+        indices (N, P) (see Action.ACTION_TO_INDEX). Returns the next states,
+        and the sparse and shaped rewards by agent (N, P)
+        """
+        batch = batch.copy()
+        joint_actions = np.asarray(joint_actions)
+        sparse_rewards, shaped_rewards = self.resolve_interacts(
+            batch, joint_actions
+        )
+        self.resolve_movement(batch, joint_actions)
+        self.step_environment_effects(batch)
+        return batch, sparse_rewards, shaped_rewards
+
+    def resolve_interacts(self, batch, joint_actions):
+        """
+        Resolves the INTERACT actions in place, player by player as in the
+        scalar path
+        """
+        n = len(batch)
+        envs = np.arange(n)
+        sparse = np.zeros((n, self.num_players), dtype=np.float64)
+        shaped = np.zeros((n, self.num_players), dtype=np.float64)
+
+        # the pot states before the interacts, for the dish pickup shaping
+        pot_ys, pot_xs = self.pot_cells[:, 0], self.pot_cells[:, 1]
+        pot_ticks = batch.ticks[:, pot_ys, pot_xs]
+        pot_counts = (batch.ingredients[:, pot_ys, pot_xs] != NO_OBJECT).sum(
+            axis=-1
+        )
+        # ready, cooking or partially full
+        non_empty_pots = (
+            (batch.objects[:, pot_ys, pot_xs] == SOUP)
+            & (
+                (pot_ticks >= 0)
+                | (
+                    (pot_counts >= 1)
+                    & (pot_counts < Recipe.MAX_NUM_INGREDIENTS)
+                )
+            )
+        ).sum(axis=1)
+
+        for p in range(self.num_players):
+            interacting = joint_actions[:, p] == INTERACT_INDEX
+            if not interacting.any():
+                continue
+            target = (
+                batch.positions[:, p] + ACTION_DELTAS[batch.orientations[:, p]]
+            )
+            tx, ty = target[:, 0], target[:, 1]
+            terrain = np.where(interacting, self.terrain[ty, tx], -1)
+            held = batch.held[:, p]
+            holding = held != NO_OBJECT
+            cell = batch.objects[envs, ty, tx]
+
+            # counters: drop onto an empty counter, or pick up from a counter
+            drop = (terrain == COUNTER) & holding & (cell == NO_OBJECT)
+            pickup = (terrain == COUNTER) & ~holding & (cell != NO_OBJECT)
+            self._move_held_to_cell(batch, drop, p, ty, tx)
+            self._move_cell_to_held(batch, pickup, p, ty, tx)
+
+            # dispensers
+            batch.held[(terrain == ONION_DISPENSER) & ~holding, p] = ONION
+            batch.held[(terrain == TOMATO_DISPENSER) & ~holding, p] = TOMATO
+            dish_pickup = (terrain == DISH_DISPENSER) & ~holding
+            if dish_pickup.any() and self.num_players == 2:
+                dishes_on_counters = (
+                    (batch.objects == DISH) & self.counter_mask
+                ).sum(axis=(1, 2))
+                player_dishes = (batch.held == DISH).sum(axis=1)
+                useful = (dishes_on_counters == 0) & (
+                    player_dishes < non_empty_pots
+                )
+                shaped[dish_pickup & useful, p] += self.shaping[
+                    "DISH_PICKUP_REWARD"
+                ]
+            batch.held[dish_pickup, p] = DISH
+
+            # pots
+            at_pot = terrain == POT
+            soup_here = cell == SOUP
+            cell_ticks = batch.ticks[envs, ty, tx]
+            cell_ingredients = batch.ingredients[envs, ty, tx]
+            cell_counts = (cell_ingredients != NO_OBJECT).sum(axis=-1)
+            cell_ready = (
+                soup_here
+                & (cell_ticks >= 0)
+                & (cell_ticks >= self._soup_cook_times(cell_ingredients))
+            )
+            if not self.old_dynamics:
+                start = (
+                    at_pot
+                    & ~holding
+                    & soup_here
+                    & (cell_ticks < 0)
+                    & (cell_counts > 0)
+                )
+                batch.ticks[envs[start], ty[start], tx[start]] = 0
+            soup_pickup = at_pot & (held == DISH) & cell_ready
+            batch.held[soup_pickup, p] = NO_OBJECT
+            self._move_cell_to_held(batch, soup_pickup, p, ty, tx)
+            shaped[soup_pickup, p] += self.shaping["SOUP_PICKUP_REWARD"]
+            potting = at_pot & ((held == ONION) | (held == TOMATO))
+            # an empty pot gets an empty soup, which is never full
+            new_soup = potting & ~soup_here
+            batch.objects[envs[new_soup], ty[new_soup], tx[new_soup]] = SOUP
+            batch.ticks[envs[new_soup], ty[new_soup], tx[new_soup]] = -1
+            batch.ingredients[envs[new_soup], ty[new_soup], tx[new_soup]] = (
+                NO_OBJECT
+            )
+            counts = np.where(new_soup, 0, cell_counts)
+            not_full = np.where(
+                new_soup,
+                True,
+                (cell_ticks < 0) & (cell_counts < Recipe.MAX_NUM_INGREDIENTS),
+            )
+            add = potting & not_full
+            batch.ingredients[envs[add], ty[add], tx[add], counts[add]] = held[
+                add
+            ]
+            batch.held[add, p] = NO_OBJECT
+            shaped[add, p] += self.shaping["PLACEMENT_IN_POT_REW"]
+
+            # serving
+            deliver = (terrain == SERVING) & (held == SOUP)
+            if deliver.any():
+                delivered = batch.held_ingredients[deliver, p]
+                onions = (delivered == ONION).sum(axis=-1)
+                tomatoes = (delivered == TOMATO).sum(axis=-1)
+                sparse[deliver, p] += self.values[onions, tomatoes]
+                batch.held[deliver, p] = NO_OBJECT
+                batch.held_ingredients[deliver, p] = NO_OBJECT
+                batch.held_ticks[deliver, p] = -1
+        return sparse, shaped
+
+    def _move_held_to_cell(self, batch, mask, p, ty, tx):
+        envs = np.nonzero(mask)[0]
+        ys, xs = ty[envs], tx[envs]
+        batch.objects[envs, ys, xs] = batch.held[envs, p]
+        batch.ingredients[envs, ys, xs] = batch.held_ingredients[envs, p]
+        batch.ticks[envs, ys, xs] = batch.held_ticks[envs, p]
+        batch.held[envs, p] = NO_OBJECT
+        batch.held_ingredients[envs, p] = NO_OBJECT
+        batch.held_ticks[envs, p] = -1
+
+    def _move_cell_to_held(self, batch, mask, p, ty, tx):
+        envs = np.nonzero(mask)[0]
+        ys, xs = ty[envs], tx[envs]
+        batch.held[envs, p] = batch.objects[envs, ys, xs]
+        batch.held_ingredients[envs, p] = batch.ingredients[envs, ys, xs]
+        batch.held_ticks[envs, p] = batch.ticks[envs, ys, xs]
+        batch.objects[envs, ys, xs] = NO_OBJECT
+        batch.ingredients[envs, ys, xs] = NO_OBJECT
+        batch.ticks[envs, ys, xs] = -1
+
+    def resolve_movement(self, batch, joint_actions):
+        """
+        Moves the players in place. Players that would end on the same cell or
+        swap cells all stay put, but still turn, as in the scalar path
+        """
+        moving = joint_actions < STAY_INDEX
+        candidates = batch.positions + ACTION_DELTAS[joint_actions]
+        valid = self.floor_mask[candidates[..., 1], candidates[..., 0]]
+        new_positions = np.where(
+            (moving & valid)[..., None], candidates, batch.positions
+        )
+        batch.orientations[...] = np.where(
+            moving, joint_actions, batch.orientations
+        )
+
+        collision = np.zeros(len(batch), dtype=bool)
+        for p0 in range(self.num_players):
+            for p1 in range(p0 + 1, self.num_players):
+                same = (new_positions[:, p0] == new_positions[:, p1]).all(
+                    axis=1
+                )
+                swap = (new_positions[:, p0] == batch.positions[:, p1]).all(
+                    axis=1
+                ) & (new_positions[:, p1] == batch.positions[:, p0]).all(
+                    axis=1
+                )
+                collision |= same | swap
+        batch.positions[~collision] = new_positions[~collision]
+
+    def step_environment_effects(self, batch):
+        """
+        Advances the timesteps and cooks the soups that are not held, in place
+        """
+        batch.timesteps += 1
+        soups = batch.objects == SOUP
+        counts = (batch.ingredients != NO_OBJECT).sum(axis=-1)
+        if self.old_dynamics:
+            # soups start cooking when they have 3 ingredients
+            batch.ticks[soups & (batch.ticks < 0) & (counts == 3)] = 0
+        cooking = (
+            soups
+            & (batch.ticks >= 0)
+            & (batch.ticks < self._soup_cook_times(batch.ingredients))
+        )
+        batch.ticks[cooking] += 1
+
+    def lossless_state_encoding(self, batch, out=None, horizon=400, dtype=int):
+        """
+        Lossless state encodings of every state of a batch, as a (N,
+        num_players, width, height, 26) array written into `out` if given.
+        out[i, p] is mdp.lossless_state_encoding(state i)[p]
+        """
+        assert (
+            self.num_players == 2
+        ), "Functionality has to be added to support encondings for > 2 players"
+        n = len(batch)
+        if out is None:
+            out = np.empty(
+                (n, self.num_players)
+                + tuple(self.mdp.get_lossless_state_encoding_shape()),
+                dtype=dtype,
+            )
+        out.fill(0)
+
+        # the terrain and object channels of the first player's view, by
+        # [n, y, x]
+        view = out[:, 0].transpose(0, 2, 1, 3)
+        base = LOSSLESS_NUM_PLAYER_LAYERS
+        view[..., base : base + self.base_map_layers.shape[-1]] = (
+            self.base_map_layers
+        )
+        view[horizon - batch.timesteps < 40, :, :, LOSSLESS_URGENCY_LAYER] = 1
+        soups = batch.objects == SOUP
+        onions = (batch.ingredients == ONION).sum(axis=-1)
+        tomatoes = (batch.ingredients == TOMATO).sum(axis=-1)
+        in_pot = soups & (self.terrain == POT)
+        idle_in_pot = in_pot & (batch.ticks < 0)
+        cooking_in_pot = in_pot & (batch.ticks >= 0)
+        # soups out of pots count as cooked with no time remaining
+        cooked = soups & ~idle_in_pot
+        cook_times = self._soup_cook_times(batch.ingredients)
+        view[..., LOSSLESS_LAYERS["onions_in_pot"]] = np.where(
+            idle_in_pot, onions, 0
+        )
+        view[..., LOSSLESS_LAYERS["tomatoes_in_pot"]] = np.where(
+            idle_in_pot, tomatoes, 0
+        )
+        view[..., LOSSLESS_LAYERS["onions_in_soup"]] = np.where(
+            cooked, onions, 0
+        )
+        view[..., LOSSLESS_LAYERS["tomatoes_in_soup"]] = np.where(
+            cooked, tomatoes, 0
+        )
+        view[..., LOSSLESS_LAYERS["soup_cook_time_remaining"]] = np.where(
+            cooking_in_pot, cook_times - batch.ticks, 0
+        )
+        view[..., LOSSLESS_LAYERS["soup_done"]] = (soups & ~in_pot) | (
+            cooking_in_pot & (batch.ticks >= cook_times)
+        )
+        view[..., LOSSLESS_LAYERS["dishes"]] = batch.objects == DISH
+        view[..., LOSSLESS_LAYERS["onions"]] = batch.objects == ONION
+        view[..., LOSSLESS_LAYERS["tomatoes"]] = batch.objects == TOMATO
+
+        # held objects are at their player's position, and held soups are out
+        # of pots
+        envs, players = np.nonzero(batch.held != NO_OBJECT)
+        held = batch.held[envs, players]
+        held_ingredients = batch.held_ingredients[envs, players]
+        cells = (
+            envs,
+            batch.positions[envs, players, 1],
+            batch.positions[envs, players, 0],
+        )
+        for layer_id, values in [
+            ("onions_in_soup", (held_ingredients == ONION).sum(axis=-1)),
+            ("tomatoes_in_soup", (held_ingredients == TOMATO).sum(axis=-1)),
+            ("soup_done", held == SOUP),
+            ("dishes", held == DISH),
+            ("onions", held == ONION),
+            ("tomatoes", held == TOMATO),
+        ]:
+            np.add.at(view, cells + (LOSSLESS_LAYERS[layer_id],), values)
+        out[:, 1:, :, :, base:] = out[:, :1, :, :, base:]
+
+        # the location and orientation channels, primary player first
+        envs = np.arange(n)
+        for primary_agent_idx in range(self.num_players):
+            for i, player_idx in enumerate(
+                [primary_agent_idx, 1 - primary_agent_idx]
+            ):
+                xs, ys = (
+                    batch.positions[:, player_idx, 0],
+                    batch.positions[:, player_idx, 1],
+                )
+                out[envs, primary_agent_idx, xs, ys, i] = 1
+                out[
+                    envs,
+                    primary_agent_idx,
+                    xs,
+                    ys,
+                    self.num_players
+                    + 4 * i
+                    + batch.orientations[:, player_idx],
+                ] = 1
+        return out
+
+
+def verify_batched_transitions(
+    mdp, num_states=64, num_steps=500, seed=0, interact_weight=3
+):
+    """
+    Steps `num_states` random rollouts from the mdp's standard start state with
+    both the batched and the scalar path, and checks that every state and
+    reward is the same. Random actions favor INTERACT by `interact_weight` so
+    soups get cooked. Returns the number of transitions checked, raises
+    AssertionError on the first mismatch
+    """
+    rng = random.Random(seed)
+    engine = BatchedOvercookedGridworld(mdp)
+    states = [
+        mdp.get_standard_start_state().deepcopy() for _ in range(num_states)
+    ]
+    batch = engine.from_states(states)
+    actions = list(range(Action.NUM_ACTIONS)) + [INTERACT_INDEX] * (
+        interact_weight - 1
+    )
+    for step in range(num_steps):
+        joint_actions = np.array(
+            [
+                [rng.choice(actions) for _ in range(mdp.num_players)]
+                for _ in range(num_states)
+            ]
+        )
+        batch, sparse, shaped = engine.get_state_transitions(
+            batch, joint_actions
+        )
+        for i, state in enumerate(states):
+            states[i], info = mdp.get_state_transition(
+                state,
+                tuple(Action.INDEX_TO_ACTION[a] for a in joint_actions[i]),
+            )
+            assert list(sparse[i]) == info["sparse_reward_by_agent"], (
+                step,
+                i,
+                "sparse reward",
+            )
+            assert list(shaped[i]) == info["shaped_reward_by_agent"], (
+                step,
+                i,
+                "shaped reward",
+            )
+        for i, unpacked in enumerate(batch.to_states()):
+            assert unpacked == states[i], (
+                step,
+                i,
+                str(unpacked),
+                str(states[i]),
+            )
+            assert (
+                unpacked.to_dict()["players"] == states[i].to_dict()["players"]
+            ), (step, i)
+    return num_states * num_steps
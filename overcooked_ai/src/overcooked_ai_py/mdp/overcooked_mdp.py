@@ -2,7 +2,6 @@ import copy
 import itertools
 import warnings
 from collections import Counter, defaultdict
-from functools import reduce
 
 import numpy as np
 
@@ -64,11 +63,25 @@ class Recipe:
 
     def __init__(self, ingredients):
         self._ingredients = ingredients
+        # Recipes are read-only, so the sorted ingredients and the integer encoding (used for sorting orders)
+        # are computed once. The encoding depends on MAX_NUM_INGREDIENTS, so it is keyed by it
+        self._sorted_ingredients = tuple(sorted(ingredients))
+        self._int_cache = None
 
     def __getnewargs__(self):
         return (self._ingredients,)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sorted_ingredients = tuple(sorted(self._ingredients))
+        self._int_cache = None
+
     def __int__(self):
+        if (
+            self._int_cache is not None
+            and self._int_cache[0] == Recipe.MAX_NUM_INGREDIENTS
+        ):
+            return self._int_cache[1]
         num_tomatoes = len([_ for _ in self.ingredients if _ == Recipe.TOMATO])
         num_onions = len([_ for _ in self.ingredients if _ == Recipe.ONION])
 
@@ -78,7 +91,9 @@ class Recipe:
         )
         encoding = num_onions + (Recipe.MAX_NUM_INGREDIENTS + 1) * num_tomatoes
 
-        return mixed_mask * encoding * mixed_shift + encoding
+        value = mixed_mask * encoding * mixed_shift + encoding
+        self._int_cache = (Recipe.MAX_NUM_INGREDIENTS, value)
+        return value
 
     def __hash__(self):
         return hash(self.ingredients)
@@ -125,7 +140,7 @@ class Recipe:
 
     @property
     def ingredients(self):
-        return tuple(sorted(self._ingredients))
+        return self._sorted_ingredients
 
     @ingredients.setter
     def ingredients(self, _):
@@ -381,11 +396,36 @@ class Recipe:
         return cls(**obj_dict)
 
 
+def _get_slots_state(obj):
+    """
+    Returns the values of the __slots__ of an object and its base classes, for pickling
+    """
+    return {
+        key: getattr(obj, key)
+        for cls in type(obj).__mro__
+        for key in getattr(cls, "__slots__", ())
+    }
+
+
+def _set_slots_state(obj, state):
+    """
+    Restores the pickled state of an object with __slots__: the (None, slots dict) state of the slots, or the
+    __dict__ of the object pickled before its class had __slots__
+    """
+    if isinstance(state, tuple):
+        state = state[1]
+    for key, value in state.items():
+        setattr(obj, key, value)
+
+
 class ObjectState(object):
     """
     State of an object in OvercookedGridworld.
     """
 
+    # States are copied on every transition, __slots__ makes them smaller and cheaper to build
+    __slots__ = ("name", "_position")
+
     def __init__(self, name, position, **kwargs):
         """
         name (str): The name of the object
@@ -406,7 +446,16 @@ class ObjectState(object):
         return self.name in ["onion", "tomato", "dish"]
 
     def deepcopy(self):
-        return ObjectState(self.name, self.position)
+        obj = ObjectState.__new__(ObjectState)
+        obj.name = self.name
+        obj._position = self._position
+        return obj
+
+    def __getstate__(self):
+        return _get_slots_state(self)
+
+    def __setstate__(self, state):
+        _set_slots_state(self, state)
 
     def __eq__(self, other):
         return (
@@ -431,6 +480,8 @@ class ObjectState(object):
 
 
 class SoupState(ObjectState):
+    __slots__ = ("_ingredients", "_cooking_tick", "_recipe", "_cook_time")
+
     def __init__(
         self,
         position,
@@ -606,11 +657,16 @@ class SoupState(ObjectState):
         self._cooking_tick += 1
 
     def deepcopy(self):
-        return SoupState(
-            self.position,
-            [ingredient.deepcopy() for ingredient in self._ingredients],
-            self._cooking_tick,
-        )
+        soup = SoupState.__new__(SoupState)
+        soup.name = self.name
+        soup._position = self._position
+        soup._ingredients = [
+            ingredient.deepcopy() for ingredient in self._ingredients
+        ]
+        soup._cooking_tick = self._cooking_tick
+        soup._recipe = None
+        soup._cook_time = None
+        return soup
 
     def to_dict(self):
         info_dict = super(SoupState, self).to_dict()
@@ -703,6 +759,8 @@ class PlayerState(object):
                  None if there is no such object.
     """
 
+    __slots__ = ("position", "orientation", "held_object")
+
     def __init__(self, position, orientation, held_object=None):
         self.position = tuple(position)
         self.orientation = tuple(orientation)
@@ -742,10 +800,20 @@ class PlayerState(object):
             self.get_object().position = new_position
 
     def deepcopy(self):
-        new_obj = (
+        # the copied player already passed the checks of __init__
+        player = PlayerState.__new__(PlayerState)
+        player.position = self.position
+        player.orientation = self.orientation
+        player.held_object = (
             None if self.held_object is None else self.held_object.deepcopy()
         )
-        return PlayerState(self.position, self.orientation, new_obj)
+        return player
+
+    def __getstate__(self):
+        return _get_slots_state(self)
+
+    def __setstate__(self, state):
+        _set_slots_state(self, state)
 
     def __eq__(self, other):
         return (
@@ -812,6 +880,7 @@ class OvercookedState(object):
         self._bonus_orders = bonus_orders
         self._all_orders = all_orders
         self.timestep = timestep
+        self._objects_by_type = None
 
         assert len(set(self.bonus_orders)) == len(
             self.bonus_orders
@@ -844,8 +913,8 @@ class OvercookedState(object):
         ones held by players.
         """
         objects_by_type = defaultdict(list)
-        for _pos, obj in self.objects.items():
-            objects_by_type[obj.name].append(obj)
+        for name, objects in self.get_objects_by_type().items():
+            objects_by_type[name] = list(objects.values())
         return objects_by_type
 
     @property
@@ -875,8 +944,26 @@ class OvercookedState(object):
 
     @property
     def all_objects_list(self):
-        all_objects_lists = list(self.all_objects_by_type.values()) + [[], []]
-        return reduce(lambda x, y: x + y, all_objects_lists)
+        return [
+            obj
+            for objects in self.all_objects_by_type.values()
+            for obj in objects
+        ]
+
+    def get_objects_by_type(self):
+        """
+        Returns the index of the objects NOT held by players by type, as a
+        dictionary of (obj_name: {position: ObjState}) with the positions of
+        each type in the order of self.objects. The index is built on first
+        use and kept up to date by add_object and remove_object, so it must
+        not be modified, and self.objects must only be changed through them
+        """
+        if self._objects_by_type is None:
+            objects_by_type = {}
+            for pos, obj in self.objects.items():
+                objects_by_type.setdefault(obj.name, {})[pos] = obj
+            self._objects_by_type = objects_by_type
+        return self._objects_by_type
 
     @property
     def all_orders(self):
@@ -904,11 +991,18 @@ class OvercookedState(object):
         assert not self.has_object(pos)
         obj.position = pos
         self.objects[pos] = obj
+        if self._objects_by_type is not None:
+            self._objects_by_type.setdefault(obj.name, {})[pos] = obj
 
     def remove_object(self, pos):
         assert self.has_object(pos)
         obj = self.objects[pos]
         del self.objects[pos]
+        if self._objects_by_type is not None:
+            objects = self._objects_by_type[obj.name]
+            del objects[pos]
+            if not objects:
+                del self._objects_by_type[obj.name]
         return obj
 
     def reverse_players(self):
@@ -950,13 +1044,30 @@ class OvercookedState(object):
         )
 
     def deepcopy(self):
-        return OvercookedState(
-            players=[player.deepcopy() for player in self.players],
-            objects={pos: obj.deepcopy() for pos, obj in self.objects.items()},
-            bonus_orders=[order.to_dict() for order in self.bonus_orders],
-            all_orders=[order.to_dict() for order in self.all_orders],
-            timestep=self.timestep,
-        )
+        # Recipes are read-only and cached, so the copy shares them rather than rebuilding them from dicts, and
+        # skips the order checks of __init__ that this state already passed. Only the players and objects,
+        # which transitions modify, are copied
+        state = OvercookedState.__new__(OvercookedState)
+        state.players = tuple(player.deepcopy() for player in self.players)
+        state.objects = {
+            pos: obj.deepcopy() for pos, obj in self.objects.items()
+        }
+        state._bonus_orders = self.bonus_orders
+        state._all_orders = self.all_orders
+        state.timestep = self.timestep
+        state._objects_by_type = None
+        return state
+
+    def __getstate__(self):
+        # the object index is rebuilt on first use
+        state = self.__dict__.copy()
+        state["_objects_by_type"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # states pickled before the object index was added don't have it
+        self._objects_by_type = None
 
     def time_independent_equal(self, other):
         order_lists_equal = (
@@ -1072,6 +1183,39 @@ POTENTIAL_CONSTANTS = {
     },
 }
 
+# Channels of the lossless state encoding, after the player location and orientation channels
+LOSSLESS_BASE_MAP_FEATURES = [
+    "pot_loc",
+    "counter_loc",
+    "onion_disp_loc",
+    "tomato_disp_loc",
+    "dish_disp_loc",
+    "serve_loc",
+]
+LOSSLESS_VARIABLE_MAP_FEATURES = [
+    "onions_in_pot",
+    "tomatoes_in_pot",
+    "onions_in_soup",
+    "tomatoes_in_soup",
+    "soup_cook_time_remaining",
+    "soup_done",
+    "dishes",
+    "onions",
+    "tomatoes",
+]
+LOSSLESS_URGENCY_FEATURES = ["urgency"]
+# 2 location and 8 orientation channels for the 2 players
+LOSSLESS_NUM_PLAYER_LAYERS = 10
+LOSSLESS_LAYERS = {
+    layer_id: LOSSLESS_NUM_PLAYER_LAYERS + i
+    for i, layer_id in enumerate(
+        LOSSLESS_BASE_MAP_FEATURES
+        + LOSSLESS_VARIABLE_MAP_FEATURES
+        + LOSSLESS_URGENCY_FEATURES
+    )
+}
+LOSSLESS_URGENCY_LAYER = LOSSLESS_LAYERS["urgency"]
+
 
 class OvercookedGridworld(object):
     """
@@ -1130,6 +1274,7 @@ class OvercookedGridworld(object):
         self.shape = (self.width, self.height)
         self.terrain_mtx = terrain
         self.terrain_pos_dict = self._get_terrain_type_pos_dict()
+        self._counter_locations_set = set(self.terrain_pos_dict["X"])
         self.start_player_positions = start_player_positions
         self.num_players = len(start_player_positions)
         self.start_bonus_orders = start_bonus_orders
@@ -1144,6 +1289,7 @@ class OvercookedGridworld(object):
         self._opt_recipe_discount_cache = {}
         self._opt_recipe_cache = {}
         self._prev_potential_params = {}
+        self._lossless_base_map_layers = None
         # determines whether to start cooking automatically once 3 items are in the pot
         self.old_dynamics = old_dynamics
 
@@ -1845,14 +1991,15 @@ class OvercookedGridworld(object):
     def get_counter_objects_dict(self, state, counter_subset=None):
         """Returns a dictionary of pos:objects on counters by type"""
         counters_considered = (
-            self.terrain_pos_dict["X"]
+            self._counter_locations_set
             if counter_subset is None
-            else counter_subset
+            else set(counter_subset)
         )
         counter_objects_dict = defaultdict(list)
-        for obj in state.objects.values():
-            if obj.position in counters_considered:
-                counter_objects_dict[obj.name].append(obj.position)
+        for obj_name, objects in state.get_objects_by_type().items():
+            positions = [pos for pos in objects if pos in counters_considered]
+            if positions:
+                counter_objects_dict[obj_name] = positions
         return counter_objects_dict
 
     def get_empty_counter_locations(self, state):
@@ -2387,183 +2534,179 @@ class OvercookedGridworld(object):
     def get_lossless_state_encoding_shape(self):
         return np.array(list(self.shape) + [26])
 
+    def get_lossless_state_encoding_layers(self, primary_agent_idx=0):
+        """Names of the channels of a player's lossless state encoding, in order"""
+        # Ensure that primary_agent_idx layers are ordered before other_agent_idx layers
+        other_agent_idx = 1 - primary_agent_idx
+        ordered_player_features = [
+            "player_{}_loc".format(primary_agent_idx),
+            "player_{}_loc".format(other_agent_idx),
+        ] + [
+            "player_{}_orientation_{}".format(
+                i, Direction.DIRECTION_TO_INDEX[d]
+            )
+            for i, d in itertools.product(
+                [primary_agent_idx, other_agent_idx],
+                Direction.ALL_DIRECTIONS,
+            )
+        ]
+        return (
+            ordered_player_features
+            + LOSSLESS_BASE_MAP_FEATURES
+            + LOSSLESS_VARIABLE_MAP_FEATURES
+            + LOSSLESS_URGENCY_FEATURES
+        )
+
+    def get_lossless_base_map_layers(self):
+        """
+        The (width, height, 6) channels of the lossless state encoding that only depend on the terrain, in the
+        order of LOSSLESS_BASE_MAP_FEATURES. Computed once per layout
+        """
+        if self._lossless_base_map_layers is None:
+            layers = np.zeros(
+                self.shape + (len(LOSSLESS_BASE_MAP_FEATURES),), dtype=int
+            )
+            for i, locations in enumerate(
+                [
+                    self.get_pot_locations(),
+                    self.get_counter_locations(),
+                    self.get_onion_dispenser_locations(),
+                    self.get_tomato_dispenser_locations(),
+                    self.get_dish_dispenser_locations(),
+                    self.get_serving_locations(),
+                ]
+            ):
+                for loc in locations:
+                    layers[loc][i] = 1
+            self._lossless_base_map_layers = layers
+        return self._lossless_base_map_layers
+
     def lossless_state_encoding(
         self, overcooked_state, horizon=400, debug=False
     ):
         """Featurizes a OvercookedState object into a stack of boolean masks that are easily readable by a CNN"""
-        assert (
-            self.num_players == 2
-        ), "Functionality has to be added to support encondings for > 2 players"
         assert type(debug) is bool
-        base_map_features = [
-            "pot_loc",
-            "counter_loc",
-            "onion_disp_loc",
-            "tomato_disp_loc",
-            "dish_disp_loc",
-            "serve_loc",
-        ]
-        variable_map_features = [
-            "onions_in_pot",
-            "tomatoes_in_pot",
-            "onions_in_soup",
-            "tomatoes_in_soup",
-            "soup_cook_time_remaining",
-            "soup_done",
-            "dishes",
-            "onions",
-            "tomatoes",
-        ]
-        urgency_features = ["urgency"]
-        all_objects = overcooked_state.all_objects_list
-
-        def make_layer(position, value):
-            layer = np.zeros(self.shape)
-            layer[position] = value
-            return layer
-
-        def process_for_player(primary_agent_idx):
-            # Ensure that primary_agent_idx layers are ordered before other_agent_idx layers
-            other_agent_idx = 1 - primary_agent_idx
-            ordered_player_features = [
-                "player_{}_loc".format(primary_agent_idx),
-                "player_{}_loc".format(other_agent_idx),
-            ] + [
-                "player_{}_orientation_{}".format(
-                    i, Direction.DIRECTION_TO_INDEX[d]
-                )
-                for i, d in itertools.product(
-                    [primary_agent_idx, other_agent_idx],
-                    Direction.ALL_DIRECTIONS,
+        encoding = self.lossless_state_encoding_into(
+            overcooked_state, horizon=horizon
+        )
+        if debug:
+            for primary_agent_idx, player_encoding in enumerate(encoding):
+                layers = self.get_lossless_state_encoding_layers(
+                    primary_agent_idx
                 )
-            ]
+                print("terrain----")
+                print(np.array(self.terrain_mtx))
+                print("-----------")
+                print(len(layers))
+                print(player_encoding.shape[2])
+                for i, layer_id in enumerate(layers):
+                    print(layer_id)
+                    print(np.transpose(player_encoding[:, :, i], (1, 0)))
+        # NOTE: currently not including time left or order_list in featurization
+        return tuple(encoding)
+
+    def lossless_state_encoding_into(
+        self, overcooked_state, out=None, horizon=400, dtype=int
+    ):
+        """
+        Writes the lossless state encodings of all the players into `out`, a (num_players, width, height, 26)
+        array, and returns it. out[i] is lossless_state_encoding(overcooked_state)[i], in out's dtype (e.g. a
+        reused uint8 or float32 buffer), and a new buffer of `dtype` is allocated if out is None.
 
-            # LAYERS = ordered_player_features + base_map_features + variable_map_features
-            LAYERS = (
-                ordered_player_features
-                + base_map_features
-                + variable_map_features
-                + urgency_features
+        The terrain and object channels are written once and copied into each player's view, the terrain channels
+        from get_lossless_base_map_layers
+        """
+        assert (
+            self.num_players == 2
+        ), "Functionality has to be added to support encondings for > 2 players"
+        if out is None:
+            out = np.empty(
+                (self.num_players,) + tuple(self.get_lossless_state_encoding_shape()),
+                dtype=dtype,
             )
-            state_mask_dict = {k: np.zeros(self.shape) for k in LAYERS}
-
-            # MAP LAYERS
-            if horizon - overcooked_state.timestep < 40:
-                state_mask_dict["urgency"] = np.ones(self.shape)
-
-            for loc in self.get_counter_locations():
-                state_mask_dict["counter_loc"][loc] = 1
-
-            for loc in self.get_pot_locations():
-                state_mask_dict["pot_loc"][loc] = 1
-
-            for loc in self.get_onion_dispenser_locations():
-                state_mask_dict["onion_disp_loc"][loc] = 1
+        out.fill(0)
 
-            for loc in self.get_tomato_dispenser_locations():
-                state_mask_dict["tomato_disp_loc"][loc] = 1
-
-            for loc in self.get_dish_dispenser_locations():
-                state_mask_dict["dish_disp_loc"][loc] = 1
+        # MAP LAYERS
+        view = out[0]
+        base = LOSSLESS_NUM_PLAYER_LAYERS
+        view[:, :, base : base + len(LOSSLESS_BASE_MAP_FEATURES)] = (
+            self.get_lossless_base_map_layers()
+        )
+        if horizon - overcooked_state.timestep < 40:
+            view[:, :, LOSSLESS_URGENCY_LAYER] = 1
 
-            for loc in self.get_serving_locations():
-                state_mask_dict["serve_loc"][loc] = 1
+        # OBJECT & STATE LAYERS
+        for obj in overcooked_state.all_objects_list:
+            x, y = obj.position
+            if obj.name == "soup":
+                ingredients = obj.ingredients
+                onions = ingredients.count(Recipe.ONION)
+                tomatoes = ingredients.count(Recipe.TOMATO)
+                if self.terrain_mtx[y][x] != "P":
+                    # If player soup is not in a pot, treat it like a soup that is cooked with remaining time 0
+                    view[x, y, LOSSLESS_LAYERS["onions_in_soup"]] += onions
+                    view[x, y, LOSSLESS_LAYERS["tomatoes_in_soup"]] += tomatoes
+                    view[x, y, LOSSLESS_LAYERS["soup_done"]] += 1
+                elif obj.is_idle:
+                    # onions_in_pot and tomatoes_in_pot are used when the soup is idling, and ingredients could still be added
+                    view[x, y, LOSSLESS_LAYERS["onions_in_pot"]] += onions
+                    view[x, y, LOSSLESS_LAYERS["tomatoes_in_pot"]] += tomatoes
+                else:
+                    view[x, y, LOSSLESS_LAYERS["onions_in_soup"]] += onions
+                    view[x, y, LOSSLESS_LAYERS["tomatoes_in_soup"]] += tomatoes
+                    view[
+                        x, y, LOSSLESS_LAYERS["soup_cook_time_remaining"]
+                    ] += (obj.cook_time - obj._cooking_tick)
+                    if obj.is_ready:
+                        view[x, y, LOSSLESS_LAYERS["soup_done"]] += 1
+            elif obj.name == "dish":
+                view[x, y, LOSSLESS_LAYERS["dishes"]] += 1
+            elif obj.name == "onion":
+                view[x, y, LOSSLESS_LAYERS["onions"]] += 1
+            elif obj.name == "tomato":
+                view[x, y, LOSSLESS_LAYERS["tomatoes"]] += 1
+            else:
+                raise ValueError("Unrecognized object")
+        out[1:, :, :, base:] = view[:, :, base:]
 
-            # PLAYER LAYERS
-            for i, player in enumerate(overcooked_state.players):
-                player_orientation_idx = Direction.DIRECTION_TO_INDEX[
+        # PLAYER LAYERS
+        players = overcooked_state.players
+        for primary_agent_idx in range(self.num_players):
+            other_agent_idx = 1 - primary_agent_idx
+            for i, player in enumerate(
+                [players[primary_agent_idx], players[other_agent_idx]]
+            ):
+                x, y = player.position
+                orientation_idx = Direction.DIRECTION_TO_INDEX[
                     player.orientation
                 ]
-                state_mask_dict["player_{}_loc".format(i)] = make_layer(
-                    player.position, 1
-                )
-                state_mask_dict[
-                    "player_{}_orientation_{}".format(
-                        i, player_orientation_idx
-                    )
-                ] = make_layer(player.position, 1)
-
-            # OBJECT & STATE LAYERS
-            for obj in all_objects:
-                if obj.name == "soup":
-                    # removed the next line because onion doesn't have to be in all the soups?
-                    # if Recipe.ONION in obj.ingredients:
-                    # get the ingredients into a {object: number} dictionary
-                    ingredients_dict = Counter(obj.ingredients)
-                    # assert "onion" in ingredients_dict.keys()
-                    if obj.position in self.get_pot_locations():
-                        if obj.is_idle:
-                            # onions_in_pot and tomatoes_in_pot are used when the soup is idling, and ingredients could still be added
-                            state_mask_dict["onions_in_pot"] += make_layer(
-                                obj.position, ingredients_dict["onion"]
-                            )
-                            state_mask_dict["tomatoes_in_pot"] += make_layer(
-                                obj.position, ingredients_dict["tomato"]
-                            )
-                        else:
-                            state_mask_dict["onions_in_soup"] += make_layer(
-                                obj.position, ingredients_dict["onion"]
-                            )
-                            state_mask_dict["tomatoes_in_soup"] += make_layer(
-                                obj.position, ingredients_dict["tomato"]
-                            )
-                            state_mask_dict[
-                                "soup_cook_time_remaining"
-                            ] += make_layer(
-                                obj.position, obj.cook_time - obj._cooking_tick
-                            )
-                            if obj.is_ready:
-                                state_mask_dict["soup_done"] += make_layer(
-                                    obj.position, 1
-                                )
-
-                    else:
-                        # If player soup is not in a pot, treat it like a soup that is cooked with remaining time 0
-                        state_mask_dict["onions_in_soup"] += make_layer(
-                            obj.position, ingredients_dict["onion"]
-                        )
-                        state_mask_dict["tomatoes_in_soup"] += make_layer(
-                            obj.position, ingredients_dict["tomato"]
-                        )
-                        state_mask_dict["soup_done"] += make_layer(
-                            obj.position, 1
-                        )
-
-                elif obj.name == "dish":
-                    state_mask_dict["dishes"] += make_layer(obj.position, 1)
-                elif obj.name == "onion":
-                    state_mask_dict["onions"] += make_layer(obj.position, 1)
-                elif obj.name == "tomato":
-                    state_mask_dict["tomatoes"] += make_layer(obj.position, 1)
-                else:
-                    raise ValueError("Unrecognized object")
-
-            if debug:
-                print("terrain----")
-                print(np.array(self.terrain_mtx))
-                print("-----------")
-                print(len(LAYERS))
-                print(len(state_mask_dict))
-                for k, v in state_mask_dict.items():
-                    print(k)
-                    print(np.transpose(v, (1, 0)))
-
-            # Stack of all the state masks, order decided by order of LAYERS
-            state_mask_stack = np.array(
-                [state_mask_dict[layer_id] for layer_id in LAYERS]
+                out[primary_agent_idx, x, y, i] = 1
+                out[
+                    primary_agent_idx,
+                    x,
+                    y,
+                    self.num_players + 4 * i + orientation_idx,
+                ] = 1
+        return out
+
+    def batched_lossless_state_encoding(
+        self, overcooked_states, out=None, horizon=400, dtype=int
+    ):
+        """
+        Lossless state encodings of many states, as a (num_states, num_players, width, height, 26) array written
+        into `out` if given (see lossless_state_encoding_into)
+        """
+        if out is None:
+            out = np.empty(
+                (len(overcooked_states), self.num_players)
+                + tuple(self.get_lossless_state_encoding_shape()),
+                dtype=dtype,
             )
-            state_mask_stack = np.transpose(state_mask_stack, (1, 2, 0))
-            assert state_mask_stack.shape[:2] == self.shape
-            assert state_mask_stack.shape[2] == len(LAYERS)
-            # NOTE: currently not including time left or order_list in featurization
-            return np.array(state_mask_stack).astype(int)
-
-        # NOTE: Currently not very efficient, a decent amount of computation repeated here
-        num_players = len(overcooked_state.players)
-        final_obs_for_players = tuple(
-            process_for_player(i) for i in range(num_players)
-        )
-        return final_obs_for_players
+        for i, overcooked_state in enumerate(overcooked_states):
+            self.lossless_state_encoding_into(
+                overcooked_state, out=out[i], horizon=horizon
+            )
+        return out
 
     @property
     def featurize_state_shape(self):
@@ -2623,9 +2766,6 @@ class OvercookedGridworld(object):
 
         all_features = {}
 
-        def concat_dicts(a, b):
-            return {**a, **b}
-
         def make_closest_feature(idx, player, name, locations):
             """
             Compute (x, y) deltas to closest feature of type `name`, and save it in the features dict
@@ -2748,6 +2888,9 @@ class OvercookedGridworld(object):
         OBJ_TO_IDX = {o_name: idx for idx, o_name in enumerate(IDX_TO_OBJ)}
 
         counter_objects = self.get_counter_objects_dict(overcooked_state)
+        empty_counter_locations = self.get_empty_counter_locations(
+            overcooked_state
+        )
         pot_states = self.get_pot_states(overcooked_state)
 
         for i, player in enumerate(overcooked_state.players):
@@ -2769,8 +2912,7 @@ class OvercookedGridworld(object):
                 ]
 
             # Closest feature for each object type
-            all_features = concat_dicts(
-                all_features,
+            all_features.update(
                 make_closest_feature(
                     i,
                     player,
@@ -2779,8 +2921,7 @@ class OvercookedGridworld(object):
                     + counter_objects["onion"],
                 ),
             )
-            all_features = concat_dicts(
-                all_features,
+            all_features.update(
                 make_closest_feature(
                     i,
                     player,
@@ -2789,8 +2930,7 @@ class OvercookedGridworld(object):
                     + counter_objects["tomato"],
                 ),
             )
-            all_features = concat_dicts(
-                all_features,
+            all_features.update(
                 make_closest_feature(
                     i,
                     player,
@@ -2799,25 +2939,22 @@ class OvercookedGridworld(object):
                     + counter_objects["dish"],
                 ),
             )
-            all_features = concat_dicts(
-                all_features,
+            all_features.update(
                 make_closest_feature(
                     i, player, "soup", counter_objects["soup"]
                 ),
             )
-            all_features = concat_dicts(
-                all_features,
+            all_features.update(
                 make_closest_feature(
                     i, player, "serving", self.get_serving_locations()
                 ),
             )
-            all_features = concat_dicts(
-                all_features,
+            all_features.update(
                 make_closest_feature(
                     i,
                     player,
                     "empty_counter",
-                    self.get_empty_counter_locations(overcooked_state),
+                    empty_counter_locations,
                 ),
             )
 
@@ -2830,7 +2967,7 @@ class OvercookedGridworld(object):
                 pot_features = make_pot_feature(
                     i, player, pot_idx, closest_pot_loc, pot_states
                 )
-                all_features = concat_dicts(all_features, pot_features)
+                all_features.update(pot_features)
 
                 if closest_pot_loc:
                     pot_locations.remove(closest_pot_loc)
@@ -2902,6 +3039,25 @@ class OvercookedGridworld(object):
 
         return ordered_features
 
+    def batched_featurize_state(
+        self, overcooked_states, mlam, num_pots=2, out=None, **kwargs
+    ):
+        """
+        featurize_state of many states, as a (num_states, num_players, num_features) array written into `out` if
+        given. The closest feature lookups of all the states share mlam's table of feature costs (see
+        MotionPlanner.get_feature_cost_table)
+        """
+        if out is None:
+            out = np.empty(
+                (len(overcooked_states), self.num_players)
+                + self.get_featurize_state_shape(num_pots)
+            )
+        for i, overcooked_state in enumerate(overcooked_states):
+            out[i] = self.featurize_state(
+                overcooked_state, mlam, num_pots=num_pots, **kwargs
+            )
+        return out
+
     def get_deltas_to_closest_location(self, player, locations, mlam):
         _, closest_loc = mlam.motion_planner.min_cost_to_feature(
             player.pos_and_or, locations, with_argmin=True
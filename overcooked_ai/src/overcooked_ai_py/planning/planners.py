@@ -66,6 +66,7 @@ class MotionPlanner(object):
         self.motion_goals_for_pos = self._get_goal_dict()
 
         self.all_plans = self._populate_all_plans()
+        self._feature_cost_table = None
 
     def save_to_file(self, filename):
         with open(filename, "wb") as output:
@@ -401,27 +402,56 @@ class MotionPlanner(object):
         """
         start_pos = start_pos_and_or[0]
         assert self.mdp.get_terrain_type_at_pos(start_pos) != "X"
-        min_dist = np.Inf
+        feature_index, costs_from_start = self.get_feature_cost_table()
+        costs = costs_from_start[start_pos_and_or]
+        min_cost = np.inf
         best_feature = None
+        # the first feature of the list wins ties
         for feature_pos in feature_pos_list:
-            for feature_goal in self.motion_goals_for_pos[feature_pos]:
-                if not self.is_valid_motion_start_goal_pair(
-                    start_pos_and_or, feature_goal
-                ):
-                    continue
-                curr_dist = self.get_gridworld_distance(
-                    start_pos_and_or, feature_goal
-                )
-                if curr_dist < min_dist:
-                    best_feature = feature_pos
-                    min_dist = curr_dist
-        # +1 to account for interaction action
-        min_cost = min_dist + 1
+            curr_cost = costs[feature_index[feature_pos]]
+            if curr_cost < min_cost:
+                best_feature = feature_pos
+                min_cost = curr_cost
         if with_argmin:
             # assert best_feature is not None, "{} vs {}".format(start_pos_and_or, feature_pos_list)
             return min_cost, best_feature
         return min_cost
 
+    def get_feature_cost_table(self):
+        """
+        Pre-computes the cost of min_cost_to_feature from every valid start position and orientation to each
+        single terrain feature (including the interaction action, inf if the feature can't be reached), so
+        finding the closest of a list of features is one lookup per feature.
+
+        Returns a dict of the feature positions to their index, and a dict of the start (pos, or) to the list
+        of costs by feature index
+        """
+        # planners pickled before the table was added don't have it
+        if getattr(self, "_feature_cost_table", None) is None:
+            features = list(self.motion_goals_for_pos.keys())
+            costs_from_start = {}
+            for start in self.mdp.get_valid_player_positions_and_orientations():
+                costs = []
+                for feature_pos in features:
+                    min_dist = np.inf
+                    for feature_goal in self.motion_goals_for_pos[feature_pos]:
+                        if not self.is_valid_motion_start_goal_pair(
+                            start, feature_goal
+                        ):
+                            continue
+                        min_dist = min(
+                            min_dist,
+                            self.get_gridworld_distance(start, feature_goal),
+                        )
+                    # +1 to account for interaction action
+                    costs.append(min_dist + 1)
+                costs_from_start[start] = costs
+            self._feature_cost_table = (
+                {feature_pos: i for i, feature_pos in enumerate(features)},
+                costs_from_start,
+            )
+        return self._feature_cost_table
+
     def _get_goal_dict(self):
         """Creates a dictionary of all possible goal states for all possible
         terrain features that the agent might want to interact with."""
@@ -0,0 +1,98 @@
+# replay.py: converts user logs to a compact binary replay file, so the log lines are only parsed once
+
+import os  # for writing the replay files
+import pickle  # for the binary replay format
+import array  # for the columnar record tables
+import smm.smm  # for converting logged states to the belief state data structure
+import env.server.log_writer  # for reading the log records across rotated segments and log formats
+
+LOG_PATH = env.server.log_writer.LOG_PATH  # path of user data logs
+REPLAY_EXTENSION = ".replay"  # extension of the replay files, written next to the logs
+REPLAY_VERSION = 2  # bump when the replay format or the state conversion changes, so old replays are rebuilt
+
+# record kinds
+STATE = 0  # a game state tick, the payload is the state converted for the SMMs
+EVENT = 1  # any other log line (in-situ questions, stage changes, etc.), the payload is the raw log dictionary
+
+# gets the path of a user's replay file
+def get_replay_path(user:str, log_path:str=LOG_PATH)->str:
+    return os.path.join(log_path, user + REPLAY_EXTENSION)
+
+# gets the fingerprint of a user's log segments, used to detect a stale replay
+def get_source_fingerprint(user:str, log_path:str=LOG_PATH)->tuple:
+    return env.server.log_writer.get_log_fingerprint(user, log_path)
+
+# converts a user's log file to a replay file, returns the replay
+#   the replay is columnar: one kind and layout index per record, with the layout names stored once
+def convert_log(user:str, log_path:str=LOG_PATH)->dict:
+    replay_path = get_replay_path(user, log_path)
+    fingerprint = get_source_fingerprint(user, log_path)
+
+    layouts = []  # layout names, indexed by the layout column
+    layout_ids = {}  # layout name to index in layouts
+    kinds = array.array("B")  # record kind of each line
+    record_layouts = array.array("H")  # layout index of each line, 0 (the None layout) for non-state lines
+    payloads = []  # structured state or raw event of each line
+    layouts.append(None)
+    layout_ids[None] = 0
+
+    for log_dict in env.server.log_writer.iter_log_records(user, log_path):
+        if "state" in log_dict:
+            layout = log_dict.get("layout", None)
+            if layout not in layout_ids:
+                layout_ids[layout] = len(layouts)
+                layouts.append(layout)
+            kinds.append(STATE)
+            record_layouts.append(layout_ids[layout])
+            payloads.append(smm.smm.convert_log_to_state(log_dict))
+        else:
+            kinds.append(EVENT)
+            record_layouts.append(0)
+            payloads.append(log_dict)
+
+    replay = {
+        "version": REPLAY_VERSION,
+        "source": fingerprint,
+        "layouts": layouts,
+        "kinds": kinds,
+        "record_layouts": record_layouts,
+        "payloads": payloads,
+    }
+
+    # write to a temporary file first so concurrent readers never see a partial replay
+    temp_path = replay_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(replay, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, replay_path)
+    return replay
+
+# loads a user's replay, converting the log if the replay is missing or out of date
+def load_replay(user:str, log_path:str=LOG_PATH)->dict:
+    replay_path = get_replay_path(user, log_path)
+    if os.path.exists(replay_path):
+        try:
+            with open(replay_path, "rb") as f:
+                replay = pickle.load(f)
+            if replay["version"] == REPLAY_VERSION and replay["source"] == get_source_fingerprint(user, log_path):
+                return replay
+        except (pickle.UnpicklingError, EOFError, KeyError):
+            pass  # corrupt or incompatible replay, rebuild it
+    return convert_log(user, log_path)
+
+# iterates over a user's log as (kind, layout, payload) records, in the order they were logged
+#   kind: STATE or EVENT
+#   layout: the layout name of a STATE record, None for EVENT records
+#   payload: the SMM-structured state of a STATE record, or the raw log dictionary of an EVENT record
+def iter_log(user:str, log_path:str=LOG_PATH):
+    replay = load_replay(user, log_path)
+    layouts = replay["layouts"]
+    for kind, layout_id, payload in zip(replay["kinds"], replay["record_layouts"], replay["payloads"]):
+        yield kind, layouts[layout_id], payload
+
+if __name__ == "__main__":
+    # converts every user log to a replay: python replay.py [user ...]
+    import sys
+    users = sys.argv[1:] if len(sys.argv) > 1 else env.server.log_writer.get_log_users(LOG_PATH)
+    for user in users:
+        replay = convert_log(user)
+        print("Converted", user, "(" + str(len(replay["payloads"])) + " records)")
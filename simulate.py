@@ -0,0 +1,237 @@
+# simulate.py: plays synthetic study sessions headlessly, as fast as possible, and writes their logs in the server's format
+#   each session plays the study stages like a participant: an OvercookedGame per stage with the FSMAI teammate, and a
+#   simulated participant in the human slot. The game timer runs on a simulated clock that advances 1/fps per tick, so
+#   a 93 second round takes as long as its ticks take to compute. The participant answers the in-situ questions every
+#   30 simulated seconds with random responses, so the logs can be graded by grader.py and replayed by the SMMs
+
+import os  # for the layout folder
+import sys  # for args
+import time  # for the session start times and timing the sessions
+import json  # for the server config
+import random  # for the simulated participants and their responses
+import multiprocessing  # for simulating sessions in parallel
+import numpy as np  # for seeding
+import env.server.game  # for configuring the games like the server
+from env.server.game import OvercookedGame, FSMAI, Game  # the game and its FSM teammate
+from env.server.session import STAGES  # layout and game time of each study stage
+from env.server.log_writer import LogWriter, LOG_PATH  # for writing the session logs like the server
+from env.server.npc_executor import InlineNPCExecutor  # for running the FSMAI teammate deterministically on the tick thread
+
+CONFIG_PATH = "env/server/config.json"  # server config, for the frame rate and log writer parameters
+LAYOUT_PATH = os.path.join(os.getcwd(), "env/server/layouts")  # path of the layouts
+SYNTHETIC_LOG_PATH = os.path.join(LOG_PATH, "synthetic/")  # path of the synthetic session logs, apart from the participants' logs
+STAGE_ORDER = ["intro", "practice", "round1", "round2", "round3", "round4"]  # study stages, in the order they are played
+GRADED_STAGES = ["round1", "round2", "round3", "round4"]  # stages the grader scores, simulated by default
+PARTNERS = ["FSMAI", "random", "stay"]  # policies of the simulated participant
+KEYS = ["UP", "DOWN", "LEFT", "RIGHT", "SPACE"]  # keys the random participant presses
+KEYS_PER_SECOND = 4  # mean key presses per second of the random participant, presses are a poisson process
+QUESTION_INTERVAL = 30  # simulated seconds between in-situ question interrupts, as in the study client
+QUESTIONS_PER_INTERRUPT = 2  # questions asked at each interrupt, numSituationAwarenessQuestionsPerInterrupt in the study client
+
+# in-situ questions of the study client by category, as (question, responses), see insitu-questions.js
+#   grid questions are answered with a quadrant, "center", or "no idea"
+GRID_RESPONSES = ["Top Left", "Top Right", "Bottom Left", "Bottom Right", "center", "no idea"]
+INGREDIENTS = ["<b style='color:goldenrod'>Onion</b>", "<b style='color:red'>Tomato</b>"]
+ACTIVITY_RESPONSES = ["Getting ingredient for pot", "Getting dish for soup", "Bringing soup to station", "Idling, all soups complete"]
+QUESTION_CATEGORIES = {
+    "SA1 ingredientloc": [("Where is the nearest available " + ingredient + "? Make your best guess.", ["Left half", "Right half", "Center-ish", "None available", "No idea"]) for ingredient in INGREDIENTS]
+        + [("Is there at least one available " + ingredient + "? Make your best guess.", ["Definite YES", "Likely YES", "No idea", "Likely NO", "Definite NO"]) for ingredient in INGREDIENTS],
+    "SA1 playerloc": [
+        ("Where is your <b style='color:blue'>TEAMMATE</b>? Make your best guess.", GRID_RESPONSES),
+        ("Where are <b style='color:#009966'>YOU</b>?", GRID_RESPONSES),
+    ],
+    "SA1 potstate": [("How full is the " + pot + " pot? Make your best guess.", ["Empty", "1-2 ingredients", "3 ingredients (full/cooking)", "No idea"]) for pot in ["leftmost", "rightmost"]]
+        + [("What is the " + pot + " pot's status? Make your best guess.", ["Finished cooking", "Cooking", "1-2 ingredients", "Empty", "No idea"]) for pot in ["leftmost", "rightmost"]],
+    "SA2 playerstate": [
+        ("What are <b style='color:#009966'>YOU</b> doing now?", ACTIVITY_RESPONSES),
+        ("What is your <b style='color:blue'>TEAMMATE</b> doing now? Make your best guess.", ACTIVITY_RESPONSES + ["No idea"]),
+    ],
+    "SA2 numremaining": [
+        ("How many more soups can be made/delivered, including soups in-progress? Make your best guess.", ["No soups", "1-2 soups", "3-4 soups", "5+ soups", "No idea"]),
+    ],
+}
+
+# a clock that only moves when advanced, the game timers of a simulated session run on it
+class SimulatedClock():
+    def __init__(self, start:float=0):
+        self.now = start
+
+    def __call__(self)->float:
+        return self.now
+
+    def advance(self, seconds:float):
+        self.now += seconds
+
+# a simulated participant that plays like the FSMAI teammate
+class FSMPartner():
+    def __init__(self, game:OvercookedGame, agent_id:int):
+        self.policy = FSMAI(game)
+        self.policy.agent_id = agent_id
+
+    def action(self, state):
+        return self.policy.action(state)
+
+    def reset(self):
+        self.policy.reset()
+
+# a simulated participant that presses random keys at human-like rates, or stays still
+class ScriptedPartner():
+    def __init__(self, game:OvercookedGame, agent_id:int, keys_per_second:float=KEYS_PER_SECOND):
+        self.game = game
+        self.keys_per_second = keys_per_second
+
+    def action(self, state):
+        return self.game.action_to_overcooked_action[random.choice(KEYS)], None
+
+    def reset(self):
+        pass
+
+# makes the simulated participant of a game
+def make_partner(partner:str, game:OvercookedGame, agent_id:int):
+    if partner == "FSMAI":
+        return FSMPartner(game, agent_id)
+    if partner == "random":
+        return ScriptedPartner(game, agent_id)
+    if partner == "stay":
+        return ScriptedPartner(game, agent_id, keys_per_second=0)
+    raise ValueError("Unknown partner " + partner + ", partners are: " + ", ".join(PARTNERS))
+
+# picks the questions of an interrupt like the study client, each category is asked once before any is repeated
+#   asked: the categories asked so far in the session, updated in place
+def generate_questions(asked:list, num_questions:int=QUESTIONS_PER_INTERRUPT)->list:
+    questions = []
+    for _ in range(num_questions):
+        categories = [x for x in QUESTION_CATEGORIES if x not in asked]
+        if len(categories) == 0:
+            categories = list(QUESTION_CATEGORIES)
+            asked.clear()
+        category = random.choice(categories)
+        asked.append(category)
+        questions.append(random.choice(QUESTION_CATEGORIES[category]))
+    return questions
+
+# writes the log records of the participant answering the questions of an interrupt, like log.js
+def answer_questions(writer:LogWriter, user:str, stage:str, clock:SimulatedClock, asked:list):
+    for question, responses in generate_questions(asked):
+        response = random.choice(responses)
+        for kind in ["in situ selection", "in situ submission"]:
+            writer.write({"type": kind, "question": question, "response": response, "timestamp": int(clock() * 1000), "stage": stage, "user": user})
+
+# plays a study stage's game to the end, logging every tick like the server's play_game
+#   returns the stage's number of ticks and score
+def simulate_stage(user:str, stage:str, partner:str, writer:LogWriter, clock:SimulatedClock, fps:int, asked:list)->dict:
+    layout, game_time = STAGES[stage]
+    params = {"playerZero": "FSMAI", "playerOne": "human", "num_players": 2, "mdp_params": {"old_dynamics": True}, "layout": layout + ".layout", "layouts": [layout], "gameTime": str(game_time)}
+    game = OvercookedGame(clock=clock, npc_executor=InlineNPCExecutor(), **params)
+    game.add_player(user)
+    agent_id = game.players.index(user)
+    game.activate(curr_layout=game.layouts.pop(), folder=LAYOUT_PATH)
+    participant = make_partner(partner, game, agent_id)
+    participant.reset()
+    keys = {value: key for key, value in game.action_to_overcooked_action.items()}  # overcooked action to client key
+
+    status = Game.Status.ACTIVE
+    next_questions = clock() + QUESTION_INTERVAL
+    while status != Game.Status.DONE and status != Game.Status.INACTIVE:
+        # the participant acts at the teammate's rate, or presses keys at its own rate
+        if isinstance(participant, ScriptedPartner):
+            if random.random() < participant.keys_per_second / fps:
+                game.enqueue_action(user, keys[participant.action(game.state)[0]])
+        elif game.curr_tick % game.ticks_per_ai_action == 0:
+            game.enqueue_action(user, keys[participant.action(game.state)[0]])
+        status = game.tick()
+        if status != Game.Status.RESET:
+            writer.write(game.get_state())
+        clock.advance(1 / fps)
+        # the study pauses the game while the questions are answered, so they do not use up the game time
+        if stage != "intro" and clock() >= next_questions and status == Game.Status.ACTIVE:
+            answer_questions(writer, user, stage, clock, asked)
+            next_questions += QUESTION_INTERVAL
+
+    result = {"ticks": game.curr_tick, "score": game.score}
+    game.deactivate()
+    return result
+
+# plays a whole session, runs in a worker process
+#   job: (user, stages, partner, fps, seed, log_path, server config)
+#   returns the user and the ticks and score of each stage
+def simulate_session(job:tuple)->tuple:
+    user, stages, partner, fps, seed, log_path, config = job
+    env.server.game._configure(config["MAX_GAME_LENGTH"], config["AGENT_DIR"], config["visibility"], config["visibility_range"])
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    writer = LogWriter(user, log_path=log_path, **config.get("log_writer", {}))
+    clock = SimulatedClock(time.time())
+    asked = []  # question categories asked so far in the session
+    results = {}
+    try:
+        for stage in stages:
+            results[stage] = simulate_stage(user, stage, partner, writer, clock, fps, asked)
+    finally:
+        writer.close()
+    return user, results
+
+# simulates sessions across a pool of worker processes, yielding (user, results) as the sessions complete
+def simulate_sessions(jobs:list, workers:int=None):
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield simulate_session(job)
+        return
+    with multiprocessing.Pool(processes=min(workers, len(jobs))) as pool:
+        for result in pool.imap_unordered(simulate_session, jobs):
+            yield result
+
+def main(num_sessions:int, stages:list=GRADED_STAGES, partner:str="FSMAI", workers:int=None, log_path:str=SYNTHETIC_LOG_PATH, prefix:str="sim", seed:int=0, fps:int=None):
+    with open(CONFIG_PATH, "r") as f:
+        config = json.load(f)
+    fps = config["MAX_FPS"] if fps is None else fps
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError("Unknown stage " + stage + ", stages are: " + ", ".join(STAGE_ORDER))
+    if partner not in PARTNERS:
+        raise ValueError("Unknown partner " + partner + ", partners are: " + ", ".join(PARTNERS))
+
+    jobs = [(prefix + str(seed) + "_" + str(i), stages, partner, fps, seed * 1000003 + i, log_path, config) for i in range(num_sessions)]
+    print("Simulating", num_sessions, "sessions of", ",".join(stages), "with a", partner, "participant at", fps, "fps, logs in", log_path)
+    start = time.perf_counter()
+    ticks = 0
+    scores = []
+    for count, (user, results) in enumerate(simulate_sessions(jobs, workers)):
+        ticks += sum([x["ticks"] for x in results.values()])
+        scores.append(sum([x["score"] for x in results.values()]))
+        if (count + 1) % 10 == 0 or count + 1 == num_sessions:
+            print("    ", count + 1, "/", num_sessions, "sessions")
+    elapsed = time.perf_counter() - start
+    print("Simulated", num_sessions, "sessions (" + str(ticks) + " ticks) in", "%.1f" % elapsed, "s:", "%.1f" % (60 * num_sessions / elapsed), "sessions per minute,", "%.0f" % (ticks / elapsed), "ticks per second, mean score", "%.1f" % (np.mean(scores) if len(scores) > 0 else 0))
+
+if __name__ == "__main__":
+    # usage: python simulate.py [--sessions=N] [--stages=round1,round2] [--partner=FSMAI|random|stay] [--workers=N] [--log-path=path] [--prefix=sim] [--seed=N] [--fps=N]
+    num_sessions = 10
+    stages = GRADED_STAGES
+    partner = "FSMAI"
+    workers = None
+    log_path = SYNTHETIC_LOG_PATH
+    prefix = "sim"
+    seed = 0
+    fps = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--sessions="):
+            num_sessions = int(arg.split("=")[1])
+        elif arg.startswith("--stages="):
+            stages = arg.split("=")[1].split(",")
+        elif arg.startswith("--partner="):
+            partner = arg.split("=")[1]
+        elif arg.startswith("--workers="):
+            workers = int(arg.split("=")[1])
+        elif arg.startswith("--log-path="):
+            log_path = arg.split("=")[1]
+        elif arg.startswith("--prefix="):
+            prefix = arg.split("=")[1]
+        elif arg.startswith("--seed="):
+            seed = int(arg.split("=")[1])
+        elif arg.startswith("--fps="):
+            fps = int(arg.split("=")[1])
+        else:
+            raise ValueError("Unknown argument " + arg)
+    main(num_sessions, stages=stages, partner=partner, workers=workers, log_path=log_path, prefix=prefix, seed=seed, fps=fps)
@@ -15,9 +15,12 @@ class SMMPredicates:
         self.functional_role_of_agents_in_teams = {}
         self.agent_name = "A0"
         self.can_see = can_see
+        self.object_positions = None  # name to positions of the pots and soups, only indexed while the known objects are not moving
         return
     
+    # updates the domain knowledge, counting the updates so cached facts derived from it can tell it changed
     def update(self, state:dict, debug=False):
+        self.domain_knowledge["updates"] = self.domain_knowledge.get("updates", 0) + 1
         self.update_domain_knowledge(state=state, debug=debug)
         return self.domain_knowledge
     
@@ -42,12 +45,32 @@ class SMMPredicates:
             return []
         return [x["propertyOf"]["name"] for x in obj["propertyOf"]["ingredients"]]
     
+    # indexes the positions of the pots and soups, so on_pot and on_soup are set lookups until the index is cleared
+    def index_object_positions(self):
+        self.object_positions = {"pot": set(), "soup": set()}
+        for obj in self.domain_knowledge["objects"].values():
+            if obj["propertyOf"]["name"] in self.object_positions:
+                self.object_positions[obj["propertyOf"]["name"]].add(obj["position"])
+
+    # groups object IDs by their object's name, keeping the order of the IDs in each group
+    def group_by_name(self, object_ids, objects):
+        groups = {}
+        for k in object_ids:
+            if objects[k]["propertyOf"]["name"] not in groups:
+                groups[objects[k]["propertyOf"]["name"]] = []
+            groups[objects[k]["propertyOf"]["name"]].append(k)
+        return groups
+
     # determines whether an object is on a pot spot
     def on_pot(self, object_id):
+        if self.object_positions is not None:
+            return self.domain_knowledge["objects"][object_id]["position"] in self.object_positions["pot"]
         return len([x for x in self.domain_knowledge["objects"] if self.domain_knowledge["objects"][x]["propertyOf"]["name"] == "pot" and self.domain_knowledge["objects"][x]["position"] == self.domain_knowledge["objects"][object_id]["position"]]) > 0
 
     # determines whether an object is on a soup spot
     def on_soup(self, object_id):
+        if self.object_positions is not None:
+            return self.domain_knowledge["objects"][object_id]["position"] in self.object_positions["soup"]
         return len([x for x in self.domain_knowledge["objects"] if self.domain_knowledge["objects"][x]["propertyOf"]["name"] == "soup" and self.domain_knowledge["objects"][x]["position"] == self.domain_knowledge["objects"][object_id]["position"]]) > 0
 
     # determines the agent's goal from the state
@@ -204,39 +227,8 @@ class SMMPredicates:
             if matched_ids[object_id] is not None and self.domain_knowledge["objects"][matched_ids[object_id]]["visible"] and str(state["objects"][object_id]["position"]) in agent_locations:
                 self.updatePredicate("holding", agent_locations[str(state["objects"][object_id]["position"])], matched_ids[object_id])
 
-        # update usability between objects, inefficient n^2 algorithm but our environment size is pretty small
-        for i, object_from in enumerate(self.domain_knowledge["objects"]):
-            for j, object_to in enumerate(self.domain_knowledge["objects"]):
-                # can never use an object with itself
-                if i == j:
-                    self.updatePredicate("canUseWith", object_from, [object_to, 0])
-                # ingredients can be used on unfilled pots
-                elif self.domain_knowledge["objects"][object_from]["propertyOf"]["name"] in ["onion", "tomato"] and \
-                     self.domain_knowledge["objects"][object_to]["propertyOf"]["name"] == "soup" and \
-                     len(self.get_ingredient_list(object_to)) < 3:
-                        self.updatePredicate("canUseWith", object_from, [object_to, 1])
-                # soups can be used on stations
-                elif self.domain_knowledge["objects"][object_from]["propertyOf"]["name"] == "soup" and \
-                     len(self.get_ingredient_list(object_from)) == 3 and \
-                     self.domain_knowledge["objects"][object_from]["propertyOf"]["isReady"] and \
-                     self.domain_knowledge["objects"][object_to]["propertyOf"]["name"] == "station":
-                    self.updatePredicate("canUseWith", object_from, [object_to, 1])
-                # ingredients can be used on empty pots
-                elif self.domain_knowledge["objects"][object_from]["propertyOf"]["name"] in ["onion", "tomato"] and \
-                     self.domain_knowledge["objects"][object_to]["propertyOf"]["name"] == "pot" and \
-                     not self.on_soup(object_to):
-                        self.updatePredicate("canUseWith", object_from, [object_to, 1])
-                # dishes can be used on filled pots
-                elif self.domain_knowledge["objects"][object_from]["propertyOf"]["name"] == "dish" and \
-                     len(self.get_ingredient_list(object_from)) == 0 and \
-                     self.domain_knowledge["objects"][object_to]["propertyOf"]["name"] == "soup" and \
-                     self.domain_knowledge["objects"][object_to]["propertyOf"]["isReady"] and \
-                     self.on_pot(object_to):
-                    self.updatePredicate("canUseWith", object_from, [object_to, 1])
-                
-                # by default, cannot use
-                else:
-                    self.updatePredicate("canUseWith", object_from, [object_to, 0])
+        # update usability between objects, only the objects whose usability changed since the last update are recomputed
+        self.update_affordances()
 
         # update location: this is the nav mesh of each agent, irrelevant for us at this point
         # update perceivable: all agents can perceive all objects in all conditions, should double for loop to add these
@@ -250,6 +242,86 @@ class SMMPredicates:
         return self.domain_knowledge
     
 
+    # gets the properties of an object that decide what it can be used with
+    #   returns the name, number of ingredients, whether a soup is ready, whether a pot has a soup on it, and whether a soup is on a pot
+    #   the pot and soup positions should be indexed first
+    def get_affordance_signature(self, object_id):
+        obj = self.domain_knowledge["objects"][object_id]
+        name = obj["propertyOf"]["name"]
+        return (
+            name,
+            len(self.get_ingredient_list(object_id)),
+            bool(obj["propertyOf"]["isReady"]) if name == "soup" else None,
+            self.on_soup(object_id) if name == "pot" else None,
+            self.on_pot(object_id) if name == "soup" else None,
+        )
+
+    # determines whether an object can be used with another object from their signatures, 1 if it can and 0 if not
+    def can_use_with(self, from_signature, to_signature):
+        from_name, from_num_ingredients, from_is_ready, _, _ = from_signature
+        to_name, to_num_ingredients, to_is_ready, to_on_soup, to_on_pot = to_signature
+        # ingredients can be used on unfilled pots
+        if from_name in ["onion", "tomato"] and to_name == "soup" and to_num_ingredients < 3:
+            return 1
+        # soups can be used on stations
+        if from_name == "soup" and from_num_ingredients == 3 and from_is_ready and to_name == "station":
+            return 1
+        # ingredients can be used on empty pots
+        if from_name in ["onion", "tomato"] and to_name == "pot" and not to_on_soup:
+            return 1
+        # dishes can be used on filled pots
+        if from_name == "dish" and from_num_ingredients == 0 and to_name == "soup" and to_is_ready and to_on_pot:
+            return 1
+        # by default, cannot use
+        return 0
+
+    # updates the canUseWith predicates between objects, recomputing the rows and columns of objects whose signature changed
+    #   the first update of a domain knowledge computes every pair
+    #   the signatures and the sparse usability graph are kept in domain_knowledge["affordances"], because SMMs can share a live domain knowledge
+    #     signatures: object ID to the signature its canUseWith predicates were computed with
+    #     edges: object ID to the set of object IDs it can be used with
+    def update_affordances(self):
+        objects = self.domain_knowledge["objects"]
+        if "affordances" not in self.domain_knowledge:
+            self.domain_knowledge["affordances"] = {"signatures": {}, "edges": {}}
+        signatures = self.domain_knowledge["affordances"]["signatures"]
+
+        # the known objects do not move while checking, so the pot and soup positions are indexed once
+        self.index_object_positions()
+        try:
+            current_signatures = {k : self.get_affordance_signature(k) for k in objects}
+        finally:
+            self.object_positions = None
+        changed = [k for k in objects if k not in signatures or signatures[k] != current_signatures[k]]
+        if len(changed) == 0:
+            return
+
+        # recompute what the changed objects can be used with
+        for object_from in changed:
+            for object_to in objects:
+                self.set_affordance(object_from, object_to, 0 if object_from == object_to else self.can_use_with(current_signatures[object_from], current_signatures[object_to]))
+        # recompute whether the other objects can be used with the changed objects
+        changed_ids = set(changed)
+        for object_from in objects:
+            if object_from in changed_ids:
+                continue
+            for object_to in changed:
+                self.set_affordance(object_from, object_to, self.can_use_with(current_signatures[object_from], current_signatures[object_to]))
+
+        for k in changed:
+            signatures[k] = current_signatures[k]
+
+    # sets whether an object can be used with another, in both the canUseWith predicate and the sparse usability graph
+    def set_affordance(self, object_from, object_to, usable):
+        self.updatePredicate("canUseWith", object_from, [object_to, usable])
+        edges = self.domain_knowledge["affordances"]["edges"]
+        if object_from not in edges:
+            edges[object_from] = set()
+        if usable:
+            edges[object_from].add(object_to)
+        else:
+            edges[object_from].discard(object_to)
+
     # match objects of a class to their known
     # inputs:
     #   known_objects: list of known objects from the last time step
@@ -276,6 +348,14 @@ class SMMPredicates:
 
         soups_delta_ingredients = {}  # soups that have stayed in the same location but now have ingredients to be assigned
 
+        # index the known objects by name and position, each bucket keeps the order of the known objects
+        known_index = {}
+        for k in known_objects:
+            key = (known_objects[k]["propertyOf"]["name"], known_objects[k]["position"])
+            if key not in known_index:
+                known_index[key] = []
+            known_index[key].append(k)
+
         # the naive case: objects have exact name/location matches, does not work for moved or transformed objects
         for o in objects:
             # ignore matched objects
@@ -283,51 +363,46 @@ class SMMPredicates:
                 continue
 
             # check if the object matches a known object's name and position
-            for k in known_objects:
-                # ignore objects of the wrong name
-                if known_objects[k]["propertyOf"]["name"] != objects[o]["propertyOf"]["name"]:
-                    continue
-                # save if this known object has the same position
-                if known_objects[k]["position"] == objects[o]["position"]:
-                    # if a soup, check if ingredients match
-                    if known_objects[k]["propertyOf"]["name"] == "soup":
-                        # if matching a seen object soup and we already have it in the soup ingredients delta record, ignore because we have already matched it
-                        if objects[o]["propertyOf"]["name"] == "soup" and k in soups_delta_ingredients:
-                            continue
-                        known_soup_ingredients = self.get_ingredient_list(obj=known_objects[k])
-                        object_soup_ingredients = self.get_ingredient_list(obj=objects[o])
-                        # ignore if known object has ingredients and this one does not
-                        if known_soup_ingredients == []:
-                            if debug:
-                                print("    Skipping soup", k, "because it has no ingredients:", known_objects[k])
-                            continue
+            for k in known_index.get((objects[o]["propertyOf"]["name"], objects[o]["position"]), []):
+                # if a soup, check if ingredients match
+                if known_objects[k]["propertyOf"]["name"] == "soup":
+                    # if matching a seen object soup and we already have it in the soup ingredients delta record, ignore because we have already matched it
+                    if objects[o]["propertyOf"]["name"] == "soup" and k in soups_delta_ingredients:
+                        continue
+                    known_soup_ingredients = self.get_ingredient_list(obj=known_objects[k])
+                    object_soup_ingredients = self.get_ingredient_list(obj=objects[o])
+                    # ignore if known object has ingredients and this one does not
+                    if known_soup_ingredients == []:
                         if debug:
-                            print("    Looking at soup with ingredients", known_soup_ingredients)
-                        if object_soup_ingredients != known_soup_ingredients:
-                            # if the known soup has ingredients that are not in the object soup, they must be different
-                            incompatible_soups = False
-                            delta_ingredients = [x for x in object_soup_ingredients]
-                            for ing in known_soup_ingredients:
-                                if ing not in delta_ingredients:
-                                    incompatible_soups = True
-                                    if debug:
-                                        print("    Soups are incompatible, known soup ingredients:", known_soup_ingredients, "; object soup ingredients:", object_soup_ingredients)
-                                    break
-                                else:
-                                    delta_ingredients.remove(ing)  # remove the ingredient from the object soup ingredients so we are left with a delta ingredients (object soup - known soup)
-                            if incompatible_soups:
-                                continue
-                            
-                            # add the delta ingredients to the soups that added ingredients
-                            soups_delta_ingredients[k] = delta_ingredients
-                        elif "ingredients" in objects[o]["propertyOf"] and debug:
-                            print("    Naive case: soups match, known", known_objects[k], "and seen object", o)
-                    ids[o] = k
-                    completed_matches[k] = o
+                            print("    Skipping soup", k, "because it has no ingredients:", known_objects[k])
+                        continue
                     if debug:
-                        # print("   matched known object", known_objects[k]["propertyOf"]["name"], "position", known_objects[k]["position"], "with seen object", objects[o]["propertyOf"]["name"], "position", objects[o]["position"])
-                        pass
-                    break
+                        print("    Looking at soup with ingredients", known_soup_ingredients)
+                    if object_soup_ingredients != known_soup_ingredients:
+                        # if the known soup has ingredients that are not in the object soup, they must be different
+                        incompatible_soups = False
+                        delta_ingredients = [x for x in object_soup_ingredients]
+                        for ing in known_soup_ingredients:
+                            if ing not in delta_ingredients:
+                                incompatible_soups = True
+                                if debug:
+                                    print("    Soups are incompatible, known soup ingredients:", known_soup_ingredients, "; object soup ingredients:", object_soup_ingredients)
+                                break
+                            else:
+                                delta_ingredients.remove(ing)  # remove the ingredient from the object soup ingredients so we are left with a delta ingredients (object soup - known soup)
+                        if incompatible_soups:
+                            continue
+                        
+                        # add the delta ingredients to the soups that added ingredients
+                        soups_delta_ingredients[k] = delta_ingredients
+                    elif "ingredients" in objects[o]["propertyOf"] and debug:
+                        print("    Naive case: soups match, known", known_objects[k], "and seen object", o)
+                ids[o] = k
+                completed_matches[k] = o
+                if debug:
+                    # print("   matched known object", known_objects[k]["propertyOf"]["name"], "position", known_objects[k]["position"], "with seen object", objects[o]["propertyOf"]["name"], "position", objects[o]["position"])
+                    pass
+                break
 
         unmatched_seen_objects = [seen_obj_id for seen_obj_id in ids if ids[seen_obj_id] is None]  # seen objects that have not been matched
         unmatched_known_objects = [known_obj_id for known_obj_id in known_objects if completed_matches[known_obj_id] is None and known_objects[known_obj_id]["propertyOf"]["name"] not in ["pot", "station"]]  # known objects that have not been matched
@@ -407,6 +482,7 @@ class SMMPredicates:
             print("[After held+moved items] Unmatched Seen Objects:", [objects[o]["propertyOf"]["name"] + (":" + "+".join([x["propertyOf"]["name"] for x in objects[o]["propertyOf"]["ingredients"]]) if "ingredients" in objects[o]["propertyOf"] else "") for o in unmatched_seen_objects])
 
         # the next cases will repeat until all moved objects have a match
+        unmatched_known_by_name = self.group_by_name(unmatched_known_objects, known_objects)  # only known objects of the same class can match
         while len([x for x in ids if ids[x] is None]) > 0:
             hadChange = False  # indicates that this loop did not converge yet
             matches = {}  # map from known object ID to list of candidate objects and their distances, used as an intermediary to the completed_matches
@@ -422,17 +498,12 @@ class SMMPredicates:
                 # find the closest unmatched known object
                 closest_k = None
                 closest_k_dist = float("infinity")
-                for k in unmatched_known_objects:
+                for k in unmatched_known_by_name.get(objects[o]["propertyOf"]["name"], []):
                     # ignore known objects that have already been matched to
                     if known_objects[k]["propertyOf"]["id"] in completed_matches and completed_matches[known_objects[k]["propertyOf"]["id"]] is not None:
                         if debug:
                             print("   Known object", k, "is actually already matched to", completed_matches[known_objects[k]["propertyOf"]["id"]])
                         continue
-                    # ignore objects of the wrong class
-                    if known_objects[k]["propertyOf"]["name"] != objects[o]["propertyOf"]["name"]:
-                        if debug:
-                            print("    Wrong name, known is", known_objects[k]["propertyOf"]["name"], "while this is", objects[o]["propertyOf"]["name"])
-                        continue
                     # if soup, ignore if ingredients are different
                     if known_objects[k]["propertyOf"]["name"] == "soup":
                         # ignore if known object has ingredients and this one does not
@@ -494,21 +565,21 @@ class SMMPredicates:
         # check for ingredients that have become soups
 
         # resolve ingredients to the soups that were in the delta
+        unmatched_known_by_name = self.group_by_name(unmatched_known_objects, known_objects)
         for soup in soups_delta_ingredients:  # soup is the known object ID of the soup that has not moved and has changed ingredients
             for ingredient in soups_delta_ingredients[soup]:  # for each added ingredient
                 # find the closest known ingredient from the unmatched knowns
                 closest_ks = None
                 closest_k = None  # will filter the closest ks (list) to choose the best k
                 closest_k_dist = float("infinity")
-                for k in unmatched_known_objects:
-                    if known_objects[k]["propertyOf"]["name"] == ingredient:
-                        dist = self.distance(known_objects[k], known_objects[soup])
-                        if dist < closest_k_dist:  # reset the set of closest k objects if the distance decreases
-                            closest_ks = [k]
-                            closest_k_dist = dist
-                        elif dist == closest_k_dist:  # add to the set of closest k objects if the distance matches
-                            closest_ks.append(k)
-                            closest_k_dist = dist
+                for k in unmatched_known_by_name.get(ingredient, []):
+                    dist = self.distance(known_objects[k], known_objects[soup])
+                    if dist < closest_k_dist:  # reset the set of closest k objects if the distance decreases
+                        closest_ks = [k]
+                        closest_k_dist = dist
+                    elif dist == closest_k_dist:  # add to the set of closest k objects if the distance matches
+                        closest_ks.append(k)
+                        closest_k_dist = dist
                 if closest_ks is None:  # sanity check
                     break
                     # raise ValueError("Could not figure out an unmatched known ingredient to add to this soup! Debug this!")
@@ -534,6 +605,7 @@ class SMMPredicates:
             print("[After resolving ingredient deltas] Unmatched Seen", unmatched_seen_objects)
 
         used_known_objects = []  # keep track of which known objects we use so we don't double use ingredients        
+        unmatched_known_by_name = self.group_by_name(unmatched_known_objects, known_objects)
         for o in unmatched_seen_objects:  # check for a soup in the seen objects
             if objects[o]["propertyOf"]["name"] != "soup":  # ignore objects that are not soups
                 continue
@@ -544,10 +616,8 @@ class SMMPredicates:
                 # find the closest ingredient that fits
                 closest_k = None
                 closest_k_dist = float("infinity")
-                for k in unmatched_known_objects:  # for each unmatched known object
+                for k in unmatched_known_by_name.get(ingredient, []):  # for each unmatched known object that is this ingredient of the soup
                     # NOTE: we can likely improve this by keeping track of the ingredients in soups, and the soups that have been served, so the system maintains a net zero
-                    if known_objects[k]["propertyOf"]["name"] != ingredient:  # ignore objects that are not ingredients to this soup
-                        continue
                     if k not in used_known_objects:  # if the object name is not already acounted for with this soup
                         dist = self.distance(known_objects[k], objects[o])
                         if dist < closest_k_dist:  # pick the closest ingredient to the soup
@@ -567,8 +637,8 @@ class SMMPredicates:
                     used_known_objects.append(closest_k)
                     # if there is not a soup there already, make the object there over the known ingredient
                     no_soup = True
-                    for _k in unmatched_known_objects:
-                        if known_objects[_k]["propertyOf"]["name"] == "soup" and known_objects[_k]["position"] == objects[o]["position"]:
+                    for _k in unmatched_known_by_name.get("soup", []):
+                        if known_objects[_k]["position"] == objects[o]["position"]:
                             no_soup = False
                             if debug:
                                 print("        Soup at", objects[o]["position"], "already exists! From known", known_objects[_k])
@@ -1,4 +1,5 @@
 import copy, ast
+import env.server.visibility  # visibility masks shared with the game server
 
 # model imports
 import smm.models.predicates
@@ -24,6 +25,7 @@ class SMM:
 
         self.visibility_range = int(visibility[1:])
         self.belief_state = {}  # the belief state output by the SMM
+        self.snapshots = {}  # object ID to the last frozen snapshot of the object, reused while the object is unchanged
         self.agent_name = agent
         self.initialized = False
 
@@ -50,157 +52,167 @@ class SMM:
             layout = ast.literal_eval(f.read())
             self.init_belief_state(layout)
 
-    # gets the visible portion of a belief state
+    # gets the visible portion of a belief state, as frozen snapshots that must not be modified
+    #   snapshots of objects that have not changed since the last call are reused rather than copied again
     def get_visible_belief_state(self):
-        for k in self.belief_state["objects"]:
-            if not self.belief_state["objects"][k]["visible"]:
-                pass
-                # print("IGNORING", k, self.belief_state["objects"][k])
         visible_belief_state = {
             # return all agents, because agents are always visible
-            "agents": copy.deepcopy(self.belief_state["agents"]),
+            "agents": {
+                k : freeze_agent(self.belief_state["agents"][k]) for k in self.belief_state["agents"]
+            },
             # return objects that have a True "visible" property
-            "objects": {
-                k : copy.deepcopy(self.belief_state["objects"][k]) for k in self.belief_state["objects"] if self.belief_state["objects"][k]["visible"]
-            }
+            "objects": {}
         }
+        for k in self.belief_state["objects"]:
+            obj = self.belief_state["objects"][k]
+            if not obj["visible"]:
+                continue
+            snapshot = self.snapshots.get(k, None)
+            if snapshot is None or snapshot != obj:  # the object changed, so take a new snapshot
+                snapshot = freeze_object(obj)
+                self.snapshots[k] = snapshot
+            visible_belief_state["objects"][k] = snapshot
         return visible_belief_state
 
+    # sets the model's belief state to a copy of another belief state, e.g., a visible belief state of another SMM
+    #   frozen snapshots must be copied because the model modifies its belief state in place
+    #   copy: whether to copy the belief state, set to False to share a live belief state with another SMM
+    def set_belief_state(self, belief_state:dict, copy:bool=True):
+        self.model.domain_knowledge = thaw_belief_state(belief_state) if copy else belief_state
+        self.belief_state = self.model.domain_knowledge
+        self.snapshots = {}
+
     # updates the model by filtering state visibility and shunting over to the model
     #   from_log: dictionary from a log file, representing raw observations from the game
-    #   from_smm: dictionary from another SMM, representing a belief state\
+    #   from_smm: dictionary from another SMM, representing a belief state
+    #   the state is not modified, so frozen snapshots from other SMMs can be passed directly
     def update(self, state:dict, debug:bool=False)->None:
-        state = copy.deepcopy(state)  # deep copy the dict
         state = self.filter_visibility(state=state)  # remove features outside the user's visibility from the state
         self.belief_state = self.model.update(state=state, debug=debug)  # update the model
 
     # filter out objects and agents that are not immediately visible
+    #   returns a new state that shares the object dictionaries of the given state, the agents are shallow copies because the model sets what they hold
     def filter_visibility(self, state:dict):
         agent_position = state["agents"][self.agent_name]["position"] #if state_type == "log" else state["agents"]["A" + str(self.agent_name)]["position"]
         agent_orientation = state["agents"][self.agent_name]["facing"] #if state_type == "log" else state["agents"]["A" + str(self.agent_name)]["facing"]
 
+        filtered_state = dict(state)
+        filtered_state["agents"] = {a : dict(state["agents"][a]) for a in state["agents"]}
+        filtered_state["objects"] = {}
+
         # filter out objects
-        object_ids = [x for x in state["objects"]]
-        for o in object_ids: #if state_type == "log" else state["objects"]):
+        for o in state["objects"]: #if state_type == "log" else state["objects"]):
             dX = state["objects"][o]["position"][0] - agent_position[0] #if state_type == "log" else state["objects"][o]["position"][0] - agent_position[0]
             dY = state["objects"][o]["position"][1] - agent_position[1] #if state_type == "log" else state["objects"][o]["position"][1] - agent_position[1]
-            if not self.can_see(agent_orientation, dX, dY):
-                del state["objects"][o]
+            if self.can_see(agent_orientation, dX, dY):
+                filtered_state["objects"][o] = state["objects"][o]
 
         # filter out other agents
         if False:  # in this work we did not filter out other agents, as it was assumed an agent could reasonably hear where another agent would be located
-            agent_ids = [x for x in state["agents"]]
+            agent_ids = [x for x in filtered_state["agents"]]
             for a in agent_ids: #if state_type == "log" else state["agents"]):
-                dX = state["agents"][a]["position"][0] - agent_position[0] #if state_type == "log" else state["agents"][a]["position"][0] - agent_position[0]
-                dY = state["agents"][a]["position"][1] - agent_position[1] #if state_type == "log" else state["agents"][a]["position"][1] - agent_position[1]
+                dX = filtered_state["agents"][a]["position"][0] - agent_position[0] #if state_type == "log" else state["agents"][a]["position"][0] - agent_position[0]
+                dY = filtered_state["agents"][a]["position"][1] - agent_position[1] #if state_type == "log" else state["agents"][a]["position"][1] - agent_position[1]
                 if not self.can_see(agent_orientation, dX, dY):
-                    del state["agents"][a]
+                    del filtered_state["agents"][a]
 
-        return state
+        return filtered_state
 
-    # whether the agent can see the object given the object's dx and dy relative to the agent, this is copied from game.py
+    # whether the agent can see the object given the object's dx and dy relative to the agent, uses the same cached masks as game.py
     def can_see(self, agent_orientation, dX, dY):
-        # V visibility: agents sees everything in front of them with 90deg field of view (45deg angles)
-        if self.visibility_type == "V":
-            # agent facing right, ignore items to left of agent and beyond 45deg (dY > dX)
-            if agent_orientation == (1, 0) and (dX < 0 or abs(dY) > abs(dX) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing left, ignore items to right of agent and beyond 45deg (dY > dX)
-            if agent_orientation == (-1, 0) and (dX > 0 or abs(dY) > abs(dX) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing up, ignore items to down of agent and beyond 45deg (dX > dY)
-            if agent_orientation == (0, 1) and (dY < 0 or abs(dX) > abs(dY) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing down, ignore items to up of agent and beyond 45deg (dX > dY)
-            if agent_orientation == (0, -1) and (dY > 0 or abs(dX) > abs(dY) or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-
-        # D visibility: agents see everything in front of them to a radius
-        elif self.visibility_type == "D":
-            # agent facing right, ignore items to left of agent and where dist > max
-            if agent_orientation == (1, 0) and (dX < 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing left, ignore items to right of agent and where dist > max
-            if agent_orientation == (-1, 0) and (dX > 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing up, ignore items to down of agent and where dist > max
-            if agent_orientation == (0, 1) and (dY < 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-            # agent facing down, ignore items to up of agent and where dist > max
-            if agent_orientation == (0, -1) and (dY > 0 or dY * dY + dX * dX > self.visibility_range * self.visibility_range):
-                return False
-
-        # O visibility: agents see everything around them to a radius
-        elif self.visibility_type == "O":
-            # ignore items where dist > max
-            if dY * dY + dX * dX > self.visibility_range * self.visibility_range:
-                return False
-
-        return True
+        return env.server.visibility.MASKS.is_visible(self.visibility_type, self.visibility_range, agent_orientation, dX, dY)
 
     # converts an observed world state from the log files to the data structure used by the belief state modules
     def convert_log_to_state(self, log):
-        state = {
-            "agents": {},
-            "objects": {}
+        return convert_log_to_state(log)
+
+# converts an observed world state from the log files to the data structure used by the belief state modules
+def convert_log_to_state(log):
+    state = {
+        "agents": {},
+        "objects": {}
+    }
+
+    # get the object information
+    for i in range(len(log["state"]["objects"])):
+        object_id = "O" + str(i+1)
+        state["objects"][object_id] = {
+            "position": log["state"]["objects"][i]["position"],
+            "propertyOf": {
+                "name": log["state"]["objects"][i]["name"],
+            },
+            "visible": True,  # by default, model assumes objects are visible
+            "canUseWith": []  # by default, the model does not know what objects can be used with
         }
 
-        # get the object information
-        for i in range(len(log["state"]["objects"])):
-            object_id = "O" + str(i+1)
-            state["objects"][object_id] = {
-                "position": log["state"]["objects"][i]["position"],
+        # if the object has ingredients, set those
+        if "_ingredients" in log["state"]["objects"][i]:
+            state["objects"][object_id]["propertyOf"]["ingredients"] = []
+            for ingredient in log["state"]["objects"][i]["_ingredients"]:
+                state["objects"][object_id]["propertyOf"]["ingredients"].append({
+                    "position": ingredient["position"],
+                    "propertyOf": {
+                        "name": ingredient["name"]
+                    }
+                })
+            if log["state"]["objects"][i]["is_ready"] is None:
+                pass
+            state["objects"][object_id]["propertyOf"]["isReady"] = log["state"]["objects"][i]["is_ready"]
+            state["objects"][object_id]["propertyOf"]["isCooking"] = log["state"]["objects"][i]["is_cooking"]
+            if "is_idle" in log["state"]["objects"][i]:
+                state["objects"][object_id]["propertyOf"]["isIdle"] = log["state"]["objects"][i]["is_idle"]
+
+    # get the agent information
+    for i in range(len(log["state"]["players"])):
+        agent_id = "A" + str(i)
+        state["agents"][agent_id] = {
+            "position": log["state"]["players"][i]["position"],
+            "facing": log["state"]["players"][i]["orientation"],
+        }
+        # if the agent is holding an object, include it
+        if log["state"]["players"][i]["held_object"] is not None:
+            state["agents"][agent_id]["holding"] = {
+                "position": log["state"]["players"][i]["position"],
                 "propertyOf": {
-                    "name": log["state"]["objects"][i]["name"],
-                },
-                "visible": True,  # by default, model assumes objects are visible
-                "canUseWith": []  # by default, the model does not know what objects can be used with
+                    "name": log["state"]["players"][i]["held_object"]["name"],
+                    "holder": agent_id
+                }
             }
-
             # if the object has ingredients, set those
-            if "_ingredients" in log["state"]["objects"][i]:
-                state["objects"][object_id]["propertyOf"]["ingredients"] = []
-                for ingredient in log["state"]["objects"][i]["_ingredients"]:
-                    state["objects"][object_id]["propertyOf"]["ingredients"].append({
+            if "_ingredients" in log["state"]["players"][i]["held_object"]:
+                state["agents"][agent_id]["holding"]["propertyOf"]["ingredients"] = []
+                for ingredient in log["state"]["players"][i]["held_object"]["_ingredients"]:
+                    state["agents"][agent_id]["holding"]["propertyOf"]["ingredients"].append({
                         "position": ingredient["position"],
                         "propertyOf": {
                             "name": ingredient["name"]
                         }
                     })
-                if log["state"]["objects"][i]["is_ready"] is None:
-                    pass
-                state["objects"][object_id]["propertyOf"]["isReady"] = log["state"]["objects"][i]["is_ready"]
-                state["objects"][object_id]["propertyOf"]["isCooking"] = log["state"]["objects"][i]["is_cooking"]
-                if "is_idle" in log["state"]["objects"][i]:
-                    state["objects"][object_id]["propertyOf"]["isIdle"] = log["state"]["objects"][i]["is_idle"]
-
-        # get the agent information
-        for i in range(len(log["state"]["players"])):
-            agent_id = "A" + str(i)
-            state["agents"][agent_id] = {
-                "position": log["state"]["players"][i]["position"],
-                "facing": log["state"]["players"][i]["orientation"],
-            }
-            # if the agent is holding an object, include it
-            if log["state"]["players"][i]["held_object"] is not None:
-                state["agents"][agent_id]["holding"] = {
-                    "position": log["state"]["players"][i]["position"],
-                    "propertyOf": {
-                        "name": log["state"]["players"][i]["held_object"]["name"],
-                        "holder": agent_id
-                    }
-                }
-                # if the object has ingredients, set those
-                if "_ingredients" in log["state"]["players"][i]["held_object"]:
-                    state["agents"][agent_id]["holding"]["propertyOf"]["ingredients"] = []
-                    for ingredient in log["state"]["players"][i]["held_object"]["_ingredients"]:
-                        state["agents"][agent_id]["holding"]["propertyOf"]["ingredients"].append({
-                            "position": ingredient["position"],
-                            "propertyOf": {
-                                "name": ingredient["name"]
-                            }
-                        })
-            else:
-                state["agents"][agent_id]["holding"] = None
-
-        return state
+        else:
+            state["agents"][agent_id]["holding"] = None
+
+    return state
+
+# takes a frozen snapshot of a belief state object, copying the containers the model modifies in place
+#   the remaining values (positions, ingredient lists, held objects) are replaced rather than modified by the model, so they are shared
+def freeze_object(obj:dict)->dict:
+    snapshot = dict(obj)
+    snapshot["propertyOf"] = dict(obj["propertyOf"])
+    if "canUseWith" in obj:
+        snapshot["canUseWith"] = dict(obj["canUseWith"])
+    if "contains" in obj:
+        snapshot["contains"] = list(obj["contains"])
+    return snapshot
+
+# takes a frozen snapshot of a belief state agent
+def freeze_agent(agent:dict)->dict:
+    snapshot = dict(agent)
+    if "capableOf" in agent:
+        snapshot["capableOf"] = list(agent["capableOf"])
+    if "perceivable" in agent:
+        snapshot["perceivable"] = dict(agent["perceivable"])
+    return snapshot
+
+# copies a frozen belief state so it can be modified, e.g., to seed a model with another model's belief state
+def thaw_belief_state(belief_state:dict)->dict:
+    return copy.deepcopy(belief_state)